@@ -0,0 +1,167 @@
+# ace_framework/ann_index.py
+
+import numpy as np
+
+
+class IVFIndex:
+    """
+    目的：NumPyのみで実装した転置ファイル（IVF）型の近似最近傍インデックス。
+
+    ベクトルは正規化済みである前提で、内積（コサイン類似度）で検索します。
+    train_size件たまるまでは全件検索を行い、それ以降は球面k-meansで求めた
+    n_lists個のセントロイドのうちnprobe個のリストだけを走査します。
+    nprobeを大きくするほど再現率が上がり、レイテンシも増えます。
+    """
+    def __init__(self, n_lists=64, nprobe=8, train_size=None, n_iter=10, seed=0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.train_size = train_size or n_lists * 39
+        self.n_iter = n_iter
+        self.seed = seed
+        self.reset()
+
+    def reset(self):
+        self._centroids = None
+        self._list_labels = []
+        self._list_vectors = []
+        self._buffer_labels = np.empty(0, dtype=np.int64)
+        self._buffer_vectors = None
+        self._list_of = {}  # ラベル -> リスト番号 (-1は学習前バッファ)
+
+    def __len__(self):
+        return len(self._list_of)
+
+    def add(self, labels, vectors):
+        labels = np.asarray(labels, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(labels), -1)
+        # 既存ラベルは更新として扱う
+        self.remove([label for label in labels.tolist() if label in self._list_of])
+        if self._centroids is None:
+            if self._buffer_vectors is None:
+                self._buffer_vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+            self._buffer_labels = np.concatenate([self._buffer_labels, labels])
+            self._buffer_vectors = np.concatenate([self._buffer_vectors, vectors])
+            self._list_of.update((label, -1) for label in labels.tolist())
+            if len(self._buffer_labels) >= self.train_size:
+                self._train()
+            return
+        self._assign(labels, vectors)
+
+    def remove(self, labels):
+        by_list = {}
+        for label in labels:
+            list_id = self._list_of.pop(int(label), None)
+            if list_id is not None:
+                by_list.setdefault(list_id, []).append(int(label))
+        for list_id, removed in by_list.items():
+            if list_id == -1:
+                keep = ~np.isin(self._buffer_labels, removed)
+                self._buffer_labels = self._buffer_labels[keep]
+                self._buffer_vectors = self._buffer_vectors[keep]
+            else:
+                keep = ~np.isin(self._list_labels[list_id], removed)
+                self._list_labels[list_id] = self._list_labels[list_id][keep]
+                self._list_vectors[list_id] = self._list_vectors[list_id][keep]
+
+    def search(self, query, k):
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if self._centroids is None:
+            if not len(self._buffer_labels):
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            return _top_k(self._buffer_labels, self._buffer_vectors @ query, k)
+        probe = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        labels = [self._list_labels[i] for i in probe]
+        scores = [self._list_vectors[i] @ query for i in probe]
+        return _top_k(np.concatenate(labels), np.concatenate(scores), k)
+
+    def _train(self):
+        vectors = self._buffer_vectors
+        rng = np.random.default_rng(self.seed)
+        n_lists = min(self.n_lists, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            for i in range(n_lists):
+                members = vectors[assignment == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._list_labels = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self._list_vectors = [np.empty((0, vectors.shape[1]), dtype=np.float32) for _ in range(n_lists)]
+        labels = self._buffer_labels
+        self._buffer_labels = np.empty(0, dtype=np.int64)
+        self._buffer_vectors = None
+        self._assign(labels, vectors)
+
+    def _assign(self, labels, vectors):
+        assignment = np.argmax(vectors @ self._centroids.T, axis=1)
+        for list_id in np.unique(assignment).tolist():
+            members = assignment == list_id
+            self._list_labels[list_id] = np.concatenate([self._list_labels[list_id], labels[members]])
+            self._list_vectors[list_id] = np.concatenate([self._list_vectors[list_id], vectors[members]])
+        self._list_of.update(zip(labels.tolist(), assignment.tolist()))
+
+
+class HNSWIndex:
+    """
+    目的：hnswlibによるHNSWグラフ型の近似最近傍インデックス。
+
+    ef_searchを大きくするほど再現率が上がり、レイテンシも増えます。
+    hnswlibはオプション依存のため、最初のadd時に読み込みます。
+    """
+    def __init__(self, M=16, ef_construction=200, ef_search=64, initial_capacity=1024):
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.initial_capacity = initial_capacity
+        self.reset()
+
+    def reset(self):
+        self._index = None
+        self._labels = set()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def add(self, labels, vectors):
+        labels = np.asarray(labels, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(labels), -1)
+        if self._index is None:
+            try:
+                import hnswlib
+            except ImportError as e:
+                raise ImportError("HNSWIndex requires hnswlib. Install it with `pip install hnswlib`.") from e
+            self._index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            self._index.init_index(max_elements=self.initial_capacity, ef_construction=self.ef_construction, M=self.M)
+        required = self._index.get_current_count() + len(labels)
+        if required > self._index.get_max_elements():
+            self._index.resize_index(max(required, self._index.get_max_elements() * 2))
+        # 削除済みラベルを再追加すると削除マークが外れて上書きされる
+        self._index.add_items(vectors, labels)
+        self._labels.update(labels.tolist())
+
+    def remove(self, labels):
+        for label in labels:
+            label = int(label)
+            if label in self._labels:
+                self._index.mark_deleted(label)
+                self._labels.discard(label)
+
+    def search(self, query, k):
+        k = min(k, len(self._labels))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        self._index.set_ef(max(self.ef_search, k))
+        labels, distances = self._index.knn_query(np.asarray(query, dtype=np.float32).reshape(1, -1), k=k)
+        # "ip"空間の距離は 1 - 内積
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+
+def _top_k(labels, scores, k):
+    k = min(k, len(labels))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return labels[top], scores[top]
@@ -1,42 +1,550 @@
 # ace_framework/context_store.py
 
-import torch
-from sentence_transformers import SentenceTransformer
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(vectors):
+    """行ベクトルをL2正規化する（ゼロベクトルはそのまま）。"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ContextSnapshot:
+    """
+    ある版（version）のコンテキストストアの不変なビュー。ロックを取らずに読み取れます。
+
+    ストアの配列や行列をコピーせずに参照し、各スロットに記録された埋め込み・削除の版と
+    自身の版を比較して、その版の時点で有効だったスロットだけを見ます。書き込み側は
+    既存の行を書き換えず（追加は末尾、削除は版の記録のみ）、詰め直しや拡張では新しい
+    配列を確保するため、取得済みのスナップショットの内容は後の更新の影響を受けません。
+    メタデータを差し替えた項目は、スロットごとの差し替え履歴から自身の版以前のものを選びます。
+    """
+    def __init__(self, version, cycle, size, n, items, replaced, matrix, embedded_version, removed_version):
+        self.version = version
+        self.cycle = cycle
+        self._size = size
+        self._n = n
+        self._items = items
+        self._replaced = replaced
+        self._matrix = matrix
+        self._embedded_version = embedded_version
+        self._removed_version = removed_version
+        self._masks = None
+
+    def __len__(self):
+        return self._size
+
+    def _item(self, slot):
+        """この版の時点でスロットに入っていた項目。"""
+        entry = self._replaced.get(slot)
+        # 差し替え履歴は (版, 項目, 1つ前の履歴) の連鎖で、新しいものが先頭
+        while entry is not None and entry[0] > self.version:
+            entry = entry[2]
+        return self._items[slot] if entry is None else entry[1]
+
+    def _visible(self):
+        """(有効なスロット, 埋め込みのある有効なスロット) のマスク。初回に計算して保持する。"""
+        if self._masks is None:
+            removed = self._removed_version[:self._n]
+            live = (removed == 0) | (removed > self.version)
+            embedded = self._embedded_version[:self._n]
+            self._masks = (live, live & (embedded > 0) & (embedded <= self.version))
+        return self._masks
+
+    @property
+    def context(self):
+        live, _ = self._visible()
+        return [self._item(slot) for slot in np.flatnonzero(live).tolist()]
+
+    def search(self, query_embedding, top_k):
+        """上位top_k件の項目を全件検索で返す。使用状況カウンタは更新しない（ContextStore.record_hitsを使う）。"""
+        if self._matrix is None or not self._n:
+            return []
+        _, embedded = self._visible()
+        k = min(top_k, int(embedded.sum()))
+        if k <= 0:
+            return []
+        query_vector = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        # 読み取り専用で開いたストアでは、行列に行の無い（埋め込み前の）スロットが末尾にありうる
+        n = min(self._n, len(self._matrix))
+        scores = (self._matrix[:n] @ query_vector.astype(self._matrix.dtype)).astype(np.float32)
+        scores[~embedded[:n]] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self._item(i) for i in top.tolist()]
+
 
 class ContextStore:
     """
     目的： 進化型コンテキストを構成する「項目」のコレクションを管理します。
+
+    埋め込みは項目ごとのリストではなく、正規化済みの連続した行列（float32、
+    または省メモリ用のfloat16）に保持します。スロットiの項目は常に行列の行iに
+    対応するため、検索は行列積1回とtop-k選択で完結します。削除されたスロットは
+    トゥームストーンとして無効化され、一定数たまった時点で詰め直されます。
+
+    indexに近似最近傍インデックス（ann_index.IVFIndex / HNSWIndexなど）を渡すと、
+    項目数がexact_search_thresholdを超えた時点で近似検索に切り替わります。
+    インデックスのラベルはスロット番号で、追加・削除は逐次反映されます。
+
+    各スロットには検索ヒット数・最終使用サイクル・helpful/harmful数の使用状況
+    カウンタを行列と同じ並びの配列で保持し、検索時にはヒットした行だけを更新します。
+
+    更新（項目の追加・削除・埋め込みの書き込み）はlock（再入可能ロック）を取って行い、
+    1回の更新ごとに新しい版のContextSnapshotを公開します。snapshot()で取得した
+    スナップショットはロック無しで読み取れるため、プロセス全体で1つのストアを
+    複数のセッションから共有できます。apply_delta()は差分だけを1つの版として適用し、
+    既存の項目には触れないので、コストは差分の大きさに比例します。項目のメタデータも
+    その場では書き換えず、replace_metadata()で新しい項目辞書に差し替えます。
+    ストアに対する検索（search / nearest）を直接行う場合は、lockで囲んでください。
     """
-    def __init__(self):
-        self.context = []
+    # 更新がそのままディスクに保存されるか（チェックポイントに内容を含める必要がないか）
+    persistent = False
+    # スロットと同じ並びで保持する使用状況などの配列
+    _SLOT_ARRAYS = {
+        "_is_live": bool,
+        "_has_embedding": bool,
+        "_hits": np.int64,
+        "_last_used": np.int64,
+        "_helpful": np.int64,
+        "_harmful": np.int64,
+        # スナップショット用：埋め込みを書き込んだ版と削除した版（0は未設定）
+        "_embedded_version": np.int64,
+        "_removed_version": np.int64,
+    }
+    def __init__(self, dtype=np.float32, initial_capacity=64, index=None, exact_search_threshold=10000):
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.index = index
+        self.exact_search_threshold = exact_search_threshold
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._bullets = []          # スロット -> 項目 (削除済みはNone)
+        self._slot_items = []       # スナップショット用の追記専用リスト (削除済みも残す)
+        self._replaced = {}         # スロット -> メタデータの差し替え履歴 (スナップショット用)
+        self._num_replaced = 0
+        self._slot_of = {}          # id(項目) -> スロット
+        self._slot_of_content = {}  # 本文 -> スロット (重複確認用)
+        self._matrix = None         # (capacity, dim) の正規化済み埋め込み
+        for name, dtype in self._SLOT_ARRAYS.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self._num_live = 0
+        self._num_embedded = 0
+        self._content_bytes = 0
+        self.cycle = 0
+        self._pending_hits = deque()
+        self._write_depth = 0
+        self.version = 0
+        self._snapshot = self._make_snapshot()
+
+    def __len__(self):
+        return self._num_live
+
+    def snapshot(self):
+        """現在公開されている版のスナップショットを返す（ロック不要）。"""
+        return self._snapshot
+
+    def _make_snapshot(self):
+        n = len(self._bullets)
+        return ContextSnapshot(
+            self.version, self.cycle, self._num_live, n, self._slot_items, self._replaced, self._matrix,
+            self._embedded_version, self._removed_version,
+        )
+
+    def _publish(self):
+        self.version += 1
+        self._snapshot = self._make_snapshot()
+
+    @contextmanager
+    def _writing(self):
+        """書き込みロックを取り、最も外側の更新が終わった時点で新しい版を公開する。"""
+        with self.lock:
+            self._write_depth += 1
+            try:
+                if self._write_depth == 1:
+                    self._drain_hits()
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._publish()
+
+    def has_content(self, content):
+        return content in self._slot_of_content
+
+    def apply_delta(self, added=(), removed=()):
+        """
+        項目の削除と追加を1つの版としてまとめて適用する。既存の項目には触れないため、
+        コストは差分の大きさに比例する（トゥームストーンの詰め直しが起きた場合を除く）。
+        """
+        with self._writing():
+            self.remove_bullets(removed)
+            self.add_bullets(added)
+    @property
+    def context(self):
+        return [item for item in self._bullets if item is not None]
+
+    @context.setter
+    def context(self, items):
+        # 既存の項目は行を維持し、差分（追加・削除）だけを行列に反映する
+        with self._writing():
+            keep = set()
+            new_items = []
+            for item in items:
+                slot = self._slot_of.get(id(item))
+                if slot is None:
+                    new_items.append(item)
+                else:
+                    keep.add(slot)
+            removed = [slot for slot, item in enumerate(self._bullets) if item is not None and slot not in keep]
+            self._remove_slots(removed)
+            self.add_bullets(new_items)
 
     def add_bullet(self, bullet_content, embedding=None, metadata=None):
         if metadata is None: metadata = {}
         bullet = {"content": bullet_content, "embedding": embedding, "metadata": metadata}
-        print(f"Adding bullet: {bullet['content']}")
-        self.context.append(bullet)
+        logger.debug("Adding bullet: %s", bullet['content'])
+        self.add_bullets([bullet])
+
+    def add_bullets(self, items):
+        """
+        項目のリストを末尾のスロットに追加する。項目が "embedding" を持つ場合は
+        行列に書き込み、項目の辞書からは取り除く。
+        """
+        items = [item for item in items if id(item) not in self._slot_of]
+        if not items:
+            return
+        with self._writing():
+            start = len(self._bullets)
+            self._ensure_capacity(start + len(items))
+            embedded_slots, vectors = [], []
+            for offset, item in enumerate(items):
+                item.setdefault("metadata", {})
+                embedding = item.pop("embedding", None)
+                self._bullets.append(item)
+                self._slot_items.append(item)
+                self._slot_of[id(item)] = start + offset
+                self._slot_of_content.setdefault(item.get("content"), start + offset)
+                self._content_bytes += len(item.get("content", "").encode("utf-8"))
+                if embedding is not None:
+                    embedded_slots.append(start + offset)
+                    vectors.append(np.asarray(embedding, dtype=np.float32))
+            self._num_live += len(items)
+            self._is_live[start:start + len(items)] = True
+            self._last_used[start:start + len(items)] = self.cycle
+            if vectors:
+                self._write_rows(embedded_slots, np.stack(vectors))
 
-    def retrieve_bullets(self, query, top_k, embedding_model):
-        print(f"Retrieving top {top_k} bullets for query: '{query}'")
-        if not self.context or query is None:
+    def remove_bullets(self, items):
+        slots = [self._slot_of[id(item)] for item in items if id(item) in self._slot_of]
+        if slots:
+            with self._writing():
+                self._remove_slots(slots)
+
+    def get_embedding(self, item):
+        """項目の正規化済み埋め込みを返す（未生成ならNone）。"""
+        slot = self._slot_of.get(id(item))
+        if slot is None or not self._has_embedding[slot]:
+            return None
+        return np.array(self._matrix[slot], dtype=np.float32)
+
+    def retrieve_bullets(self, query, top_k, embedding_model, exact=None):
+        logger.debug("Retrieving top %d bullets for query: '%s'", top_k, query)
+        if not self._num_embedded or query is None:
             return []
 
-        query_embedding = embedding_model.encode(query, convert_to_tensor=True)
-        # Move item embeddings to the same device as the query embedding
-        item_embeddings = torch.stack([torch.tensor(item["embedding"]).to(query_embedding.device) for item in self.context if item.get("embedding") is not None])
+        query_embedding = np.asarray(embedding_model.encode(query), dtype=np.float32)
+        return self.search(query_embedding, top_k, exact=exact)
 
-        if item_embeddings.nelement() == 0: # Check if tensor is empty
+    def search(self, query_embedding, top_k, exact=None):
+        """
+        上位top_k件の項目を返す。exact=Trueで常に全件検索、Falseでインデックスが
+        あれば常に近似検索、Noneなら項目数に応じて自動で選択する。
+        """
+        k = min(top_k, self._num_embedded)
+        if k <= 0:
             return []
+        query_vector = _normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        if exact is None:
+            exact = self._num_embedded <= self.exact_search_threshold
+        if self.index is not None and not exact:
+            labels, _ = self.index.search(query_vector, k)
+            top = np.array([label for label in labels.tolist() if self._bullets[label] is not None], dtype=np.int64)
+        else:
+            n = len(self._bullets)
+            scores = (self._matrix[:n] @ query_vector.astype(self.dtype)).astype(np.float32)
+            # 埋め込みの無いスロットや削除済みスロットは候補から除外する
+            scores[~self._has_embedding[:n]] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        # 使用状況はヒットしたk行だけを更新する
+        self._count_hits(top)
+        return [self._bullets[i] for i in top]
+
+    def _count_hits(self, slots):
+        self._hits[slots] += 1
+        self._last_used[slots] = self.cycle
 
-        # コサイン類似度を計算
-        cos_scores = torch.nn.functional.cosine_similarity(query_embedding, item_embeddings)
-        top_results = torch.topk(cos_scores, k=min(top_k, len(self.context)))
+    def record_hits(self, items):
+        """
+        スナップショットの検索でヒットした項目の使用状況を記録する。ロックが空いていれば
+        すぐに反映し、更新中なら次の書き込みの開始時に反映する（読み手を待たせない）。
+        """
+        self._pending_hits.append(list(items))
+        if self.lock.acquire(blocking=False):
+            try:
+                self._drain_hits()
+            finally:
+                self.lock.release()
 
-        return [self.context[i] for i in top_results.indices]
+    def _drain_hits(self):
+        while self._pending_hits:
+            items = self._pending_hits.popleft()
+            slots = self._slots_of(items)
+            if slots:
+                self._count_hits(np.asarray(slots, dtype=np.int64))
+
+    def nearest(self, vectors, exact=None):
+        """
+        各ベクトルに最も近い項目とそのコサイン類似度を返す（項目が無ければ(None, -inf)）。
+        全件検索の場合も (len(vectors), n) の行列積1回で計算する。
+        """
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        if not self._num_embedded:
+            return [(None, float("-inf"))] * len(vectors)
+        if exact is None:
+            exact = self._num_embedded <= self.exact_search_threshold
+        if self.index is not None and not exact:
+            results = []
+            for vector in vectors:
+                labels, scores = self.index.search(vector, 1)
+                results.append((self._bullets[labels[0]], float(scores[0])) if len(labels) else (None, float("-inf")))
+            return results
+        n = len(self._bullets)
+        scores = (vectors.astype(self.dtype) @ self._matrix[:n].T).astype(np.float32)
+        scores[:, ~self._has_embedding[:n]] = -np.inf
+        best = np.argmax(scores, axis=1)
+        return [(self._bullets[slot], float(scores[i, slot])) for i, slot in enumerate(best.tolist())]
+
+    def advance_cycle(self):
+        """適応サイクルを1つ進める（LRUや減衰の基準となる時刻）。"""
+        with self.lock:
+            self.cycle += 1
+
+    def record_feedback(self, items, helpful):
+        """リフレクターがhelpful/harmfulと判定した項目のカウンタを加算する。"""
+        with self.lock:
+            slots = self._slots_of(items)
+            if slots:
+                counter = self._helpful if helpful else self._harmful
+                np.add.at(counter, slots, 1)
+
+    def usage(self, item):
+        """項目の使用状況カウンタを辞書で返す。"""
+        slot = self._slot_of[id(item)]
+        return {
+            "hits": int(self._hits[slot]),
+            "last_used": int(self._last_used[slot]),
+            "helpful": int(self._helpful[slot]),
+            "harmful": int(self._harmful[slot]),
+        }
+
+    def restore_usage(self, usages, cycle):
+        """(項目, usage()の形式の辞書) の組ごとにカウンタを設定し、サイクルを戻す（チェックポイントからの再開用）。"""
+        with self._writing():
+            for item, usage in usages:
+                slot = self._slot_of.get(id(item))
+                if slot is not None:
+                    for name, value in usage.items():
+                        getattr(self, f"_{name}")[slot] = value
+            self.cycle = cycle
+
+    def select_evictions(self, count, policy):
+        """policyのスコアが低い順にcount件の項目を選ぶ（全スロットをベクトル演算で評価）。"""
+        if count <= 0 or not self._num_live:
+            return []
+        n = len(self._bullets)
+        scores = np.asarray(policy.scores(self._hits[:n], self._last_used[:n], self._helpful[:n], self._harmful[:n], self.cycle), dtype=np.float64)
+        scores[~self._is_live[:n]] = np.inf
+        count = min(count, self._num_live)
+        victims = np.argpartition(scores, count - 1)[:count]
+        return [self._bullets[slot] for slot in victims.tolist()]
+
+    def estimated_bullet_bytes(self):
+        """1項目あたりの概算メモリ使用量（埋め込み行 + 本文 + カウンタ）。"""
+        row_bytes = self._matrix.shape[1] * self.dtype.itemsize if self._matrix is not None else 0
+        counter_bytes = sum(np.dtype(dtype).itemsize for dtype in self._SLOT_ARRAYS.values())
+        return row_bytes + counter_bytes + self._content_bytes / max(self._num_live, 1)
+
+    def replace_metadata(self, updates):
+        """
+        (項目, 新しいメタデータ) の組ごとに、メタデータを差し替えた新しい項目辞書をスロットに入れ、
+        1つの版として公開する。既存の項目辞書は書き換えないので、公開済みのスナップショットは
+        差し替え前の項目を見続ける。戻り値は差し替えた新しい項目のリスト。
+        """
+        updates = [(self._slot_of[id(item)], item, metadata) for item, metadata in updates if id(item) in self._slot_of]
+        if not updates:
+            return []
+        replaced = []
+        with self._writing():
+            # スナップショットが参照しているリストは書き換えず、公開する版とともに差し替え履歴に積む
+            # （コストは差し替える項目数に比例する）
+            version = self.version + 1
+            for slot, item, metadata in updates:
+                new_item = {**item, "metadata": metadata}
+                del self._slot_of[id(item)]
+                self._slot_of[id(new_item)] = slot
+                self._bullets[slot] = new_item
+                self._replaced[slot] = (version, new_item, self._replaced.get(slot))
+                replaced.append(new_item)
+            self._num_replaced += len(updates)
+            if self._num_replaced > max(self.initial_capacity, len(self._slot_items)):
+                # 履歴が項目数を超えたら現在の項目で新しいリストを作る（償却すると1件あたり定数）
+                self._fold_replaced()
+        return replaced
+
+    def _fold_replaced(self):
+        """差し替え履歴を畳み込んだ新しいリストに切り替える。公開済みのスナップショットは古いものを参照し続ける。"""
+        self._slot_items = [item if item is not None else self._slot_items[slot] for slot, item in enumerate(self._bullets)]
+        self._replaced = {}
+        self._num_replaced = 0
+
+    def _slots_of(self, items):
+        """
+        項目のスロット番号のリスト（ストアに無い項目は除く）。古い版のスナップショットから
+        得た、メタデータの差し替え前の項目は本文で現在のスロットに対応づける。
+        """
+        slots = []
+        for item in items:
+            slot = self._slot_of.get(id(item))
+            if slot is None:
+                slot = self._slot_of_content.get(item.get("content"))
+            if slot is not None:
+                slots.append(slot)
+        return slots
+
+    def flush(self):
+        """未保存の変更を書き出す（永続化用のフック）。"""
+        pass
 
     def generate_and_store_embeddings(self, embedding_model):
-        print("Generating and storing embeddings for context items...")
-        for item in self.context:
-            if item.get("content") and item.get("embedding") is None:
-                item["embedding"] = embedding_model.encode(item["content"]).tolist() # Store as list for easier serialization
-        print("Finished generating and storing embeddings.")
+        n = len(self._bullets)
+        # 全項目を走査せず、埋め込みの無い生きたスロットだけをベクトル演算で拾う
+        slots = [
+            slot for slot in np.flatnonzero(self._is_live[:n] & ~self._has_embedding[:n]).tolist()
+            if self._bullets[slot].get("content")
+        ]
+        if slots:
+            # 1項目ずつではなくまとめてエンコードする
+            with self._writing(), tracer.span("embedding", kind="bullets", count=len(slots)):
+                vectors = embedding_model.encode([self._bullets[slot]["content"] for slot in slots])
+                self._write_rows(slots, np.asarray(vectors, dtype=np.float32))
+            logger.debug("Generated embeddings for %d context items.", len(slots))
+
+    def _ensure_capacity(self, required, dim=None):
+        capacity = len(self._has_embedding)
+        if required > capacity:
+            new_capacity = max(self.initial_capacity, capacity * 2, required)
+            for name, dtype in self._SLOT_ARRAYS.items():
+                array = np.zeros(new_capacity, dtype=dtype)
+                array[:capacity] = getattr(self, name)
+                setattr(self, name, array)
+            capacity = new_capacity
+        if dim is not None and self._matrix is None:
+            self._matrix = self._resize_matrix(capacity, dim)
+        elif self._matrix is not None and len(self._matrix) < capacity:
+            self._matrix = self._resize_matrix(capacity, self._matrix.shape[1])
+
+    def _resize_matrix(self, capacity, dim):
+        """capacity行の行列を確保し、既存の行をコピーして返す。"""
+        matrix = np.zeros((capacity, dim), dtype=self.dtype)
+        if self._matrix is not None:
+            matrix[:len(self._matrix)] = self._matrix
+        return matrix
+
+    def _compacted_matrix(self, live):
+        """生きている行（live）を先頭に詰めた新しい行列を返す。"""
+        matrix = np.zeros_like(self._matrix)
+        matrix[:len(live)] = self._matrix[live]
+        return matrix
+
+    def _write_rows(self, slots, vectors):
+        vectors = vectors.reshape(len(slots), -1)
+        if self._matrix is not None and vectors.shape[1] != self._matrix.shape[1]:
+            raise ValueError(f"Embedding dimension mismatch: expected {self._matrix.shape[1]}, got {vectors.shape[1]}")
+        self._ensure_capacity(len(self._bullets), dim=vectors.shape[1])
+        slots = np.asarray(slots, dtype=np.int64)
+        newly_embedded = slots[~self._has_embedding[slots]]
+        self._num_embedded += len(newly_embedded)
+        self._matrix[slots] = _normalize_rows(vectors).astype(self.dtype)
+        self._has_embedding[slots] = True
+        # 行を書き終えてから版を記録するので、読み手が書き込み途中の行を見ることはない
+        self._embedded_version[newly_embedded] = self.version + 1
+        if self.index is not None:
+            self.index.add(slots, self._matrix[slots].astype(np.float32))
+
+    def _remove_slots(self, slots):
+        if not slots:
+            return
+        if self.index is not None:
+            self.index.remove(slots)
+        for slot in slots:
+            item = self._bullets[slot]
+            if item is None:
+                continue
+            del self._slot_of[id(item)]
+            if self._slot_of_content.get(item.get("content")) == slot:
+                del self._slot_of_content[item.get("content")]
+            self._bullets[slot] = None
+            self._is_live[slot] = False
+            self._removed_version[slot] = self.version + 1
+            self._num_live -= 1
+            self._content_bytes -= len(item.get("content", "").encode("utf-8"))
+            if self._has_embedding[slot]:
+                self._has_embedding[slot] = False
+                self._num_embedded -= 1
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self._bullets) - self._num_live > max(self.initial_capacity, len(self._bullets) // 2):
+            self._compact()
+
+    def _compact(self):
+        """
+        トゥームストーンを取り除き、生きているスロットを行列の先頭に詰め直す。
+        公開済みのスナップショットが古い配列を参照し続けられるよう、書き換えずに新しく確保する。
+        """
+        live = np.array([slot for slot, item in enumerate(self._bullets) if item is not None], dtype=np.int64)
+        self._bullets = [self._bullets[slot] for slot in live]
+        self._slot_items = list(self._bullets)
+        self._replaced = {}
+        self._num_replaced = 0
+        self._slot_of = {id(item): slot for slot, item in enumerate(self._bullets)}
+        self._slot_of_content = {}
+        for slot, item in enumerate(self._bullets):
+            self._slot_of_content.setdefault(item.get("content"), slot)
+        count = len(live)
+        for name, dtype in self._SLOT_ARRAYS.items():
+            array = np.zeros(len(getattr(self, name)), dtype=dtype)
+            array[:count] = getattr(self, name)[live]
+            setattr(self, name, array)
+        if self._matrix is not None:
+            self._matrix = self._compacted_matrix(live)
+        if self.index is not None:
+            # スロット番号が変わるため、インデックスを作り直す
+            self.index.reset()
+            embedded = np.flatnonzero(self._has_embedding[:count])
+            if len(embedded):
+                self.index.add(embedded, self._matrix[embedded].astype(np.float32))
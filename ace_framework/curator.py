@@ -1,42 +1,149 @@
 # ace_framework/curator.py
 
+import logging
+
+import numpy as np
+
+from .eviction import ScoreDecayPolicy
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
 class Curator:
     """
     目的：リフレクターの洞察をメインコンテキストに統合し、その構造を維持し、冗長性を防ぎます。
+
+    similarity_threshold以上のコサイン類似度を持つ項目は意味的な重複とみなします。
+    max_bullets（項目数）またはmax_memory_bytes（概算メモリ量）を超えた場合は、
+    eviction_policy（既定はScoreDecayPolicy）のスコアが低い項目から追い出します。
     """
-    def __init__(self, client=None, model_name=None):
+    def __init__(self, client=None, model_name=None, similarity_threshold=0.9, max_bullets=None, max_memory_bytes=None, eviction_policy=None):
         self.client = client
         self.model_name = model_name
+        self.similarity_threshold = similarity_threshold
+        self.max_bullets = max_bullets
+        self.max_memory_bytes = max_memory_bytes
+        self.eviction_policy = eviction_policy or ScoreDecayPolicy()
 
     def synthesize_delta(self, delta_entries, existing_context):
-        print(f"Synthesizing delta from {len(delta_entries)} entries...")
+        logger.debug("Synthesizing delta from %d entries...", len(delta_entries))
         # 本格的な実装では、ここでデルタを既存コンテキストと照合・合成
         return delta_entries
 
     def merge_context(self, existing_context, delta_entries):
-        print("Merging context...")
         new_context = existing_context.copy()
         existing_content = {item['content'] for item in existing_context}
         for entry in delta_entries:
             if entry['content'] not in existing_content:
                 new_context.append(entry)
                 existing_content.add(entry['content'])
+        added = len(new_context) - len(existing_context)
+        tracer.add("bullets_added", added)
+        logger.debug("Merged %d new bullets into context.", added)
         return new_context
 
-    def perform_deduplication(self, context):
-        print("Performing deduplication...")
-        # 本格的な実装では、埋め込みの類似度に基づいて重複を削除します
-        # 現在は簡易的にcontentの重複を削除
-        seen = set()
-        deduplicated = []
-        for item in context:
-            if item['content'] not in seen:
-                deduplicated.append(item)
-                seen.add(item['content'])
-        return deduplicated
-
-    def prune_context(self, context):
-        print("Pruning context...")
-        # 本格的な実装では、関連性や使用頻度に基づいて項目を削除します
-        # 現在は簡易的に項目数を制限しない
-        return context
+    def perform_deduplication(self, entries, context_store=None, embedding_model=None):
+        """
+        デルタ項目の重複を除去し、新規に追加すべき項目だけを返す。
+
+        context_storeとembedding_modelが与えられた場合は、デルタをまとめて埋め込み、
+        ストアの埋め込み行列との類似度（デルタ数 × 項目数の行列積）で近似重複を検出する。
+        重複した項目は捨てずに、既存項目のメタデータ（出現回数・出典）へ統合する。
+        返す項目には計算済みの "embedding" が付与されるため、再エンコードは不要。
+        """
+        if context_store is None or embedding_model is None or not entries:
+            seen = set()
+            deduplicated = []
+            for item in entries:
+                if item['content'] not in seen:
+                    deduplicated.append(item)
+                    seen.add(item['content'])
+            tracer.add("bullets_deduped", len(entries) - len(deduplicated))
+            return deduplicated
+
+        vectors = np.asarray(embedding_model.encode([item['content'] for item in entries]), dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        matches = context_store.nearest(vectors)
+
+        fresh, fresh_vectors, merged = [], [], {}
+        for item, vector, (match, score) in zip(entries, vectors, matches):
+            if match is not None and score >= self.similarity_threshold:
+                # ストアの項目はスナップショットと共有されているので書き換えず、
+                # 統合したメタデータを集めてからまとめて差し替える
+                _, metadata = merged.get(id(match), (match, match.get('metadata', {})))
+                merged[id(match)] = (match, self._merge_metadata(metadata, item.get('metadata', {})))
+                continue
+            # 同じデルタ内の近似重複（デルタは小さいので逐次比較で十分）
+            if fresh_vectors:
+                similarities = np.stack(fresh_vectors) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    fresh[best]['metadata'] = self._merge_metadata(fresh[best].get('metadata', {}), item.get('metadata', {}))
+                    continue
+            item['embedding'] = vector
+            fresh.append(item)
+            fresh_vectors.append(vector)
+
+        context_store.replace_metadata(merged.values())
+        tracer.add("bullets_deduped", len(entries) - len(fresh))
+        logger.info("Deduplication kept %d of %d entries, merged %d.", len(fresh), len(entries), len(entries) - len(fresh))
+        return fresh
+
+    @staticmethod
+    def _merge_metadata(metadata, source_metadata):
+        """重複と判定された項目のメタデータ（出現回数・出典）を統合した新しい辞書を返す。"""
+        merged = dict(metadata)
+        merged['count'] = metadata.get('count', 1) + source_metadata.get('count', 1)
+        sources = list(metadata.get('sources', []))
+        sources.extend(s for s in source_metadata.get('sources', []) if s not in sources)
+        if sources:
+            merged['sources'] = sources
+        return merged
+
+    def capacity_limit(self, context_store=None):
+        """設定された上限から許容される項目数を求める（上限なしならNone）。"""
+        limits = []
+        if self.max_bullets is not None:
+            limits.append(self.max_bullets)
+        if self.max_memory_bytes is not None and context_store is not None:
+            limits.append(int(self.max_memory_bytes // max(context_store.estimated_bullet_bytes(), 1)))
+        return min(limits) if limits else None
+
+    def prune_context(self, context, context_store=None):
+        """
+        上限を超えた分だけ、ストアの使用状況カウンタに基づいて項目を追い出す。
+        まだストアに入っていない新しい項目（今回のデルタ）は追い出しの対象外。
+        """
+        limit = self.capacity_limit(context_store)
+        if limit is None or context_store is None or len(context) <= limit:
+            return context
+        victims = context_store.select_evictions(len(context) - limit, self.eviction_policy)
+        victim_ids = {id(item) for item in victims}
+        tracer.add("bullets_pruned", len(victims))
+        logger.info("Evicting %d bullets to stay within %d bullets.", len(victims), limit)
+        return [item for item in context if id(item) not in victim_ids]
+
+    def merge_delta(self, delta_entries, context_store):
+        """
+        merge_contextとprune_contextを、ストア全体のリストを作らずに差分だけで行う。
+        本文が既存と同じ項目を除き、上限を超える分の追い出し対象を選んで、
+        追加と削除を1つの版としてストアに適用する。戻り値は (追加した項目, 追い出した項目)。
+        """
+        added, seen = [], set()
+        for entry in delta_entries:
+            if entry['content'] in seen or context_store.has_content(entry['content']):
+                continue
+            seen.add(entry['content'])
+            added.append(entry)
+        limit = self.capacity_limit(context_store)
+        overflow = 0 if limit is None else len(context_store) + len(added) - limit
+        # 今回追加する項目は追い出しの対象外
+        victims = context_store.select_evictions(overflow, self.eviction_policy) if overflow > 0 else []
+        context_store.apply_delta(added=added, removed=victims)
+        tracer.add("bullets_added", len(added))
+        tracer.add("bullets_pruned", len(victims))
+        if victims:
+            logger.info("Evicting %d bullets to stay within %d bullets.", len(victims), limit)
+        logger.debug("Merged %d new bullets into context.", len(added))
+        return added, victims
@@ -1,59 +1,213 @@
 # ace_framework/document_processor.py
-import streamlit as st
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from sentence_transformers import SentenceTransformer
-from typing import List
+from typing import TYPE_CHECKING, List
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import Counter
+from itertools import islice
+import hashlib
+import json
+import multiprocessing
 import os
 
-def process_uploaded_files(uploaded_files: List, embedding_model: SentenceTransformer, collection_name: str = "rag_collection"):
+from .embedding_service import EmbeddingService
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# streamlit・langchain・chromadbは重いので、使う関数の中で読み込む
+
+
+def _load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest_path, manifest):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def _chunk_ids(file_name, texts):
+    """
+    ファイル名・本文・同じ本文の出現回数から決定的なチャンクIDを作る。チャンクの位置は
+    含めないので、途中にテキストが挿入されても変わらなかったチャンクのIDはそのまま残る。
+    """
+    occurrences = Counter()
+    ids = []
+    for text in texts:
+        ids.append(hashlib.sha256(f"{file_name}\0{text}\0{occurrences[text]}".encode("utf-8")).hexdigest())
+        occurrences[text] += 1
+    return ids
+
+
+def _parse_pdf(path, chunk_size, chunk_overlap):
+    """
+    1つのPDFをページ単位で読み込みながらチャンクに分割する（ワーカープロセスで実行）。
+    従来もページごとに分割していたので、チャンクの内容は変わらない。
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyPDFLoader
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    splits = []
+    for page in PyPDFLoader(path).lazy_load():
+        splits.extend(text_splitter.split_documents([page]))
+    return splits
+
+
+def iter_parsed_files(jobs, max_workers=None, chunk_size=1000, chunk_overlap=200):
+    """
+    (ファイル名, パス) のリストを複数プロセスで並列に解析し、完了した順に
+    (ファイル名, チャンクのリスト) を返すジェネレーター。
+    同時に処理中のファイルはmax_workers * 2個までに抑え、メモリ使用量を一定に保つ。
+    """
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    if max_workers <= 1 or len(jobs) <= 1:
+        for file_name, path in jobs:
+            yield file_name, _parse_pdf(path, chunk_size, chunk_overlap)
+        return
+
+    # Streamlitはスレッドを使うため、forkではなくspawnでワーカーを起動する
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        remaining = iter(jobs)
+        pending = {}
+        for file_name, path in islice(remaining, max_workers * 2):
+            pending[pool.submit(_parse_pdf, path, chunk_size, chunk_overlap)] = file_name
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_name = pending.pop(future)
+                for next_name, next_path in islice(remaining, 1):
+                    pending[pool.submit(_parse_pdf, next_path, chunk_size, chunk_overlap)] = next_name
+                yield file_name, future.result()
+
+
+def _batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _as_embeddings(embedding_model):
+    """
+    LangChainのChroma統合はembed_documents/embed_queryを持つ埋め込みを受け取るため、
+    既にロード済みのモデルをEmbeddingServiceで包んで共有する（モデルを二重にロードしない）。
+    """
+    if isinstance(embedding_model, EmbeddingService):
+        return embedding_model
+    return EmbeddingService(embedding_model, model_name=getattr(embedding_model, 'model_name', 'cl-nagoya/ruri-v3-30m'))
+
+
+def open_retriever(embedding_model, collection_name: str = "rag_collection", persist_directory: str = "./chroma_db"):
+    """
+    process_uploaded_filesで取り込み済みのコレクションを開き、Retrieverを返す（UI無しで使う場合）。
+    取り込み済みのチャンクが無ければNoneを返す。
+    """
+    manifest = _load_manifest(os.path.join(persist_directory, f"{collection_name}_manifest.json"))
+    if not any(entry["chunk_ids"] for entry in manifest.values()):
+        return None
+
+    from langchain_community.vectorstores import Chroma
+
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=_as_embeddings(embedding_model),
+        persist_directory=persist_directory,
+    )
+    return vectorstore.as_retriever()
+
+
+def process_uploaded_files(uploaded_files: List, embedding_model: "EmbeddingService | SentenceTransformer", collection_name: str = "rag_collection", persist_directory: str = "./chroma_db", max_workers: int | None = None, embed_batch_size: int = 64, progress_callback=None):
     """
     アップロードされたPDFファイルを処理し、ChromaDBに格納してRetrieverを返す。
+
+    ファイルごとの内容ハッシュとチャンクIDをマニフェストに記録し、差分だけを取り込む。
+    内容が変わっていないファイルは読み込みも埋め込みも行わず、変更されたファイルは
+    既存に無いチャンクだけを追加して消えたチャンクを削除し、アップロードから
+    外れたファイルのチャンクはコレクションから削除する。
+
+    変更のあったファイルはプロセスプールで並列に解析し、解析が終わったファイルから
+    embed_batch_size件ずつ埋め込んでChromaDBへ書き込む。progress_callbackを渡すと
+    ファイルを1つ処理するたびに (処理済みファイル数, 対象ファイル数, 追加チャンク数) で呼ばれる。
     """
     if not uploaded_files:
         return None
 
+    import streamlit as st
+    from langchain_community.vectorstores import Chroma
+
+    # ChromaDBにドキュメントを格納
+    vectorstore = Chroma(
+        collection_name=collection_name,
+        embedding_function=_as_embeddings(embedding_model),
+        persist_directory=persist_directory # データを永続化
+    )
+    os.makedirs(persist_directory, exist_ok=True)
+    manifest_path = os.path.join(persist_directory, f"{collection_name}_manifest.json")
+    manifest = _load_manifest(manifest_path)
+
     # アップロードされたファイルを一時的に保存
     temp_dir = "temp_docs"
     if not os.path.exists(temp_dir):
         os.makedirs(temp_dir)
 
-    docs = []
+    added = removed = skipped = 0
+    current_files = set()
+    jobs, hashes = [], {}
     for uploaded_file in uploaded_files:
+        current_files.add(uploaded_file.name)
+        data = uploaded_file.getbuffer()
+        file_hash = hashlib.sha256(data).hexdigest()
+        entry = manifest.get(uploaded_file.name)
+        if entry and entry["sha256"] == file_hash:
+            skipped += 1
+            continue
+
         temp_path = os.path.join(temp_dir, uploaded_file.name)
         with open(temp_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        # PyPDFLoaderを使用してドキュメントをロード
-        loader = PyPDFLoader(temp_path)
-        docs.extend(loader.load())
+            f.write(data)
+        jobs.append((uploaded_file.name, temp_path))
+        hashes[uploaded_file.name] = file_hash
+
+    # PyPDFLoaderを使用してドキュメントをロードし、テキストをチャンクに分割（並列）
+    for done, (file_name, splits) in enumerate(iter_parsed_files(jobs, max_workers), 1):
+        entry = manifest.get(file_name)
+        chunk_ids = _chunk_ids(file_name, [doc.page_content for doc in splits])
 
-    # テキストをチャンクに分割
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    splits = text_splitter.split_documents(docs)
+        # 変更前のファイルにしか無いチャンクを削除し、既に格納済みのチャンクは埋め込み直さない
+        old_ids = set(entry["chunk_ids"]) if entry else set()
+        stale_ids = list(old_ids - set(chunk_ids))
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            removed += len(stale_ids)
+        for batch in _batched(list(zip(chunk_ids, splits)), embed_batch_size):
+            existing_ids = set(vectorstore.get(ids=[chunk_id for chunk_id, _ in batch])["ids"])
+            new_docs = [(chunk_id, doc) for chunk_id, doc in batch if chunk_id not in existing_ids]
+            if new_docs:
+                vectorstore.add_documents([doc for _, doc in new_docs], ids=[chunk_id for chunk_id, _ in new_docs])
+                added += len(new_docs)
+        # ファイル単位でマニフェストを保存し、途中で中断しても処理済みのファイルはやり直さない
+        manifest[file_name] = {"sha256": hashes[file_name], "chunk_ids": chunk_ids}
+        _save_manifest(manifest_path, manifest)
+        if progress_callback is not None:
+            progress_callback(done, len(jobs), added)
 
-    if not splits:
+    # アップロードから外れたファイルのチャンクを削除
+    for file_name in [name for name in manifest if name not in current_files]:
+        chunk_ids = manifest.pop(file_name)["chunk_ids"]
+        if chunk_ids:
+            vectorstore.delete(ids=chunk_ids)
+            removed += len(chunk_ids)
+
+    _save_manifest(manifest_path, manifest)
+
+    total_chunks = sum(len(entry["chunk_ids"]) for entry in manifest.values())
+    if not total_chunks:
         st.warning("ドキュメントからテキストを抽出できませんでした。")
         return None
 
-    # ChromaDBにドキュメントを格納
-    # LangChainのChroma統合はSentenceTransformerモデルを直接受け取れないため、
-    # SentenceTransformerEmbeddingFunctionというラッパーを使うか、HuggingFaceEmbeddingsを使う必要がある。
-    # ここではシンプルにするため、LangChainが推奨するHuggingFaceEmbeddingsを使用する。
-    # sentence-transformersライブラリはHuggingFaceのモデルをダウンロードするために内部で使用される。
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-
-    # SentenceTransformerモデル名を指定してHuggingFaceEmbeddingsを初期化
-    embeddings = HuggingFaceEmbeddings(model_name='cl-nagoya/ruri-v3-30m')
-
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        collection_name=collection_name,
-        persist_directory="./chroma_db" # データを永続化
-    )
-
-    st.success(f"{len(splits)}個のドキュメントチャンクをChromaDBに格納しました。")
+    st.success(f"{added}個のチャンクを追加、{removed}個を削除しました（変更なしのファイル: {skipped}個、合計チャンク数: {total_chunks}）。")
 
     return vectorstore.as_retriever()
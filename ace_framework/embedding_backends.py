@@ -0,0 +1,224 @@
+# ace_framework/embedding_backends.py
+
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("sentence-transformers", "onnx")
+_METADATA_FILE = "ace_onnx.json"
+
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def embedding_model_id(model_name, backend="sentence-transformers", quantized=True):
+    """埋め込みキャッシュのキーに使う識別子。バックエンドごとにベクトルがわずかに違うので区別する。"""
+    if backend == "sentence-transformers":
+        return model_name
+    return f"{model_name}@{backend}-{'int8' if quantized else 'fp32'}"
+
+
+def default_onnx_dir(model_name, root="ace_runs"):
+    return os.path.join(root, "onnx", model_name.replace("/", "__"))
+
+
+def load_embedding_model(model_name, backend="sentence-transformers", onnx_dir=None, quantized=True, num_threads=None):
+    """
+    SentenceTransformer互換のencode()を持つ埋め込みモデルを読み込む。
+    torchやONNX Runtimeはここで初めて読み込むので、ace_frameworkのimport自体は軽いまま保てる。
+    """
+    if backend == "sentence-transformers":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return OnnxEmbeddingModel(onnx_dir or default_onnx_dir(model_name), quantized=quantized, num_threads=num_threads)
+    raise ValueError(f"Unknown embedding backend: {backend!r} (expected one of {BACKENDS})")
+
+
+class OnnxEmbeddingModel:
+    """
+    目的：export_onnx()で書き出したモデルをONNX Runtime（CPU）で実行し、torch無しで埋め込みを計算します。
+
+    トークナイズはtokenizersライブラリ、プーリングと正規化は書き出し時に記録した
+    SentenceTransformerの設定（平均またはCLS）に従ってnumpyで行います。
+    quantized=Trueなら重みをint8に動的量子化したモデルを使います。
+    SentenceTransformer互換のencode()を持つので、EmbeddingServiceや埋め込みワーカーにそのまま渡せます。
+    """
+    def __init__(self, model_dir, quantized=True, num_threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        metadata_path = os.path.join(model_dir, _METADATA_FILE)
+        if not os.path.exists(metadata_path):
+            raise FileNotFoundError(
+                f"No exported ONNX model in {model_dir}. "
+                f"Run `python -m ace_framework.embedding_backends <model name> {model_dir}` first."
+            )
+        with open(metadata_path, encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.model_name = self.metadata["model_name"]
+        self.pooling = self.metadata["pooling"]
+        self.normalize = self.metadata["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.metadata["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.metadata["pad_token_id"], pad_token=self.metadata["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        file_name = "model.int8.onnx" if quantized else "model.onnx"
+        self.session = ort.InferenceSession(os.path.join(model_dir, file_name), options, providers=["CPUExecutionProvider"])
+        self._input_names = {inp.name for inp in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self):
+        return self.metadata["dim"]
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """文字列1つなら1次元、リストなら (件数, 次元) のfloat32配列を返す。"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.empty((len(texts), self.metadata["dim"]), dtype=np.float32)
+        # SentenceTransformerと同様に長さ順に並べ、バッチ内のパディングを減らす
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), batch_size):
+            indices = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in indices])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self._input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            hidden = self.session.run(None, {name: value for name, value in feeds.items() if name in self._input_names})[0]
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = attention_mask[:, :, None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            vectors[indices] = _normalize_rows(pooled) if self.normalize else pooled
+        return vectors[0] if single else vectors
+
+
+def export_onnx(model_name, output_dir, quantize=True, opset=17):
+    """
+    SentenceTransformerモデルのTransformer部分をONNXに書き出し、tokenizer.jsonと
+    プーリング設定（ace_onnx.json）を保存する。quantize=Trueならint8の動的量子化版
+    （model.int8.onnx）も作る。書き出しにはtorch・sentence-transformers・onnxが必要だが、
+    書き出したモデルの実行にはonnxruntimeとtokenizersだけがあればよい。
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    transformer, pooling, normalize = model[0], None, False
+    for module in list(model)[1:]:
+        kind = type(module).__name__
+        if kind == "Pooling":
+            pooling = module.get_pooling_mode_str()
+        elif kind == "Normalize":
+            normalize = True
+        else:
+            raise ValueError(f"Unsupported SentenceTransformer module for ONNX export: {kind}")
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode for ONNX export: {pooling}")
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = model.tokenizer
+    sample = tokenizer(["これはONNXへの書き出し用のサンプルです。", "短い文"], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _Encoder(transformer.auto_model),
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(output_dir)
+    metadata = {
+        "model_name": model_name,
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_seq_length": model.max_seq_length,
+        "pad_token_id": tokenizer.pad_token_id,
+        "pad_token": tokenizer.pad_token,
+        "dim": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(output_dir, _METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, os.path.join(output_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    logger.info("Exported %s to %s", model_name, output_dir)
+    return metadata
+
+
+def parity_report(reference, candidate, texts, top_k=5, batch_size=32):
+    """
+    同じ本文に対する2つのモデルの埋め込みを比較する。
+    cosine_*は本文ごとのベクトル同士のコサイン類似度、recall_at_kは各本文をクエリとして
+    残りの本文を検索したときに、referenceの上位top_k件のうちcandidateの上位top_k件にも入った割合。
+    """
+    expected = _normalize_rows(np.asarray(reference.encode(list(texts), batch_size=batch_size), dtype=np.float32))
+    actual = _normalize_rows(np.asarray(candidate.encode(list(texts), batch_size=batch_size), dtype=np.float32))
+    cosine = (expected * actual).sum(axis=1)
+
+    k = min(top_k, len(texts) - 1)
+    recall = None
+    if k > 0:
+        similarities_expected, similarities_actual = expected @ expected.T, actual @ actual.T
+        # 自分自身は検索結果から除く
+        np.fill_diagonal(similarities_expected, -np.inf)
+        np.fill_diagonal(similarities_actual, -np.inf)
+        top_expected = np.argpartition(-similarities_expected, k - 1, axis=1)[:, :k]
+        top_actual = np.argpartition(-similarities_actual, k - 1, axis=1)[:, :k]
+        hits = sum(len(set(a) & set(b)) for a, b in zip(top_expected, top_actual))
+        recall = hits / (k * len(texts))
+    return {
+        "texts": len(texts),
+        "cosine_min": float(cosine.min()),
+        "cosine_mean": float(cosine.mean()),
+        "top_k": k,
+        "recall_at_k": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a SentenceTransformer model to ONNX (optionally int8-quantized) for the onnx embedding backend.")
+    parser.add_argument("model", help="SentenceTransformerのモデル名（例: cl-nagoya/ruri-v3-30m）")
+    parser.add_argument("output_dir", nargs="?", help="書き出し先（省略時はace_runs/onnx/<モデル名>）")
+    parser.add_argument("--no-quantize", action="store_true", help="int8の量子化版を作らない")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO", format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    export_onnx(args.model, args.output_dir or default_onnx_dir(args.model), quantize=not args.no_quantize, opset=args.opset)
+
+
+if __name__ == "__main__":
+    main()
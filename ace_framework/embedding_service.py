@@ -0,0 +1,114 @@
+# ace_framework/embedding_service.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingService:
+    """
+    目的：1つの埋め込みモデルをコンテキストストア・オーケストレーター・ドキュメント処理で共有し、
+    バッチエンコードと内容ハッシュをキーにしたキャッシュで重複した埋め込み計算を省きます。
+
+    キャッシュはメモリ上の上限付きLRU（cache_size件）と、cache_pathを指定した場合の
+    SQLiteによるディスク永続化の2段構成です。キーはモデル名と本文のSHA-256です。
+    SentenceTransformer互換のencode()と、LangChain互換のembed_documents()/embed_query()を
+    提供するため、どちらの埋め込みモデルの代わりにも渡せます。
+    """
+    def __init__(self, model, model_name="default", batch_size=64, cache_size=10000, cache_path=None):
+        self.model = model
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        if cache_path:
+            os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+            self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """
+        文字列1つなら1次元、リストなら (件数, 次元) のfloat32配列を返す。
+        キャッシュに無い本文だけを重複を除いてまとめてモデルに渡す。
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        keys = [self._key(text) for text in texts]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    vectors[key] = self._cache[key]
+            missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+            if missing and self._conn is not None:
+                for key, vector in self._load_from_disk(list(missing)).items():
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                    del missing[key]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # モデルの呼び出しはロックの外で行い、他スレッドのキャッシュヒットを妨げない
+            encoded = np.asarray(
+                self.model.encode(list(missing.values()), batch_size=batch_size or self.batch_size),
+                dtype=np.float32,
+            )
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = vector
+                    self._remember(key, vector)
+                if self._conn is not None:
+                    with self._conn:
+                        self._conn.executemany(
+                            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                            [(key, vector.tobytes()) for key, vector in zip(missing, encoded)],
+                        )
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        result = np.stack([vectors[key] for key in keys])
+        return result[0] if single else result
+
+    def _remember(self, key, vector):
+        self._cache[key] = vector
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load_from_disk(self, keys):
+        found = {}
+        # SQLiteの変数上限を超えないよう分割して問い合わせる
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode(text).tolist()
+
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.cache_size}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
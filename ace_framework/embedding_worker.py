@@ -0,0 +1,428 @@
+# ace_framework/embedding_worker.py
+
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import stat
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from .embedding_backends import BACKENDS, load_embedding_model
+
+logger = logging.getLogger(__name__)
+
+# 起動したワーカーに認証キーを渡す環境変数（コマンドライン引数は他のユーザーからも見えるため使わない）
+AUTHKEY_ENV = "ACE_EMBEDDING_WORKER_AUTHKEY"
+
+
+def load_authkey(address, authkey=None):
+    """
+    ワーカーとの接続に使う認証キーを返す。authkeyを指定しなければ、ソケットの隣の
+    キーファイル（<address>.key、所有者だけが読み書きできる0600）を読み、無ければ作る。
+    接続ではpickleを受け取るので、キーを知らないプロセスからの接続は受け付けない。
+    """
+    if authkey:
+        return authkey.encode("utf-8") if isinstance(authkey, str) else bytes(authkey)
+    path = f"{address}.key"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+    if stat.S_IMODE(os.stat(path).st_mode) & 0o077:
+        raise PermissionError(f"Embedding worker key file {path} must be readable only by its owner (chmod 600)")
+    # 別のプロセスが作成した直後で、まだ書き込まれていない場合は少し待つ
+    deadline = time.monotonic() + 1.0
+    while True:
+        with open(path, encoding="utf-8") as f:
+            key = f.read().strip()
+        if key or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    if not key:
+        raise ValueError(f"Embedding worker key file {path} is empty")
+    return key.encode("utf-8")
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingWorker:
+    """
+    目的：埋め込みモデルを1つの専用プロセスに置き、Unixソケット越しに複数のStreamlitプロセスや
+    セッションから共有します。
+
+    接続ごとのスレッドが受け取ったencode要求をキューに積み、バッチ処理スレッドが
+    最初の要求からmax_wait_ms以内（またはmax_batch_size件に達するまで）に届いた要求を
+    まとめて1回のmodel.encode()で処理します。1件ずつのクエリ埋め込みが同時に来ても、
+    モデルの呼び出しは1回で済みます。
+
+    ベクトルは接続ごとにワーカーが確保した共有メモリに書き込み、応答ではその名前と形だけを返すので、
+    ドキュメント取り込みのような大きなバッチでもベクトルをpickleしてソケットに流しません。
+    共有メモリは次の要求まで再利用し、足りなくなったら確保し直します。
+    接続はauthkey（省略時はload_authkeyのキーファイル）で認証し、キーを持たない接続は拒否します。
+    """
+    def __init__(self, model, address, max_batch_size=64, max_wait_ms=5.0, authkey=None):
+        self.model = model
+        self.address = address
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.authkey = load_authkey(address, authkey)
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._segments = set()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            # 前回のワーカーが残したソケットファイル（接続できなければ使われていない）
+            try:
+                Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+            except AuthenticationError:
+                pass  # 別のキーで接続を受け付けているワーカーがいる
+            except OSError:
+                os.unlink(self.address)
+            if os.path.exists(self.address):
+                raise RuntimeError(f"An embedding worker is already listening on {self.address}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.address)), exist_ok=True)
+        threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True).start()
+        try:
+            with Listener(self.address, family="AF_UNIX", authkey=self.authkey) as listener:
+                logger.info("Embedding worker listening on %s", self.address)
+                while not self._closed.is_set():
+                    try:
+                        conn = listener.accept()
+                    except (OSError, AuthenticationError) as e:
+                        # 認証キーの合わない接続は、pickleを受け取る前にここで拒否される
+                        logger.warning("Failed to accept a connection: %s", e)
+                        continue
+                    threading.Thread(target=self._handle, args=(conn,), name="embedding-connection", daemon=True).start()
+        finally:
+            # 接続中のクライアントが残っていても、共有メモリは残さない
+            with self._lock:
+                segments, self._segments = self._segments, set()
+            for shm in segments:
+                self._release_segment(shm)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "texts": self.texts,
+                "batches": self.batches,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            }
+
+    def _allocate_segment(self, size):
+        shm = SharedMemory(create=True, size=size)
+        with self._lock:
+            self._segments.add(shm)
+        return shm
+
+    def _release_segment(self, shm):
+        with self._lock:
+            self._segments.discard(shm)
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _handle(self, conn):
+        shm = None
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                command = message[0]
+                if command == "encode":
+                    request = _Request(message[1])
+                    self._queue.put(request)
+                    request.done.wait()
+                    if request.error is not None:
+                        conn.send(("error", request.error))
+                        continue
+                    vectors = request.vectors
+                    if shm is None or shm.size < vectors.nbytes:
+                        if shm is not None:
+                            self._release_segment(shm)
+                        shm = self._allocate_segment(max(vectors.nbytes, 1 << 16))
+                    np.ndarray(vectors.shape, dtype=np.float32, buffer=shm.buf)[...] = vectors
+                    conn.send(("ok", shm.name, vectors.shape))
+                elif command == "stats":
+                    conn.send(("ok", self.stats()))
+                elif command == "shutdown":
+                    conn.send(("ok",))
+                    self._closed.set()
+                    # accept()で待っているメインスレッドを起こす
+                    try:
+                        Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+                    except OSError:
+                        pass
+                    return
+                else:
+                    conn.send(("error", f"Unknown command: {command!r}"))
+        finally:
+            conn.close()
+            if shm is not None:
+                self._release_segment(shm)
+
+    def _batch_loop(self):
+        carry = None
+        while True:
+            batch = [carry if carry is not None else self._queue.get()]
+            carry = None
+            size = len(batch[0].texts)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    # 入りきらない要求は次のバッチの先頭にする
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._encode(batch)
+
+    def _encode(self, batch):
+        texts = [text for request in batch for text in request.texts]
+        try:
+            vectors = np.asarray(self.model.encode(texts, batch_size=self.max_batch_size), dtype=np.float32).reshape(len(texts), -1)
+        except Exception as e:
+            logger.exception("Embedding batch of %d texts failed", len(texts))
+            for request in batch:
+                request.error = f"{type(e).__name__}: {e}"
+                request.done.set()
+            return
+        with self._lock:
+            self.requests += len(batch)
+            self.texts += len(texts)
+            self.batches += 1
+        offset = 0
+        for request in batch:
+            request.vectors = vectors[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            request.done.set()
+
+
+class EmbeddingWorkerClient:
+    """
+    目的：EmbeddingWorkerを、プロセス内の埋め込みモデルと同じencode()で使えるようにします。
+
+    SentenceTransformer互換のencode()を持つので、ContextStore・オーケストレーター・
+    ドキュメント処理にそのまま渡せ、EmbeddingServiceで包めばキャッシュも効きます。
+    接続はスレッド間で共有せずプールから1本ずつ貸し出すので、各セッションの要求は
+    並行してワーカーに届き、ワーカー側でまとめてバッチ処理されます。
+    authkeyを省略するとワーカーと同じキーファイル（load_authkey）のキーで接続します。
+    """
+    def __init__(self, address, model_name="default", authkey=None, timeout=None):
+        self.address = address
+        self.model_name = model_name
+        self.authkey = load_authkey(address, authkey)
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        # 接続を一度張って、ワーカーが動いていなければここで失敗させる
+        self._release(self._connect())
+
+    def _connect(self):
+        return {"conn": Client(self.address, family="AF_UNIX", authkey=self.authkey), "shm": None}
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, channel):
+        with self._lock:
+            self._idle.append(channel)
+
+    def _discard(self, channel):
+        channel["conn"].close()
+        if channel["shm"] is not None:
+            channel["shm"].close()
+
+    def _call(self, channel, *message):
+        conn = channel["conn"]
+        conn.send(message)
+        if self.timeout is not None and not conn.poll(self.timeout):
+            raise TimeoutError(f"Embedding worker at {self.address} did not respond within {self.timeout}s")
+        reply = conn.recv()
+        if reply[0] == "error":
+            raise RuntimeError(f"Embedding worker failed: {reply[1]}")
+        return reply
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """文字列1つなら1次元、リストなら (件数, 次元) のfloat32配列を返す。"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        channel = self._acquire()
+        try:
+            _, name, shape = self._call(channel, "encode", texts)
+            shm = channel["shm"]
+            if shm is None or shm.name != name:
+                # ワーカーが共有メモリを確保し直した（後片付けはワーカー側が行う）
+                if shm is not None:
+                    shm.close()
+                shm = channel["shm"] = SharedMemory(name=name, track=False)
+            vectors = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+        except BaseException:
+            # 応答の途中で失敗した接続は状態が分からないので再利用しない
+            self._discard(channel)
+            raise
+        self._release(channel)
+        return vectors[0] if single else vectors
+
+    def embed_documents(self, texts):
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.encode(text).tolist()
+
+    def stats(self):
+        channel = self._acquire()
+        try:
+            stats = self._call(channel, "stats")[1]
+        except BaseException:
+            self._discard(channel)
+            raise
+        self._release(channel)
+        return stats
+
+    def shutdown(self):
+        """ワーカープロセスを停止する。"""
+        channel = self._acquire()
+        try:
+            self._call(channel, "shutdown")
+        finally:
+            self._discard(channel)
+        self.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for channel in idle:
+            self._discard(channel)
+
+
+def _serve(model_factory, address, max_batch_size, max_wait_ms, authkey):
+    EmbeddingWorker(model_factory(), address, max_batch_size, max_wait_ms, authkey).serve_forever()
+
+
+def _wait_for_worker(address, authkey, timeout, alive=None):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            Client(address, family="AF_UNIX", authkey=authkey).close()
+            return
+        except OSError:
+            if alive is not None and not alive():
+                raise RuntimeError("Embedding worker exited during startup")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Embedding worker did not start listening on {address} within {timeout}s")
+            time.sleep(0.05)
+
+
+def start_worker(model_factory, address, max_batch_size=64, max_wait_ms=5.0, authkey=None, startup_timeout=300):
+    """
+    model_factory()で作ったモデルを持つワーカーを子プロセスとして起動し、接続を受け付けるまで待つ。
+    model_factoryはspawnで子プロセスに渡すので、pickle可能（モジュールレベルの関数やpartial）である必要がある。
+    """
+    authkey = load_authkey(address, authkey)
+    # Streamlitはスレッドを使うため、forkではなくspawnで起動する
+    process = multiprocessing.get_context("spawn").Process(
+        target=_serve, args=(model_factory, address, max_batch_size, max_wait_ms, authkey), name="embedding-worker", daemon=True
+    )
+    process.start()
+    _wait_for_worker(address, authkey, startup_timeout, process.is_alive)
+    return process
+
+
+def connect_or_spawn(address, model_name, max_batch_size=64, max_wait_ms=5.0, backend="sentence-transformers", onnx_dir=None, quantized=True, authkey=None, startup_timeout=300):
+    """
+    addressのワーカーに接続する。まだ動いていなければ、どのプロセスにも属さない独立したワーカーを
+    起動してから接続するので、同じマシン上の複数のStreamlitプロセスが1つのワーカーを共有できる。
+    authkeyを省略するとキーファイルのキーを使い、起動するワーカーには環境変数で同じキーを渡す。
+    """
+    authkey = load_authkey(address, authkey)
+    try:
+        return EmbeddingWorkerClient(address, model_name=model_name, authkey=authkey)
+    except OSError:
+        pass
+    logger.info("Starting embedding worker for %s on %s", model_name, address)
+    command = [
+        sys.executable, "-m", "ace_framework.embedding_worker", address,
+        "--model", model_name, "--max-batch-size", str(max_batch_size), "--max-wait-ms", str(max_wait_ms),
+        "--backend", backend,
+    ]
+    if onnx_dir:
+        command += ["--onnx-dir", os.path.abspath(onnx_dir)]
+    if not quantized:
+        command.append("--fp32")
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, AUTHKEY_ENV: os.fsdecode(authkey)}
+    process = subprocess.Popen(command, cwd=project_root, env=env, start_new_session=True, stdin=subprocess.DEVNULL)
+    try:
+        _wait_for_worker(address, authkey, startup_timeout, lambda: process.poll() is None)
+    except RuntimeError:
+        # 同時に起動した別プロセスのワーカーが先にソケットを取った場合は、そちらに接続すればよい
+        try:
+            _wait_for_worker(address, authkey, 1)
+        except TimeoutError:
+            raise RuntimeError(f"Embedding worker for {model_name} exited during startup (exit code {process.returncode})") from None
+    return EmbeddingWorkerClient(address, model_name=model_name, authkey=authkey)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a SentenceTransformer model over a Unix socket with cross-request micro-batching.")
+    parser.add_argument("address", help="Unixソケットのパス")
+    parser.add_argument("--model", default="cl-nagoya/ruri-v3-30m")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--backend", choices=BACKENDS, default="sentence-transformers")
+    parser.add_argument("--onnx-dir", help="onnxバックエンドで使う書き出し済みモデルのディレクトリ")
+    parser.add_argument("--fp32", action="store_true", help="onnxバックエンドでint8量子化前のモデルを使う")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    model = load_embedding_model(args.model, backend=args.backend, onnx_dir=args.onnx_dir, quantized=not args.fp32)
+    # 環境変数に認証キーが無ければ、ソケットの隣のキーファイルを使う
+    authkey = os.environ.get(AUTHKEY_ENV)
+    EmbeddingWorker(model, args.address, args.max_batch_size, args.max_wait_ms, os.fsencode(authkey) if authkey else None).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# ace_framework/eviction.py
+
+import numpy as np
+
+
+class LFUPolicy:
+    """
+    目的：検索ヒット数が少ない項目から追い出します（Least Frequently Used）。
+    helpful/harmfulの判定はヒット数と同じ重みで加減算します。
+    """
+    def __init__(self, feedback_weight=1.0):
+        self.feedback_weight = feedback_weight
+
+    def scores(self, hits, last_used, helpful, harmful, cycle):
+        return hits + self.feedback_weight * (helpful - harmful)
+
+
+class LRUPolicy:
+    """
+    目的：最後に使用されたサイクルが古い項目から追い出します（Least Recently Used）。
+    """
+    def scores(self, hits, last_used, helpful, harmful, cycle):
+        return last_used.astype(np.float64)
+
+
+class ScoreDecayPolicy:
+    """
+    目的：使用頻度とフィードバックから求めた価値を、最終使用からの経過サイクルで
+    指数的に減衰させ、その値が低い項目から追い出します。
+
+    half_lifeサイクル使われないと価値が半分になります。減衰させるのは正の価値だけで、
+    harmfulの判定で負になった価値は時間が経っても0に近づかず、新しい項目より先に追い出されます。
+    """
+    def __init__(self, half_life=50, feedback_weight=2.0):
+        self.half_life = half_life
+        self.feedback_weight = feedback_weight
+
+    def scores(self, hits, last_used, helpful, harmful, cycle):
+        value = 1.0 + hits + self.feedback_weight * (helpful - harmful)
+        decay = 0.5 ** ((cycle - last_used) / self.half_life)
+        return np.maximum(value, 0.0) * decay + np.minimum(value, 0.0)
+
+
+EVICTION_POLICIES = {
+    "lfu": LFUPolicy,
+    "lru": LRUPolicy,
+    "decay": ScoreDecayPolicy,
+}
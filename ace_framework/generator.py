@@ -1,19 +1,37 @@
 # ace_framework/generator.py
 
+import logging
+
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
 class Generator:
     """
     目的：現在の進化型コンテキストを使用して、推論軌跡を生成し、新しいタスクを解決しようとします。
+
+    optionsはOllamaのchat()にそのまま渡す生成オプション（temperature・seedなど）です。
     """
-    def __init__(self, client, model_name):
+    def __init__(self, client, model_name, options=None):
         self.client = client
         self.model_name = model_name
+        self.options = options or None
 
     def generate_trajectory(self, evolutionary_context, external_context, query):
-        print(f"Generating trajectory for query: '{query}'")
+        logger.info("Generating trajectory for query: '%s'", query)
+        prompt = self.build_prompt(evolutionary_context, external_context, query)
+        return self.complete(prompt), prompt
+
+    def build_prompt(self, evolutionary_context, external_context, query):
+        """
+        指示→進化的コンテキスト→外部コンテキスト→クエリの順に組み立てる。
+        変化の少ない部分を先頭に置き、LLMサーバーのプレフィックスKVキャッシュを再利用しやすくする。
+        """
         prompt = f"""あなたはAIアシスタントです。以下の2種類のコンテキストを使用して、クエリを解決するための詳細な推論軌跡とクエリに対する回答を生成してください。応答は日本語で行ってください。
 
-### クエリ
-"{query}"
+### 指示
+- ステップバイステップの推論軌跡とクエリに対する最終的な回答を生成してください。
 
 ### 進化的コンテキスト (過去の対話からの教訓)
 {evolutionary_context}
@@ -21,24 +39,58 @@ class Generator:
 ### 外部コンテキスト (ドキュメントからの情報)
 {external_context}
 
-### 指示
-- ステップバイステップの推論軌跡とクエリに対する最終的な回答を生成してください。
+### クエリ
+"{query}"
 """
-        print("\n--- Final Prompt Sent to LLM ---")
-        print(prompt)
-        print("----------------------------------\n")
+        return prompt
+
+    def complete(self, prompt):
+        logger.debug("Final prompt sent to LLM:\n%s", prompt)
         try:
             # Ollama chat APIを使用
-            response = self.client.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt,
-                    }
-                ]
-            )
-            return response['message']['content'], prompt # chat APIの応答形式に対応
+            with tracer.span("generation", model=self.model_name):
+                response = self.client.chat(
+                    model=self.model_name,
+                    messages=[
+                        {
+                            'role': 'user',
+                            'content': prompt,
+                        }
+                    ],
+                    options=self.options
+                )
+            tracer.record_llm_usage(response, "generation")
+            return response['message']['content'] # chat APIの応答形式に対応
+        except Exception as e:
+            logger.error("Error generating trajectory: %s", e)
+            return "推論軌跡の生成中にエラーが発生しました。"
+
+    def stream(self, prompt):
+        """
+        Ollamaのstream=Trueで推論軌跡を逐次生成し、テキストの断片をyieldする。
+        """
+        logger.debug("Final prompt sent to LLM (streaming):\n%s", prompt)
+        try:
+            # スパンは最後のチャンクを受け取るまで（表示側の処理時間を含む）
+            with tracer.span("generation", model=self.model_name, stream=True):
+                chunk = None
+                for chunk in self.client.chat(
+                    model=self.model_name,
+                    messages=[
+                        {
+                            'role': 'user',
+                            'content': prompt,
+                        }
+                    ],
+                    options=self.options,
+                    stream=True
+                ):
+                    content = chunk['message']['content']
+                    if content:
+                        yield content
+            # トークン数は最後のチャンクにだけ含まれる
+            if chunk is not None:
+                tracer.record_llm_usage(chunk, "generation")
         except Exception as e:
-            print(f"Error generating trajectory: {e}")
-            return "推論軌跡の生成中にエラーが発生しました。", prompt
+            logger.error("Error generating trajectory: %s", e)
+            yield "推論軌跡の生成中にエラーが発生しました。"
@@ -0,0 +1,169 @@
+# ace_framework/llm_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LLMResponseCache:
+    """
+    目的：同じ (モデル, メッセージ, format, options) に対するLLM応答を再利用し、
+    データセットの再実行や評価の繰り返しでの無駄な呼び出しを省きます。
+
+    メモリ上の上限付きLRU（max_entries件）と、pathを指定した場合のSQLiteによる
+    永続化の2段構成です。ttl（秒）を過ぎた応答は破棄し、ディスク側は
+    max_disk_entries件を超えると最終アクセスの古いものから削除します。
+    """
+    def __init__(self, max_entries=1024, path=None, ttl=None, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()  # key -> (作成時刻, 応答)
+        self._touched = {}            # メモリでヒットし、ディスクの最終アクセスが未更新のkey -> 時刻
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._conn.commit()
+            self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, messages, format=None, options=None):
+        payload = json.dumps(
+            {"model": model, "messages": messages, "format": format, "options": options},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    if self._conn is not None:
+                        # ヒットのたびには書き込まず、ディスク側の削除の前にまとめて反映する
+                        self._touched[key] = now
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+            if self._conn is not None:
+                row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    response, created = json.loads(row[0]), row[1]
+                    with self._conn:
+                        if self._expired(created, now):
+                            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                            self._disk_entries -= 1
+                        else:
+                            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                            self._remember(key, created, response)
+                            self.hits += 1
+                            return response
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            if self._conn is None:
+                return
+            with self._conn:
+                exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(response, ensure_ascii=False, default=str), now, now),
+                )
+                if not exists:
+                    self._disk_entries += 1
+                overflow = self._disk_entries - self.max_disk_entries
+                if overflow > 0:
+                    self._write_touched()
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._disk_entries -= overflow
+                    self.evictions += overflow
+
+    def _write_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?", [(at, key) for key, at in self._touched.items()])
+            self._touched.clear()
+
+    def _remember(self, key, created, response):
+        self._memory[key] = (created, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "memory_entries": len(self._memory)}
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock, self._conn:
+                self._write_touched()
+            self._conn.close()
+
+
+class CachedClient:
+    """
+    目的：Ollamaクライアントを包み、chat()の応答をLLMResponseCacheで再利用します。
+    Generator/Reflectorには元のクライアントの代わりにそのまま渡せます。
+
+    bypass=Trueでキャッシュを完全に迂回します。deterministic_only=Trueの場合は、
+    options に temperature=0 または seed が指定された（再現性のある）呼び出しだけを
+    キャッシュし、通常のサンプリングは毎回LLMに問い合わせます。
+    ストリーミング呼び出しは常にキャッシュしません。キャッシュから返す応答には "cached": True が付きます。
+    """
+    def __init__(self, client, cache, bypass=False, deterministic_only=False):
+        self.client = client
+        self.cache = cache
+        self.bypass = bypass
+        self.deterministic_only = deterministic_only
+
+    def _cacheable(self, options, stream):
+        if self.bypass or stream:
+            return False
+        if self.deterministic_only:
+            options = options or {}
+            return options.get("temperature") == 0 or options.get("seed") is not None
+        return True
+
+    def chat(self, model, messages, format=None, options=None, stream=False, **kwargs):
+        if not self._cacheable(options, stream):
+            return self.client.chat(model=model, messages=messages, format=format, options=options, stream=stream, **kwargs)
+        key = self.cache.make_key(model, messages, format, options)
+        cached = self.cache.get(key)
+        if cached is not None:
+            # キャッシュの応答であることを示し、トークン数の集計から除けるようにする
+            return {**cached, "cached": True}
+        response = self.client.chat(model=model, messages=messages, format=format, options=options, **kwargs)
+        # ollamaのChatResponseはpydanticモデルなので、シリアライズ可能な辞書にして保存する
+        if hasattr(response, "model_dump"):
+            response = response.model_dump()
+        self.cache.put(key, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -1,88 +1,590 @@
 # ace_framework/orchestrator.py
 
+import base64
+import copy
+import json
+import logging
+import os
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import TYPE_CHECKING
+
+import numpy as np
+
 from .generator import Generator
 from .reflector import Reflector
 from .curator import Curator
-from .context_store import ContextStore
-from sentence_transformers import SentenceTransformer
+from .context_store import ContextSnapshot, ContextStore
+from .prompt_packer import PromptPacker
+from .tracing import tracer
+
+if TYPE_CHECKING:
+    # 型注釈のためだけに読み込む（torchを読み込まずにimportできるようにする）
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRIEVAL_TIMEOUTS = {"external": 10.0}
+
+
+@dataclass
+class CycleResult:
+    """
+    適応サイクルの結果。従来通り `trajectory, final_prompt, context = ...` と
+    アンパックでき、metricsにステージごとの計測値が入る。
+    snapshotはサイクル終了時点のストアの版で、contextは参照されたときに初めて一覧にする。
+    """
+    trajectory: str
+    final_prompt: str
+    snapshot: ContextSnapshot
+    metrics: dict = field(default_factory=dict)
+
+    @property
+    def context(self):
+        return self.snapshot.context
+
+    def __iter__(self):
+        return iter((self.trajectory, self.final_prompt, self.context))
+
+
+class StreamingCycle:
+    """
+    ストリーミング中の適応サイクル。反復するとLLMの出力断片を順に返し、
+    最後まで読み終えた時点で全文を反省ステージに渡し、resultにCycleResultを設定する。
+    """
+    def __init__(self, chunks, on_complete):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.result = None
+
+    def __iter__(self):
+        parts = []
+        first_token_at = None
+        for chunk in self._chunks:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(chunk)
+            yield chunk
+        self.result = self._on_complete("".join(parts), first_token_at)
+
 
 class ACEOrchestrator:
     """
     目的： ジェネレーター、リフレクター、キュレーター間のフローを調整し、適応サイクルを管理します。
+
+    async_updates=Trueの場合、run_adaptation_cycleは推論軌跡の生成直後に戻り、
+    反省・洞察の抽出・キュレーションはバックグラウンドのワーカースレッドに積まれます。
+    ワーカーは1本なので、デルタは投入された順にコンテキストストアへ適用されます。
+    flush()で未処理の更新の完了を待てます。update_executor・retrieval_poolに既存のスレッドプールを
+    渡すと複数のオーケストレーターで共有でき、その場合close()はそれらを停止しません。
+
+    外部コンテキスト（Retriever）と進化的コンテキストの検索は、1回だけ計算した
+    クエリ埋め込みを共有して並行に実行します。外部検索だけをスレッドプールで実行し、
+    retrieval_timeouts["external"]（秒）以内に返らなければ空として扱います。
+    進化的コンテキストはローカルの検索なので呼び出し元のスレッドで実行します。
+
+    取得したコンテキストはprompt_packer（省略時は既定のPromptPacker）でトークン予算内に
+    まとめ、サイクルごとのプロンプトのトークン数をmetricsに記録します。
     """
-    def __init__(self, generator: Generator, reflector: Reflector, curator: Curator, context_store: ContextStore, embedding_model: SentenceTransformer, retriever=None):
+    def __init__(self, generator: Generator, reflector: Reflector, curator: Curator, context_store: ContextStore, embedding_model: "SentenceTransformer", retriever=None, async_updates=False, retrieval_timeouts=None, prompt_packer=None, update_executor=None, retrieval_pool=None):
         self.generator = generator
         self.reflector = reflector
         self.curator = curator
         self.context_store = context_store
         self.embedding_model = embedding_model
         self.retriever = retriever
+        self.async_updates = async_updates
+        # 1本のワーカーに積むので、デルタは投入された順に適用される
+        self._owns_executor = update_executor is None
+        self._executor = (update_executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="ace-update")) if async_updates else None
+        self._pending = []
+        self.retrieval_timeouts = {**DEFAULT_RETRIEVAL_TIMEOUTS, **(retrieval_timeouts or {})}
+        # 外部検索専用。タイムアウトした呼び出しがスレッドを占有し続けても詰まらないよう余裕を持たせる
+        self._owns_retrieval_pool = retrieval_pool is None
+        self._retrieval_pool = retrieval_pool or ThreadPoolExecutor(max_workers=4, thread_name_prefix="ace-retrieval")
+        self.prompt_packer = prompt_packer or PromptPacker()
 
     def run_adaptation_cycle(self, query, feedback, mode, top_k=5):
-        print(f"\n--- Running adaptation cycle in {mode} mode for query: {query} ---")
-        
-        # 1. 外部コンテキストを取得 (Retrieverが存在する場合)
-        external_context_str = ""
-        if self.retriever:
-            print("Retrieving external context...")
-            retrieved_docs = self.retriever.invoke(query)
-            print(f"Retrieved {len(retrieved_docs)} documents from external source.")
-            if retrieved_docs:
-                print("--- Retrieved Documents ---")
-                for i, doc in enumerate(retrieved_docs):
-                    print(f"  Doc {i+1}: {doc.page_content[:200]}...") # Display first 200 chars
-                print("-------------------------")
-            external_context_str = "\n\n".join([doc.page_content for doc in retrieved_docs])
+        logger.info("Running adaptation cycle in %s mode for query: %s", mode, query)
+        metrics = {}
+
+        # 1-3. コンテキストを取得し、推論軌跡を生成
+        trajectory, final_prompt, evolutionary_context_items = self._generate(query, top_k, metrics, self.generator)
+
+        # 4-6. 反省とキュレーション (非同期モードではバックグラウンドで実行)
+        self._schedule_update(query, feedback, trajectory, evolutionary_context_items, metrics)
+
+        logger.info("Adaptation cycle finished.")
+        return CycleResult(trajectory, final_prompt, self.context_store.snapshot(), metrics)
+
+    def stream_adaptation_cycle(self, query, feedback, mode, top_k=5):
+        """
+        run_adaptation_cycleのストリーミング版。コンテキストの取得までを行い、
+        LLMの出力を逐次返すStreamingCycleを返す（st.write_streamにそのまま渡せる）。
+        読み終えると全文で反省とキュレーションを行い、metricsにサイクル開始からの
+        最初のトークンまでの時間（time_to_first_token）を記録する。
+        """
+        logger.info("Running streaming adaptation cycle in %s mode for query: %s", mode, query)
+        cycle_start = time.perf_counter()
+        metrics = {}
+        final_prompt, evolutionary_context_items = self._prepare_prompt(query, top_k, metrics, self.generator)
+        generation_start = time.perf_counter()
+
+        def complete(trajectory, first_token_at):
+            finished_at = time.perf_counter()
+            metrics["time_to_first_token"] = None if first_token_at is None else first_token_at - cycle_start
+            metrics["generation_latency"] = finished_at - generation_start
+            self._schedule_update(query, feedback, trajectory, evolutionary_context_items, metrics)
+            logger.info("Adaptation cycle finished.")
+            return CycleResult(trajectory, final_prompt, self.context_store.snapshot(), metrics)
+
+        return StreamingCycle(self.generator.stream(final_prompt), complete)
+
+    def _schedule_update(self, query, feedback, trajectory, evolutionary_context_items, metrics):
+        if getattr(self.context_store, "readonly", False):
+            logger.info("Context store is read-only. Skipping reflection and curation.")
+            return
+        if self.async_updates:
+            self._pending = [future for future in self._pending if not future.done()]
+            future = self._executor.submit(self._update_context, query, feedback, trajectory, evolutionary_context_items)
+            future.add_done_callback(self._report_update_failure)
+            self._pending.append(future)
+            logger.info("Queued context update (%d pending).", len(self._pending))
         else:
-            print("No retriever available. Skipping external context retrieval.")
+            # 同期モードでは反省とキュレーションの所要時間もこのサイクルのmetricsに記録する
+            self._update_context(query, feedback, trajectory, evolutionary_context_items, metrics)
 
-        # 2. 進化的コンテキストを取得
-        evolutionary_context_items = self.context_store.retrieve_bullets(query=query, top_k=top_k, embedding_model=self.embedding_model)
-        evolutionary_context_str = "\n".join([f"- {item['content']}" for item in evolutionary_context_items])
+    def _generate(self, query, top_k, metrics, generator, query_embedding=None):
+        final_prompt, evolutionary_context_items = self._prepare_prompt(query, top_k, metrics, generator, query_embedding)
 
         # 3. 推論軌跡を生成
-        trajectory, final_prompt = self.generator.generate_trajectory(evolutionary_context_str, external_context_str, query)
-
-        # 4. 軌跡とフィードバックを反省
-        reflection_output = self.reflector.reflect_on_trajectory(trajectory, feedback)
-        insights = self.reflector.distill_insights(reflection_output)
-        delta_entries = self.reflector.format_delta_entries(insights)
-
-        # 5. コンテキストをキュレーション
-        synthesized_delta = self.curator.synthesize_delta(delta_entries, evolutionary_context_items)
-        merged_context = self.curator.merge_context(self.context_store.context, synthesized_delta)
-        deduplicated_context = self.curator.perform_deduplication(merged_context)
-        pruned_context = self.curator.prune_context(deduplicated_context)
-
-        # 6. コンテキストストアを更新し、埋め込みを再生成
-        self.context_store.context = pruned_context
-        self.context_store.generate_and_store_embeddings(self.embedding_model)
-
-        print("--- Adaptation cycle finished. ---")
-        return trajectory, final_prompt, self.context_store.context
-
-    def run_offline_adaptation(self, dataset, initial_context, epochs, top_k=5):
-        print(f"\n--- Running offline adaptation for {epochs} epochs... ---")
-        self.context_store.context = initial_context
-        self.context_store.generate_and_store_embeddings(self.embedding_model)
-
-        for epoch in range(epochs):
-            print(f"\n--- Epoch {epoch + 1}/{epochs} ---")
-            for data_point in dataset:
-                query = data_point.get("query")
-                feedback = data_point.get("feedback")
-                if query and feedback is not None:
-                    self.run_adaptation_cycle(query, feedback, mode="offline", top_k=top_k)
+        start = time.perf_counter()
+        trajectory = generator.complete(final_prompt)
+        metrics["generation_latency"] = time.perf_counter() - start
+        return trajectory, final_prompt, evolutionary_context_items
+
+    def _prepare_prompt(self, query, top_k, metrics, generator, query_embedding=None):
+        # 1-2. 外部コンテキストと進化的コンテキストを並行に取得
+        retrieved_docs, evolutionary_context_items = self._retrieve_contexts(query, top_k, metrics, query_embedding)
+        if retrieved_docs and logger.isEnabledFor(logging.DEBUG):
+            for i, doc in enumerate(retrieved_docs):
+                logger.debug("Retrieved doc %d: %s...", i + 1, doc.page_content[:200]) # Display first 200 chars
+        # トークン予算内に収め、重複を除いてプロンプトを組み立てる
+        packed = self.prompt_packer.pack(
+            lambda evolutionary_context_str, external_context_str: generator.build_prompt(evolutionary_context_str, external_context_str, query),
+            evolutionary_context_items,
+            [doc.page_content for doc in retrieved_docs],
+        )
+        metrics["prompt_tokens"] = packed.prompt_tokens
+        metrics["prompt_section_tokens"] = packed.section_tokens
+        metrics["prompt_dropped"] = packed.dropped
+        tracer.add("prompt_tokens", packed.prompt_tokens)
+        logger.info("Generating trajectory for query: '%s' (%d prompt tokens)", query, packed.prompt_tokens)
+        # 反省ではプロンプトに実際に入った項目だけを評価対象にする
+        return packed.prompt, packed.bullets
+
+    def _retrieve_contexts(self, query, top_k, metrics, query_embedding=None):
+        """
+        クエリを1回だけ埋め込み（計算済みのquery_embeddingがあればそれを使い）、両ソースの検索を並行に実行する。
+        ソースごとのレイテンシ（秒）をmetrics["retrieval_latency"]に、
+        タイムアウトや失敗で空になったソースをmetrics["retrieval_skipped"]に記録する。
+        """
+        if query_embedding is None:
+            start = time.perf_counter()
+            with tracer.span("embedding", kind="query"):
+                query_embedding = np.asarray(self.embedding_model.encode(query), dtype=np.float32)
+            metrics["query_embedding_latency"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sources = ["evolutionary", "external"] if self.retriever else ["evolutionary"]
+        results, latencies, skipped = {}, {}, []
+        with tracer.span("retrieval", sources=sources):
+            external = None
+            if self.retriever:
+                logger.debug("Retrieving external context...")
+                external = self._retrieval_pool.submit(self._timed, self._retrieve_external, query, query_embedding)
+            else:
+                logger.debug("No retriever available. Skipping external context retrieval.")
+            # 進化的コンテキストはローカルの検索なので呼び出し元のスレッドで実行し、
+            # 外部検索のスレッドが塞がっていても必ず取得できるようにする
+            try:
+                results["evolutionary"], latencies["evolutionary"] = self._timed(self._retrieve_evolutionary, query_embedding, top_k)
+            except Exception as e:
+                logger.error("Error retrieving from evolutionary source: %s", e)
+                results["evolutionary"], latencies["evolutionary"] = [], time.perf_counter() - start
+                skipped.append("evolutionary")
+            if external is not None:
+                timeout = self.retrieval_timeouts.get("external")
+                # タイムアウトは外部検索の投入時刻からの期限として扱う
+                remaining = None if timeout is None else max(0.0, start + timeout - time.perf_counter())
+                try:
+                    results["external"], latencies["external"] = external.result(timeout=remaining)
+                except TimeoutError:
+                    # まだ実行が始まっていなければ取り消し、詰まったバックエンドへの呼び出しを積み上げない
+                    external.cancel()
+                    logger.warning("Retrieval from external source timed out after %ss. Continuing without it.", timeout)
+                    results["external"], latencies["external"] = [], timeout
+                    skipped.append("external")
+                except Exception as e:
+                    logger.error("Error retrieving from external source: %s", e)
+                    results["external"], latencies["external"] = [], time.perf_counter() - start
+                    skipped.append("external")
+        metrics["retrieval_latency"] = latencies
+        metrics["retrieval_skipped"] = skipped
+        if "external" in results:
+            logger.info("Retrieved %d documents from external source.", len(results['external']))
+        return results.get("external", []), results["evolutionary"]
+
+    @staticmethod
+    def _timed(func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, time.perf_counter() - start
+
+    def _retrieve_external(self, query, query_embedding):
+        # LangChainのVectorStoreRetrieverなら、計算済みの埋め込みでベクトルストアを直接検索する
+        vectorstore = getattr(self.retriever, "vectorstore", None)
+        if vectorstore is not None and getattr(self.retriever, "search_type", None) == "similarity":
+            return vectorstore.similarity_search_by_vector(query_embedding.tolist(), **self.retriever.search_kwargs)
+        return self.retriever.invoke(query)
+
+    def _retrieve_evolutionary(self, query_embedding, top_k):
+        store = self.context_store
+        if store.index is not None:
+            # 近似最近傍インデックスは更新と並行して読めないため、ロックを取ってストアを検索する
+            with store.lock:
+                return store.search(query_embedding, top_k)
+        # 公開済みのスナップショットをロック無しで検索し、キュレーション中でも待たない
+        items = store.snapshot().search(query_embedding, top_k)
+        store.record_hits(items)
+        return items
+
+    def _update_context(self, query, feedback, trajectory, evolutionary_context_items, metrics=None):
+        start = time.perf_counter()
+        update = self._reflect(query, feedback, trajectory, evolutionary_context_items, self.reflector)
+        reflected = time.perf_counter()
+        self._apply_updates([update])
+        if metrics is not None:
+            metrics["reflection_latency"] = reflected - start
+            metrics["curation_latency"] = time.perf_counter() - reflected
+
+    def _reflect(self, query, feedback, trajectory, evolutionary_context_items, reflector):
+        """4. 軌跡とフィードバックを反省し、(デルタ, helpful/harmful判定, 使用した項目) を返す。"""
+        if reflector.single_pass:
+            _, insights, bullet_tags = reflector.reflect_and_distill(trajectory, feedback, evolutionary_context_items)
+        else:
+            reflection_output = reflector.reflect_on_trajectory(trajectory, feedback, evolutionary_context_items)
+            if reflection_output is None:
+                # 反省に失敗した場合は洞察を抽出せず、コンテキストを更新しない
+                insights, bullet_tags = [], {"helpful": [], "harmful": []}
+            else:
+                insights, bullet_tags = reflector.distill_insights_and_tags(reflection_output, evolutionary_context_items)
+        delta_entries = reflector.format_delta_entries(insights)
+        for entry in delta_entries:
+            entry["metadata"].setdefault("sources", [query])
+        return delta_entries, bullet_tags, evolutionary_context_items
+
+    def _apply_updates(self, updates):
+        """
+        1つ以上の反省結果をまとめて1回のキュレーションでストアへ適用する。
+        LLM呼び出しは含まないので、ロックを保持する時間は短い。
+        """
+        with self.context_store.lock, tracer.span("curation", updates=len(updates)):
+            delta_entries, used_items = [], []
+            for entries, bullet_tags, evolutionary_context_items in updates:
+                self.context_store.record_feedback(bullet_tags["helpful"], helpful=True)
+                self.context_store.record_feedback(bullet_tags["harmful"], helpful=False)
+                delta_entries.extend(entries)
+                used_items.extend(evolutionary_context_items)
+
+            # 5. コンテキストをキュレーション (デルタのみを既存項目と照合して重複を統合)
+            synthesized_delta = self.curator.synthesize_delta(delta_entries, used_items)
+            deduplicated_delta = self.curator.perform_deduplication(synthesized_delta, self.context_store, self.embedding_model)
+            # 6. 追加と追い出しの差分だけを1つの版としてストアに適用し、未生成の埋め込みを作る
+            self.curator.merge_delta(deduplicated_delta, self.context_store)
+            self.context_store.generate_and_store_embeddings(self.embedding_model)
+            self.context_store.advance_cycle()
+            self.context_store.flush()
+
+    @staticmethod
+    def _report_update_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Error updating context in background: %s", future.exception())
+
+    @property
+    def pending_updates(self):
+        return sum(1 for future in self._pending if not future.done())
+
+    def flush(self, timeout=None):
+        """
+        キューに積まれたコンテキスト更新がすべて適用されるまで待つ。
+        timeoutは全体で待つ秒数で、超えるとTimeoutErrorを送出する。
+        バックグラウンドで発生した例外はここで再送出される。
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for future in list(self._pending):
+            try:
+                future.result(timeout=None if deadline is None else max(0.0, deadline - time.perf_counter()))
+            finally:
+                # 完了した（失敗を含む）更新だけを取り除き、タイムアウトした更新は次のflush()で待てるよう残す
+                self._pending = [pending for pending in self._pending if not pending.done()]
+
+    def close(self):
+        """未処理の更新を待ち、このオーケストレーターが作ったスレッドプールを停止する。"""
+        self.flush()
+        if self._executor is not None and self._owns_executor:
+            self._executor.shutdown()
+        if self._owns_retrieval_pool:
+            # タイムアウトした外部検索の完了は待たない
+            self._retrieval_pool.shutdown(wait=False, cancel_futures=True)
+
+    def run_offline_adaptation(self, dataset, initial_context, epochs, top_k=5, batch_size=None, max_workers=None, clients=None, checkpoint_path=None):
+        """
+        データセットを複数エポック繰り返してコンテキストを適応させる。
+
+        batch_sizeを指定するとバッチモードになり、batch_size件のサンプルの生成と反省を
+        clients（Ollamaクライアントのリスト、省略時はジェネレーターのクライアント）に
+        振り分けて最大max_workers並列で実行し、集めたデルタをバッチごとに1回の
+        マージ/重複除去/剪定/埋め込みで適用する。バッチモードでcheckpoint_pathを指定すると
+        バッチごとに進捗を保存し、次回の呼び出しで続きから再開する。メモリ上のストアでは
+        コンテキスト（埋め込みと使用状況カウンタを含む）も毎回まとめて保存し、再開時に戻す。
+        永続化ストアではストアをflush()して進捗だけを保存し、再開時はストアの内容をそのまま使う
+        （保存の直前に中断した場合、最後のバッチがもう一度適用されることがある）。
+        チェックポイントは最後まで適応し終えたら削除し、サンプル数がデータセットと
+        合わないチェックポイントはValueErrorで拒否する。
+        """
+        logger.info("Running offline adaptation for %d epochs...", epochs)
+        self.flush()
+        if batch_size is None:
+            if checkpoint_path:
+                logger.warning("checkpoint_path is only supported in batch mode (batch_size). Ignoring it.")
+            with self.context_store.lock:
+                self.context_store.context = initial_context
+                self.context_store.generate_and_store_embeddings(self.embedding_model)
+            for epoch in range(epochs):
+                logger.info("Epoch %d/%d", epoch + 1, epochs)
+                for data_point in dataset:
+                    query = data_point.get("query")
+                    feedback = data_point.get("feedback")
+                    if query and feedback is not None:
+                        self.run_adaptation_cycle(query, feedback, mode="offline", top_k=top_k)
+            self.flush()
+            return self.context_store.context
+
+        samples = [(d.get("query"), d.get("feedback")) for d in dataset]
+        samples = [(query, feedback) for query, feedback in samples if query and feedback is not None]
+        start_epoch, start_index = 0, 0
+        checkpoint = self._load_checkpoint(checkpoint_path)
+        if checkpoint is not None:
+            if checkpoint.get("samples") != len(samples):
+                raise ValueError(
+                    f"Checkpoint {checkpoint_path} was saved for {checkpoint.get('samples')} samples, but the dataset has {len(samples)}. "
+                    "Delete it to start over."
+                )
+            start_epoch, start_index = checkpoint["epoch"], checkpoint["next_index"]
+            logger.info("Resuming from checkpoint at epoch %d, sample %d.", start_epoch + 1, start_index)
+        with self.context_store.lock:
+            if checkpoint is None:
+                self.context_store.context = initial_context
+            elif not self.context_store.persistent:
+                self._restore_checkpoint_context(checkpoint, checkpoint_path)
+            # 永続化ストアには前回のflush()までの内容が残っているので、そのまま続ける
+            self.context_store.generate_and_store_embeddings(self.embedding_model)
+
+        clients = clients or [self.generator.client]
+        workers = [self._bind_client(client) for client in clients]
+        with ThreadPoolExecutor(max_workers=max_workers or len(clients) * 2, thread_name_prefix="ace-offline") as pool:
+            for epoch in range(start_epoch, epochs):
+                logger.info("Epoch %d/%d", epoch + 1, epochs)
+                first = start_index if epoch == start_epoch else 0
+                for index in range(first, len(samples), batch_size):
+                    batch = samples[index:index + batch_size]
+                    futures = [
+                        pool.submit(self._run_offline_sample, query, feedback, top_k, *workers[(index + i) % len(workers)])
+                        for i, (query, feedback) in enumerate(batch)
+                    ]
+                    updates = []
+                    for future in futures:
+                        try:
+                            updates.append(future.result())
+                        except Exception as e:
+                            logger.error("Error in offline sample: %s", e)
+                    self._apply_updates(updates)
+                    logger.info("Applied batch of %d samples (%d/%d).", len(updates), index + len(batch), len(samples))
+                    next_epoch, next_index = (epoch, index + batch_size) if index + batch_size < len(samples) else (epoch + 1, 0)
+                    self._save_checkpoint(checkpoint_path, next_epoch, next_index, len(samples))
+        # 完了したチェックポイントを残すと、次回の呼び出しが適応せずに古いコンテキストを返してしまう
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
         return self.context_store.context
 
+    def run_batch(self, samples, top_k=5, adapt=False, clients=None, max_workers=None, embed_batch_size=32):
+        """
+        サンプル（"query"と任意の"feedback"・"id"を持つ辞書）のイテラブルを推論し、
+        完了した順に結果の辞書を返すジェネレーター。
+
+        クエリはembed_batch_size件ずつまとめて埋め込み、生成はclients（省略時はジェネレーターの
+        クライアント）のプールから1つずつ借りて最大max_workers（省略時はクライアント数）並列で実行する。
+        実行待ちを含めた処理中のサンプルはmax_workers + embed_batch_size件までに抑えるので、
+        入力が大きくてもメモリ使用量は一定に保たれる。
+
+        adapt=Falseでは進化的コンテキストを凍結して読むだけにし、adapt=Trueではフィードバックのある
+        サンプルごとに反省とキュレーションを行って、以降のサンプルに教訓を反映させる。
+        結果のlatency_sはサンプル1件の処理時間（按分したクエリ埋め込みと、ワーカーでの実行の合計）、
+        queue_sは埋め込み後にワーカーが空くまで待った秒数。
+        """
+        self.flush()
+        clients = clients or [self.generator.client]
+        idle = queue.Queue()
+        for client in clients:
+            idle.put(self._bind_client(client))
+        max_workers = max_workers or len(clients)
+        max_in_flight = max_workers + embed_batch_size
+        samples = iter(samples)
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ace-batch") as pool:
+            pending, exhausted = set(), False
+            while pending or not exhausted:
+                # 実行待ちが尽きる前に次のクエリをまとめて埋め込み、プールを空けないようにする
+                if not exhausted and len(pending) <= max_workers:
+                    batch = list(islice(samples, max_in_flight - len(pending)))
+                    if not batch:
+                        exhausted = True
+                        continue
+                    for start in range(0, len(batch), embed_batch_size):
+                        pending.update(self._submit_batch(pool, batch[start:start + embed_batch_size], top_k, adapt, idle))
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def _submit_batch(self, pool, batch, top_k, adapt, idle):
+        started = time.perf_counter()
+        try:
+            with tracer.span("embedding", kind="query", batch=len(batch)):
+                query_embeddings = np.asarray(self.embedding_model.encode([sample["query"] for sample in batch]), dtype=np.float32)
+        except Exception as e:
+            # 埋め込みに失敗したバッチのサンプルはエラーとして返し、残りの処理は続ける
+            logger.error("Error embedding batch of %d queries: %s", len(batch), e)
+            failed = []
+            for sample in batch:
+                future = Future()
+                future.set_result({
+                    "id": sample.get("id"), "query": sample["query"], "error": f"{type(e).__name__}: {e}",
+                    "latency_s": time.perf_counter() - started, "metrics": {},
+                })
+                failed.append(future)
+            return failed
+        # バッチの埋め込み時間をサンプル数で按分して各サンプルのmetricsに記録する
+        embedded = time.perf_counter()
+        embedding_latency = (embedded - started) / len(batch)
+        return [
+            pool.submit(self._run_batch_sample, sample, query_embedding, embedding_latency, embedded, top_k, adapt, idle)
+            for sample, query_embedding in zip(batch, query_embeddings)
+        ]
+
+    def _run_batch_sample(self, sample, query_embedding, embedding_latency, embedded, top_k, adapt, idle):
+        began = time.perf_counter()
+        query, feedback = sample["query"], sample.get("feedback")
+        result = {"id": sample.get("id"), "query": query}
+        metrics = {"query_embedding_latency": embedding_latency}
+        try:
+            generator, reflector = idle.get()
+            try:
+                trajectory, _, evolutionary_context_items = self._generate(query, top_k, metrics, generator, query_embedding)
+                update = None
+                if adapt and feedback is not None:
+                    reflection_start = time.perf_counter()
+                    update = self._reflect(query, feedback, trajectory, evolutionary_context_items, reflector)
+                    metrics["reflection_latency"] = time.perf_counter() - reflection_start
+            finally:
+                # キュレーションはLLMを使わないので、先にクライアントを返す
+                idle.put((generator, reflector))
+            if update is not None:
+                curation_start = time.perf_counter()
+                self._apply_updates([update])
+                metrics["curation_latency"] = time.perf_counter() - curation_start
+            result["answer"] = trajectory
+        except Exception as e:
+            logger.error("Error in batch sample %s: %s", result["id"], e)
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["latency_s"] = embedding_latency + time.perf_counter() - began
+        result["queue_s"] = began - embedded
+        result["metrics"] = metrics
+        return result
+
+    def _bind_client(self, client):
+        """指定したクライアントを使うジェネレーターとリフレクターの複製を作る。"""
+        generator, reflector = copy.copy(self.generator), copy.copy(self.reflector)
+        generator.client = client
+        reflector.client = client
+        return generator, reflector
+
+    def _run_offline_sample(self, query, feedback, top_k, generator, reflector):
+        trajectory, _, evolutionary_context_items = self._generate(query, top_k, {}, generator)
+        return self._reflect(query, feedback, trajectory, evolutionary_context_items, reflector)
+
+    @staticmethod
+    def _load_checkpoint(checkpoint_path):
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_checkpoint(self, checkpoint_path, epoch, next_index, num_samples):
+        """
+        進捗を保存する。永続化ストアは内容を書き出したうえで進捗だけを、メモリ上のストアは
+        項目ごとの本文・メタデータ・使用状況カウンタ・埋め込みとサイクルも保存する。
+        """
+        if not checkpoint_path:
+            return
+        checkpoint = {"epoch": epoch, "next_index": next_index, "samples": num_samples}
+        store = self.context_store
+        with store.lock:
+            if store.persistent:
+                store.flush()
+            else:
+                checkpoint["cycle"] = store.cycle
+                checkpoint["context"] = []
+                for item in store.context:
+                    entry = {"content": item["content"], "metadata": item.get("metadata", {}), "usage": store.usage(item)}
+                    embedding = store.get_embedding(item)
+                    if embedding is not None:
+                        entry["embedding"] = base64.b64encode(embedding.astype(np.float32).tobytes()).decode("ascii")
+                    checkpoint["context"].append(entry)
+        # 書き込み途中でクラッシュしても前回のチェックポイントが壊れないよう、置き換えで保存する
+        temp_path = f"{checkpoint_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, default=str)
+        os.replace(temp_path, checkpoint_path)
+
+    def _restore_checkpoint_context(self, checkpoint, checkpoint_path):
+        """メモリ上のストアの内容を、チェックポイントの項目・埋め込み・使用状況カウンタ・サイクルに戻す。"""
+        if "context" not in checkpoint:
+            raise ValueError(f"Checkpoint {checkpoint_path} was saved for a persistent context store and has no context to restore.")
+        items = []
+        for entry in checkpoint["context"]:
+            item = {"content": entry["content"], "metadata": entry.get("metadata", {})}
+            if "embedding" in entry:
+                item["embedding"] = np.frombuffer(base64.b64decode(entry["embedding"]), dtype=np.float32)
+            items.append(item)
+        self.context_store.context = items
+        usages = [(item, entry["usage"]) for item, entry in zip(items, checkpoint["context"]) if "usage" in entry]
+        self.context_store.restore_usage(usages, checkpoint.get("cycle", self.context_store.cycle))
+
     def run_online_adaptation(self, stream_of_tasks, initial_context, top_k=5):
-        print("\n--- Running online adaptation... ---")
-        self.context_store.context = initial_context
-        self.context_store.generate_and_store_embeddings(self.embedding_model)
+        logger.info("Running online adaptation...")
+        self.flush()
+        with self.context_store.lock:
+            self.context_store.context = initial_context
+            self.context_store.generate_and_store_embeddings(self.embedding_model)
 
         for task in stream_of_tasks:
             query = task.get("query")
             feedback = task.get("feedback")
             if query and feedback is not None:
                  self.run_adaptation_cycle(query, feedback, mode="online", top_k=top_k)
+        self.flush()
         return self.context_store.context
@@ -0,0 +1,281 @@
+# ace_framework/persistent_store.py
+
+import json
+import logging
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windowsではファイルロックを使わない
+    fcntl = None
+
+from .context_store import ContextStore
+
+logger = logging.getLogger(__name__)
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# 行数が増えてもヘッダ長が変わらないよう、ヘッダを固定長で確保する
+_NPY_HEADER_SIZE = 128
+# SQLiteに保存する使用状況カウンタの列と、対応するスロット配列
+_USAGE_COLUMNS = {"hits": "_hits", "last_used": "_last_used", "helpful": "_helpful", "harmful": "_harmful"}
+
+
+class StoreLockedError(RuntimeError):
+    """書き込み用に開こうとしたストアを、別のプロセス（または別のインスタンス）が書き込み用に開いている。"""
+
+
+def _write_npy_header(f, shape, dtype):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d, %d), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), shape[0], shape[1]
+    )
+    header_len = _NPY_HEADER_SIZE - len(_NPY_MAGIC) - 2
+    f.seek(0)
+    f.write(_NPY_MAGIC + struct.pack("<H", header_len) + (header.ljust(header_len - 1) + "\n").encode("latin1"))
+
+
+def _read_npy_header(path):
+    with open(path, "rb") as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            raise ValueError(f"Unsupported .npy version in {path}")
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        return shape, dtype, f.tell()
+
+
+class PersistentContextStore(ContextStore):
+    """
+    目的：進化型コンテキストをディスクに永続化し、再起動後も再埋め込みなしで再開できるようにします。
+
+    項目のメタデータはSQLite（bullets.sqlite）、埋め込みはメモリマップされた
+    .npy（embeddings.npy）に保存します。スロット番号がそのままSQLiteの主キーと
+    .npyの行番号になるため、追加は行の追記、削除は削除フラグの更新だけで済みます。
+    readonly=Trueで開くと埋め込みのページを複数のワーカープロセスで共有できます。
+    書き込み用に開けるのは同時に1つだけで、ディレクトリのwrite.lockを排他ロックし、
+    すでに他で開かれていればStoreLockedErrorを送出します（読み取り専用では何度でも開けます）。
+    使用状況カウンタは検索のたびには書き込まず、flush()時に変化した行だけを保存します。
+    """
+    persistent = True
+
+    def __init__(self, path, dtype=np.float32, readonly=False, initial_capacity=1024, index=None, exact_search_threshold=10000):
+        super().__init__(dtype=dtype, initial_capacity=initial_capacity, index=index, exact_search_threshold=exact_search_threshold)
+        self.path = path
+        self.readonly = readonly
+        self._lock_file = None
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+            self._acquire_write_lock()
+        self._matrix_path = os.path.join(path, "embeddings.npy")
+        db_path = os.path.join(path, "bullets.sqlite")
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS bullets ("
+                "slot INTEGER PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL, "
+                "has_embedding INTEGER NOT NULL DEFAULT 0, deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(bullets)")}
+            for column in _USAGE_COLUMNS:
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE bullets ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+            self._conn.commit()
+        self._load()
+
+    def _load(self):
+        usage_columns = ", ".join(_USAGE_COLUMNS)
+        rows = self._conn.execute(f"SELECT slot, content, metadata, has_embedding, deleted, {usage_columns} FROM bullets ORDER BY slot").fetchall()
+        try:
+            cycle = self._conn.execute("SELECT value FROM store_info WHERE key = 'cycle'").fetchone()
+        except sqlite3.OperationalError:
+            cycle = None
+        self.cycle = int(cycle[0]) if cycle else 0
+        capacity = len(rows)
+        if os.path.exists(self._matrix_path):
+            shape, dtype, offset = _read_npy_header(self._matrix_path)
+            self.dtype = dtype
+            capacity = max(capacity, shape[0])
+            self._matrix = np.memmap(self._matrix_path, dtype=dtype, mode="r" if self.readonly else "r+", offset=offset, shape=shape)
+        for name, dtype in self._SLOT_ARRAYS.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        # 読み込んだ内容は最初の版 (version + 1) として公開する
+        for slot, content, metadata, has_embedding, deleted, *usage in rows:
+            if deleted:
+                self._bullets.append(None)
+                self._slot_items.append(None)
+                self._removed_version[slot] = self.version + 1
+                continue
+            item = {"content": content, "metadata": json.loads(metadata)}
+            self._bullets.append(item)
+            self._slot_items.append(item)
+            self._slot_of[id(item)] = slot
+            self._slot_of_content.setdefault(content, slot)
+            self._is_live[slot] = True
+            self._num_live += 1
+            self._content_bytes += len(content.encode("utf-8"))
+            for name, value in zip(_USAGE_COLUMNS.values(), usage):
+                getattr(self, name)[slot] = value
+            # 行列に行が無いスロットは（古い形式で中断した場合も）埋め込み無しとして扱い、生成し直す
+            if has_embedding and self._matrix is not None and slot < len(self._matrix):
+                self._has_embedding[slot] = True
+                self._embedded_version[slot] = self.version + 1
+                self._num_embedded += 1
+        self._flushed_usage = self._usage_snapshot()
+        if self.index is not None and self._num_embedded:
+            embedded = np.flatnonzero(self._has_embedding[:len(self._bullets)])
+            self.index.add(embedded, np.asarray(self._matrix[embedded], dtype=np.float32))
+        self._publish()
+        logger.info("Opened context store at %s with %d bullets.", self.path, self._num_live)
+
+    def add_bullets(self, items):
+        items = [item for item in items if id(item) not in self._slot_of]
+        if not items:
+            return
+        self._check_writable()
+        with self.lock:
+            # 共有の行列やメモリ上の状態を変える前にSQLiteへ挿入し、失敗したら何も変えない。
+            # has_embeddingは行を書き終えた後に_write_rowsが立てるので、途中で落ちても
+            # ベクトルの無い行が埋め込み済みとして読まれることはない
+            start = len(self._bullets)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO bullets (slot, content, metadata, last_used) VALUES (?, ?, ?, ?)",
+                    [
+                        (slot, item["content"], json.dumps(item.get("metadata") or {}, ensure_ascii=False, default=str), self.cycle)
+                        for slot, item in enumerate(items, start)
+                    ],
+                )
+            super().add_bullets(items)
+
+    def replace_metadata(self, updates):
+        updates = list(updates)
+        if updates:
+            self._check_writable()
+        with self.lock:
+            replaced = super().replace_metadata(updates)
+            if replaced:
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE bullets SET metadata = ? WHERE slot = ?",
+                        [(json.dumps(item["metadata"], ensure_ascii=False, default=str), self._slot_of[id(item)]) for item in replaced],
+                    )
+        return replaced
+
+    def _write_rows(self, slots, vectors):
+        self._check_writable()
+        super()._write_rows(slots, vectors)
+        with self._conn:
+            self._conn.executemany("UPDATE bullets SET has_embedding = 1 WHERE slot = ?", [(int(slot),) for slot in slots])
+
+    def _remove_slots(self, slots):
+        if slots:
+            self._check_writable()
+            with self._conn:
+                self._conn.executemany("UPDATE bullets SET deleted = 1 WHERE slot = ?", [(int(slot),) for slot in slots])
+        super()._remove_slots(slots)
+
+    def _maybe_compact(self):
+        # 追記専用の形式を保つため、詰め直しはcompact()の明示的な呼び出し時のみ行う
+        pass
+
+    def compact(self):
+        """削除済みスロットを取り除き、SQLiteと.npyの両方を詰め直す。"""
+        self._check_writable()
+        with self._writing():
+            self.flush()
+            live_slots = [slot for slot, item in enumerate(self._bullets) if item is not None]
+            self._compact()
+            with self._conn:
+                self._conn.execute("DELETE FROM bullets WHERE deleted = 1")
+                # 昇順に振り直すので主キーが衝突することはない
+                self._conn.executemany(
+                    "UPDATE bullets SET slot = ? WHERE slot = ?",
+                    [(new, old) for new, old in enumerate(live_slots) if new != old],
+                )
+            self._flushed_usage = self._usage_snapshot()
+            self.flush()
+
+    def _compacted_matrix(self, live):
+        # 別ファイルに詰め直してから置き換える。公開済みのスナップショットは
+        # 置き換え前のファイルのメモリマップを参照し続けられる
+        capacity, dim = self._matrix.shape
+        self._matrix.flush()
+        temp_path = f"{self._matrix_path}.tmp"
+        with open(temp_path, "w+b") as f:
+            _write_npy_header(f, (capacity, dim), self.dtype)
+            f.truncate(_NPY_HEADER_SIZE + capacity * dim * self.dtype.itemsize)
+        matrix = np.memmap(temp_path, dtype=self.dtype, mode="r+", offset=_NPY_HEADER_SIZE, shape=(capacity, dim))
+        matrix[:len(live)] = self._matrix[live]
+        matrix.flush()
+        os.replace(temp_path, self._matrix_path)
+        return matrix
+
+    def _resize_matrix(self, capacity, dim):
+        self._check_writable()
+        if self._matrix is not None:
+            self._matrix.flush()
+        exists = os.path.exists(self._matrix_path)
+        with open(self._matrix_path, "r+b" if exists else "w+b") as f:
+            _write_npy_header(f, (capacity, dim), self.dtype)
+            # 拡張した領域はゼロで埋められる（疎ファイル）
+            f.truncate(_NPY_HEADER_SIZE + capacity * dim * self.dtype.itemsize)
+        return np.memmap(self._matrix_path, dtype=self.dtype, mode="r+", offset=_NPY_HEADER_SIZE, shape=(capacity, dim))
+
+    def _acquire_write_lock(self):
+        if fcntl is None:
+            logger.warning("File locking is unavailable on this platform; make sure only one process writes to %s.", self.path)
+            return
+        lock_file = open(os.path.join(self.path, "write.lock"), "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise StoreLockedError(
+                f"Context store at {self.path} is already open for writing by another process. Open it with readonly=True instead."
+            ) from None
+        self._lock_file = lock_file
+
+    def _check_writable(self):
+        if self.readonly:
+            raise PermissionError(f"Context store at {self.path} was opened read-only.")
+
+    def _usage_snapshot(self):
+        n = len(self._bullets)
+        return {name: getattr(self, name)[:n].copy() for name in _USAGE_COLUMNS.values()}
+
+    def flush(self):
+        """メモリマップされた埋め込みと、前回から変化した使用状況カウンタをディスクに書き出す。"""
+        if self.readonly:
+            return
+        if self._matrix is not None:
+            self._matrix.flush()
+        current = self._usage_snapshot()
+        n = len(self._bullets)
+        changed = np.zeros(n, dtype=bool)
+        for name, values in current.items():
+            previous = self._flushed_usage[name]
+            changed[:len(previous)] |= values[:len(previous)] != previous
+            changed[len(previous):] = True
+        changed &= self._is_live[:n]
+        slots = np.flatnonzero(changed).tolist()
+        assignments = ", ".join(f"{column} = ?" for column in _USAGE_COLUMNS)
+        with self._conn:
+            if slots:
+                self._conn.executemany(
+                    f"UPDATE bullets SET {assignments} WHERE slot = ?",
+                    [tuple(int(current[name][slot]) for name in _USAGE_COLUMNS.values()) + (slot,) for slot in slots],
+                )
+            self._conn.execute("INSERT OR REPLACE INTO store_info (key, value) VALUES ('cycle', ?)", (str(self.cycle),))
+        self._flushed_usage = current
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
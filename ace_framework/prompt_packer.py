@@ -0,0 +1,189 @@
+# ace_framework/prompt_packer.py
+
+import math
+import re
+from dataclasses import dataclass, field
+
+# 日本語（かな・漢字・全角記号）やハングルは概ね1文字1トークン、それ以外は約4文字1トークンとみなす
+_WIDE_CHARS = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    """トークナイザーが無い場合のトークン数の見積もり。"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def _normalize(text):
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _suffix_prefix_overlap(a, b, min_chars):
+    """aの末尾とbの先頭が一致する最長の長さ（min_chars未満なら0）を返す。"""
+    probe = b[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    # 最初に見つかった位置が最長の重なりになる
+    start = a.find(probe, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(probe, start + 1)
+    return 0
+
+
+@dataclass
+class PackedPrompt:
+    prompt: str
+    bullets: list
+    chunks: list
+    prompt_tokens: int
+    section_tokens: dict = field(default_factory=dict)
+    dropped: dict = field(default_factory=dict)
+
+
+class PromptPacker:
+    """
+    目的：進化的コンテキストと外部コンテキストをトークン予算内に収めてプロンプトを組み立てます。
+
+    - 重複した項目と、チャンク同士（chunk_overlapによる）の重なりを取り除き、
+      予算内に採用したものの間では、チャンクに含まれる項目（またはその逆）も一方だけを残します
+      （min_contained_chars未満の短い本文は対象外）。
+    - 指示と定型部分・クエリを除いた残りの予算のうち、evolutionary_shareまでを
+      進化的コンテキストに割り当て、余りを外部コンテキストに回します。項目は順位の高い順に
+      丸ごと入るものだけを採用します。
+    - 採用した進化的コンテキストは本文順に並べ、同じ項目集合なら同じ文字列になるようにして、
+      LLMサーバーのプレフィックスKVキャッシュを再利用しやすくします
+      （セクションの並び自体はGenerator.build_promptが指示→進化的→外部→クエリの順に組み立てる）。
+
+    tokenizerには、文字列からトークン数を返す関数か、encode()でトークン列を返すオブジェクト
+    （Hugging Faceのトークナイザーやtiktokenなど）を渡せます。省略時はestimate_tokensで見積もります。
+    """
+    def __init__(self, max_tokens=4096, tokenizer=None, evolutionary_share=0.4, min_overlap_chars=50, min_contained_chars=20):
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
+        self.evolutionary_share = evolutionary_share
+        self.min_overlap_chars = min_overlap_chars
+        self.min_contained_chars = min_contained_chars
+
+    def count_tokens(self, text):
+        if self.tokenizer is None:
+            return estimate_tokens(text)
+        if hasattr(self.tokenizer, "encode"):
+            return len(self.tokenizer.encode(text))
+        return self.tokenizer(text)
+
+    def pack(self, build_prompt, bullets, chunks):
+        """
+        build_prompt(進化的コンテキスト文字列, 外部コンテキスト文字列) でプロンプトを作る関数と、
+        順位順の進化的コンテキスト項目（辞書）・外部チャンク（文字列）を受け取り、PackedPromptを返す。
+        """
+        dropped = {"duplicate_bullets": 0, "duplicate_chunks": 0, "trimmed_chunks": 0, "over_budget": 0}
+        bullets = self._dedupe_bullets(bullets, dropped)
+        chunks = self._dedupe_chunks(chunks, dropped)
+
+        template_tokens = self.count_tokens(build_prompt("", ""))
+        available = max(0, self.max_tokens - template_tokens)
+        selected_bullets = self._select(bullets, lambda item: f"- {item['content']}\n", int(available * self.evolutionary_share), dropped)
+        evolutionary_tokens = sum(self.count_tokens(f"- {item['content']}\n") for item in selected_bullets)
+        selected_chunks = self._select(chunks, lambda chunk: f"{chunk}\n\n", available - evolutionary_tokens, dropped)
+
+        selected_bullets.sort(key=lambda item: item["content"])
+        while True:
+            prompt, evolutionary_context, external_context = self._render(build_prompt, selected_bullets, selected_chunks)
+            prompt_tokens = self.count_tokens(prompt)
+            # トークン数は連結で厳密には加算的でないので、超えた分は外部チャンクの末尾から（無ければ項目から）削る
+            if prompt_tokens <= self.max_tokens or not (selected_chunks or selected_bullets):
+                break
+            (selected_chunks or selected_bullets).pop()
+            dropped["over_budget"] += 1
+
+        # 項目と外部チャンクの間の重複は、実際にプロンプトに入るもの同士でだけ取り除く
+        # （予算で削られるチャンクを理由に項目を落とすと、両方とも失われるため）
+        deduplicated = self._dedupe_across(selected_bullets, selected_chunks, dropped)
+        if deduplicated != (selected_bullets, selected_chunks):
+            selected_bullets, selected_chunks = deduplicated
+            prompt, evolutionary_context, external_context = self._render(build_prompt, selected_bullets, selected_chunks)
+            prompt_tokens = self.count_tokens(prompt)
+
+        section_tokens = {
+            "template": template_tokens,
+            "evolutionary": self.count_tokens(evolutionary_context),
+            "external": self.count_tokens(external_context),
+        }
+        return PackedPrompt(prompt, selected_bullets, selected_chunks, prompt_tokens, section_tokens, dropped)
+
+    @staticmethod
+    def _render(build_prompt, bullets, chunks):
+        evolutionary_context = "\n".join(f"- {item['content']}" for item in bullets)
+        external_context = "\n\n".join(chunks)
+        return build_prompt(evolutionary_context, external_context), evolutionary_context, external_context
+
+    def _dedupe_across(self, bullets, chunks, dropped):
+        """
+        項目を丸ごと含むチャンクは残してその項目を落とし、項目に含まれるチャンクは落とす。
+        min_contained_chars未満の短い本文は、言い回しが偶然一致しただけのことが多いので落とさない。
+        """
+        normalized_bullets = [_normalize(item["content"]) for item in bullets]
+        kept_chunks = []
+        for chunk in chunks:
+            text = _normalize(chunk)
+            if len(text) >= self.min_contained_chars and any(text in bullet for bullet in normalized_bullets):
+                dropped["duplicate_chunks"] += 1
+            else:
+                kept_chunks.append(chunk)
+        normalized_chunks = [_normalize(chunk) for chunk in kept_chunks]
+        kept_bullets = []
+        for item, text in zip(bullets, normalized_bullets):
+            if len(text) >= self.min_contained_chars and any(text in chunk for chunk in normalized_chunks):
+                dropped["duplicate_bullets"] += 1
+            else:
+                kept_bullets.append(item)
+        return kept_bullets, kept_chunks
+
+    def _select(self, items, render, budget, dropped):
+        selected, used = [], 0
+        for item in items:
+            cost = self.count_tokens(render(item))
+            if used + cost <= budget:
+                selected.append(item)
+                used += cost
+            else:
+                dropped["over_budget"] += 1
+        return selected
+
+    def _dedupe_bullets(self, bullets, dropped):
+        seen, result = set(), []
+        for item in bullets:
+            key = _normalize(item["content"])
+            if not key or key in seen:
+                dropped["duplicate_bullets"] += 1
+                continue
+            seen.add(key)
+            result.append(item)
+        return result
+
+    def _dedupe_chunks(self, chunks, dropped):
+        """完全に含まれるチャンクを落とし、既に採用したチャンクと重なる先頭・末尾を切り詰める。"""
+        result = []
+        for chunk in chunks:
+            chunk = chunk.strip()
+            if not chunk or any(chunk in other for other in result):
+                dropped["duplicate_chunks"] += 1
+                continue
+            original = chunk
+            for other in result:
+                head = _suffix_prefix_overlap(other, chunk, self.min_overlap_chars)
+                if head:
+                    chunk = chunk[head:].lstrip()
+                tail = _suffix_prefix_overlap(chunk, other, self.min_overlap_chars)
+                if tail:
+                    chunk = chunk[:-tail].rstrip()
+            if not chunk:
+                dropped["duplicate_chunks"] += 1
+                continue
+            if chunk != original:
+                dropped["trimmed_chunks"] += 1
+            result.append(chunk)
+        return result
@@ -1,89 +1,211 @@
 # ace_framework/reflector.py
 
-from pydantic import BaseModel, Field
+import logging
+
+from pydantic import BaseModel, Field, ValidationError
 from typing import List
 
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
 # Pydanticモデルの定義：抽出する洞察の構造
 class Insight(BaseModel):
     content: str = Field(..., description="再利用可能な教訓または観察事項")
 
 class InsightsList(BaseModel):
     insights: List[Insight] = Field(..., description="抽出された洞察のリスト")
+    helpful_bullet_ids: List[int] = Field(default_factory=list, description="回答に役立った進化的コンテキスト項目の番号")
+    harmful_bullet_ids: List[int] = Field(default_factory=list, description="回答を誤らせた進化的コンテキスト項目の番号")
+
+class ReflectionResult(BaseModel):
+    """単一パスの反省で使う構造：プロパティの順に生成されるので、批判的な反省を先に書かせてから洞察を抽出させる。"""
+    critique: str = Field(..., description="推論軌跡に対する批判的な反省（何がうまくいき、何がうまくいかなかったか、その理由）")
+    insights: List[Insight] = Field(..., description="反省から抽出された再利用可能な洞察のリスト")
+    helpful_bullet_ids: List[int] = Field(default_factory=list, description="回答に役立った進化的コンテキスト項目の番号")
+    harmful_bullet_ids: List[int] = Field(default_factory=list, description="回答を誤らせた進化的コンテキスト項目の番号")
+
+
+def _format_bullets(bullets):
+    """進化的コンテキスト項目を番号付きで列挙する（helpful/harmful判定の参照用）。"""
+    return "\n".join(f"[{i}] {item['content']}" for i, item in enumerate(bullets))
+
+def _insights_and_tags(result, bullets):
+    """検証済みの構造化出力から (空でない洞察のリスト, helpful/harmful判定) を取り出す。"""
+    insights = [item.content.strip() for item in result.insights if item.content.strip()]
+    tags = {
+        "helpful": [bullets[i] for i in set(result.helpful_bullet_ids) if 0 <= i < len(bullets)],
+        "harmful": [bullets[i] for i in set(result.harmful_bullet_ids) if 0 <= i < len(bullets)],
+    }
+    return insights, tags
 
 class Reflector:
     """
     目的：ジェネレーターのパフォーマンスを批判的に分析し、実行可能な洞察を抽出します。
+
+    optionsはOllamaのchat()にそのまま渡す生成オプション（temperature・seedなど）です。
     """
-    def __init__(self, client, model_name):
+    def __init__(self, client, model_name, single_pass=False, max_retries=2, options=None):
         self.client = client
         self.model_name = model_name
+        self.options = options or None
+        # single_pass=Trueの場合、反省と洞察の抽出を1回の構造化出力呼び出しで行う
+        self.single_pass = single_pass
+        self.max_retries = max_retries
 
-    def reflect_on_trajectory(self, trajectory, feedback):
-        print(f"Reflecting on trajectory with feedback: '{feedback}'")
+    def reflect_on_trajectory(self, trajectory, feedback, bullets=None):
+        """
+        推論軌跡とフィードバックに対する批判的な反省文を返す。LLMの呼び出しに失敗した場合は
+        Noneを返す（エラー文を反省として洞察の抽出に渡さない）。
+        """
+        logger.info("Reflecting on trajectory with feedback: '%s'", feedback)
+        bullets_section = ""
+        if bullets:
+            bullets_section = f"""
+使用した進化的コンテキスト:
+{_format_bullets(bullets)}
+"""
         prompt = f"""以下の推論軌跡とフィードバックを分析してください。批判的な反省を提供してください。応答は日本語で行ってください。
 推論軌跡:
 {trajectory}
 
 フィードバック:
 {feedback}
-
+{bullets_section}
 何がうまくいったか、何がうまくいかなかったか、そしてその理由を特定してください。
 """
-        print("\n--- Reflection Prompt Sent to LLM ---")
-        print(prompt)
-        print("----------------------------------\n")
+        logger.debug("Reflection prompt sent to LLM:\n%s", prompt)
         try:
              # Ollama chat APIを使用
-            response = self.client.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt,
-                    }
-                ]
-            )
+            with tracer.span("reflection", model=self.model_name):
+                response = self.client.chat(
+                    model=self.model_name,
+                    messages=[
+                        {
+                            'role': 'user',
+                            'content': prompt,
+                        }
+                    ],
+                    options=self.options
+                )
+            tracer.record_llm_usage(response, "reflection")
             return response['message']['content'] # chat APIの応答形式に対応
         except Exception as e:
-            print(f"Error reflecting on trajectory: {e}")
-            return "推論軌跡の反省中にエラーが発生しました。"
+            logger.error("Error reflecting on trajectory: %s", e)
+            return None
 
     def distill_insights(self, reflection_output):
-        print(f"Distilling insights from reflection into structured format...")
+        insights, _ = self.distill_insights_and_tags(reflection_output)
+        return insights
+
+    def distill_insights_and_tags(self, reflection_output, bullets=None):
+        """
+        反省結果から洞察を抽出し、同じ呼び出しで使用した進化的コンテキスト項目の
+        helpful/harmful判定も得る。戻り値は (洞察のリスト, {"helpful": [...], "harmful": [...]})。
+        """
+        logger.info("Distilling insights from reflection into structured format...")
+        raw_content = "N/A"
+        tags = {"helpful": [], "harmful": []}
+        bullets = bullets or []
+        bullets_section = ""
+        if bullets:
+            bullets_section = f"""
+使用した進化的コンテキスト:
+{_format_bullets(bullets)}
+
+回答に役立った項目の番号をhelpful_bullet_idsに、回答を誤らせた項目の番号をharmful_bullet_idsに含めてください。
+"""
         prompt = f"""以下の反省結果から、具体的で再利用可能な教訓または洞察を抽出してください。出力は提供されたJSONスキーマに厳密に従ったJSONオブジェクト形式で行ってください。応答内容は日本語で記述してください。
 反省結果:
 {reflection_output}
-
+{bullets_section}
 このJSONスキーマに厳密に従ってください:
 {InsightsList.model_json_schema()}
 """
-        print("\n--- Distillation Prompt Sent to LLM ---")
-        print(prompt)
-        print("----------------------------------\n")
+        logger.debug("Distillation prompt sent to LLM:\n%s", prompt)
         try:
             # Ollama chat APIと構造化出力を使用
-            response = self.client.chat(
-                model=self.model_name,
-                messages=[
-                    {
-                        'role': 'user',
-                        'content': prompt,
-                    }
-                ],
-                format='json' # JSON形式での出力を要求
-            )
+            with tracer.span("distillation", model=self.model_name):
+                response = self.client.chat(
+                    model=self.model_name,
+                    messages=[
+                        {
+                            'role': 'user',
+                            'content': prompt,
+                        }
+                    ],
+                    format='json', # JSON形式での出力を要求
+                    options=self.options
+                )
+            tracer.record_llm_usage(response, "distillation")
             # JSON応答をパースしてPydanticモデルに検証
-            insights_data = response['message']['content']
+            insights_data = raw_content = response['message']['content']
             insights_list_obj = InsightsList.model_validate_json(insights_data)
             # Pydanticオブジェクトから洞察のリスト（文字列）を抽出
-            insights = [item.content for item in insights_list_obj.insights]
-            return insights
+            return _insights_and_tags(insights_list_obj, bullets)
         except Exception as e:
-            print(f"Error distilling insights: {e}")
-            print(f"Raw response content: {response.get('message', {}).get('content', 'N/A')}")
-            return ["洞察の抽出中にエラーが発生しました。"]
+            # エラーメッセージを洞察として返すとコンテキストを汚染するため、空のリストを返す
+            logger.error("Error distilling insights: %s", e)
+            logger.debug("Raw response content: %s", raw_content)
+            return [], tags
+
+    def reflect_and_distill(self, trajectory, feedback, bullets=None):
+        """
+        反省と洞察の抽出を1回のLLM呼び出しで行う（single_passモード）。
+        ReflectionResultのJSONスキーマをformatに渡して出力を制約し、検証に失敗した場合は
+        エラー内容を添えて最大max_retries回まで修正を依頼する。
+        戻り値は (反省文, 洞察のリスト, {"helpful": [...], "harmful": [...]})。
+        すべて失敗した場合は洞察を空にし、エラー文字列をコンテキストに入れない。
+        """
+        logger.info("Reflecting and distilling insights in a single pass with feedback: '%s'", feedback)
+        bullets = bullets or []
+        bullets_section = ""
+        if bullets:
+            bullets_section = f"""
+使用した進化的コンテキスト:
+{_format_bullets(bullets)}
+
+回答に役立った項目の番号をhelpful_bullet_idsに、回答を誤らせた項目の番号をharmful_bullet_idsに含めてください。
+"""
+        prompt = f"""以下の推論軌跡とフィードバックを分析してください。応答は日本語で行ってください。
+推論軌跡:
+{trajectory}
+
+フィードバック:
+{feedback}
+{bullets_section}
+まずcritiqueに、何がうまくいったか、何がうまくいかなかったか、そしてその理由を批判的に記述してください。
+次にinsightsに、その反省から得られる具体的で再利用可能な教訓または洞察を列挙してください。
+出力は提供されたJSONスキーマに厳密に従ったJSONオブジェクト形式で行ってください。
+"""
+        logger.debug("Single-pass reflection prompt sent to LLM:\n%s", prompt)
+        messages = [{'role': 'user', 'content': prompt}]
+        schema = ReflectionResult.model_json_schema()
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Ollamaの構造化出力：formatにJSONスキーマを渡して出力を制約する
+                with tracer.span("reflection", model=self.model_name, single_pass=True, attempt=attempt + 1):
+                    response = self.client.chat(model=self.model_name, messages=messages, format=schema, options=self.options)
+                tracer.record_llm_usage(response, "reflection")
+                content = response['message']['content']
+            except Exception as e:
+                logger.error("Error reflecting on trajectory: %s", e)
+                break
+            try:
+                result = ReflectionResult.model_validate_json(content)
+                insights, tags = _insights_and_tags(result, bullets)
+                return result.critique, insights, tags
+            except ValidationError as e:
+                tracer.add("reflection_repairs", stage="reflection")
+                logger.warning("Invalid reflection output (attempt %d/%d): %s", attempt + 1, self.max_retries + 1, e)
+                # 不正な出力と検証エラーを会話に加え、修正したJSONを再度求める
+                messages = messages[:1] + [
+                    {'role': 'assistant', 'content': content},
+                    {'role': 'user', 'content': f"上記の出力はJSONスキーマの検証に失敗しました。\n{e}\nスキーマに従う修正済みのJSONオブジェクトのみを出力してください。"},
+                ]
+        return "", [], {"helpful": [], "harmful": []}
 
     def format_delta_entries(self, insights):
-        print("Formatting insights into delta entries...")
+        logger.debug("Formatting insights into delta entries...")
         # 抽出された洞察は既に意味のある単位になっていると仮定し、そのままdelta entryに変換
         return [{"content": i, "metadata": {}} for i in insights]
@@ -0,0 +1,189 @@
+# ace_framework/tracing.py
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer:
+    """
+    目的：各ステージ（retrieval / generation / reflection / distillation / curation / embedding）の
+    所要時間をスパンとして、項目の追加・統合・剪定数やLLMのトークン数をカウンターとして集計します。
+
+    スパンは終了するたびに登録されたエクスポーターのexport_span()に渡され、
+    集計値（スパンごとの回数・合計・最大、カウンター）はsnapshot()で取り出せます。
+    flush()は集計値をエクスポーターのexport_snapshot()に渡します（Prometheusのテキスト形式など）。
+    """
+    def __init__(self, exporters=None):
+        self.exporters = list(exporters or [])
+        self._lock = threading.Lock()
+        self._spans = {}     # name -> {"count", "total_s", "max_s"}
+        self._counters = {}  # (name, ラベルのタプル) -> 値
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                stats = self._spans.setdefault(name, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+                stats["count"] += 1
+                stats["total_s"] += duration
+                stats["max_s"] = max(stats["max_s"], duration)
+            record = {"type": "span", "name": name, "start": time.time() - duration, "duration_s": duration, "attributes": attributes}
+            if error is not None:
+                record["error"] = error
+            for exporter in self.exporters:
+                exporter.export_span(record)
+
+    def add(self, name, value=1, **labels):
+        if not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def record_llm_usage(self, response, stage):
+        """
+        Ollamaの応答（またはストリームの最後のチャンク）からトークン数を集計する。
+        CachedClientがキャッシュから返した応答（"cached"が真）はLLMを呼んでいないので、
+        llm_cache_hitsだけを数える。
+        """
+        if isinstance(response, dict) and response.get("cached"):
+            self.add("llm_cache_hits", stage=stage)
+            return
+        self.add("llm_calls", stage=stage)
+        try:
+            self.add("llm_prompt_tokens", response.get("prompt_eval_count") or 0, stage=stage)
+            self.add("llm_completion_tokens", response.get("eval_count") or 0, stage=stage)
+        except AttributeError:
+            pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "spans": {name: dict(stats) for name, stats in self._spans.items()},
+                "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self._counters.items()],
+            }
+
+    def flush(self):
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            exporter.export_snapshot(snapshot)
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+
+class LoggingExporter:
+    """スパンを1件ずつloggingに書き出す（既定はDEBUGレベル）。"""
+    def __init__(self, level=logging.DEBUG):
+        self.level = level
+
+    def export_span(self, record):
+        logger.log(self.level, "span %s took %.1f ms %s", record["name"], record["duration_s"] * 1000, record["attributes"] or "")
+
+    def export_snapshot(self, snapshot):
+        logger.log(self.level, "trace snapshot: %s", json.dumps(snapshot, ensure_ascii=False))
+
+
+class JSONLExporter:
+    """スパンと集計値を1行1レコードのJSONでファイルに追記する。"""
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def export_span(self, record):
+        self._write(record)
+
+    def export_snapshot(self, snapshot):
+        self._write({"type": "snapshot", "time": time.time(), **snapshot})
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusExporter:
+    """
+    集計値をPrometheusのテキスト形式で出力する。pathを指定するとflush()のたびに
+    アトミックに書き換えるので、node_exporterのtextfileコレクターで収集できる。
+    """
+    def __init__(self, path=None, prefix="ace"):
+        self.path = path
+        self.prefix = prefix
+
+    def export_span(self, record):
+        pass
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+    def render(self, snapshot):
+        lines = [
+            f"# TYPE {self.prefix}_span_duration_seconds summary",
+        ]
+        for name, stats in sorted(snapshot["spans"].items()):
+            labels = self._labels({"span": name})
+            lines.append(f"{self.prefix}_span_duration_seconds_sum{labels} {stats['total_s']}")
+            lines.append(f"{self.prefix}_span_duration_seconds_count{labels} {stats['count']}")
+        seen = set()
+        for counter in sorted(snapshot["counters"], key=lambda c: c["name"]):
+            metric = f"{self.prefix}_{counter['name']}_total"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{self._labels(counter['labels'])} {counter['value']}")
+        return "\n".join(lines) + "\n"
+
+    def export_snapshot(self, snapshot):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.render(snapshot))
+        os.replace(temp_path, self.path)
+
+
+# プロセス全体で共有するトレーサー
+tracer = Tracer()
+
+
+def configure_logging(level="INFO"):
+    """ace_frameworkのロガーのレベルを設定し、ハンドラーが無ければ標準エラーへの出力を追加する。"""
+    package_logger = logging.getLogger("ace_framework")
+    package_logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not package_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        package_logger.addHandler(handler)
+    return package_logger
+
+
+def configure_tracing(exporters):
+    """共有トレーサーのエクスポーターを差し替える。"""
+    tracer.exporters = list(exporters)
+    return tracer
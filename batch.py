@@ -0,0 +1,243 @@
+# batch.py
+"""
+Streamlit無しでACEOrchestratorを動かす、バッチ推論のエントリポイント。
+
+    python batch.py queries.jsonl --output results.jsonl --concurrency 4
+    python batch.py queries.jsonl --output results.jsonl --resume --adapt
+
+入力は1行1サンプルのJSONL（"-"で標準入力）で、各行は
+{"query": "...", "feedback": "...（任意）", "id": ...（任意、省略時は行番号）}。
+結果は完了した順に {"id", "query", "answer", "latency_s", "queue_s", "metrics"}（失敗時は"error"）の
+JSONLで書き出す（--output省略時は標準出力）。
+
+- クエリはまとめて埋め込み、生成は--concurrency個のOllamaクライアント（--hostsに振り分け）で並行に実行する。
+- --resumeを付けると、出力ファイルに成功済みの結果があるidを飛ばして追記する。
+- 既定（--freeze）では進化的コンテキストを読み取り専用で使い、--adaptではフィードバックのある
+  サンプルごとに反省とキュレーションを行ってコンテキストを更新し続ける。--adaptは
+  ストアの書き込みロックを取るので、Streamlitアプリなど別のプロセスが書き込み用に開いている間は起動しない。
+- 終了時にスループット（queries/s）とレイテンシのp50/p95を標準エラーに出力する。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+from ollama import Client
+
+from ace_framework.context_store import ContextStore
+from ace_framework.curator import Curator
+from ace_framework.document_processor import open_retriever
+from ace_framework.embedding_backends import embedding_model_id, load_embedding_model
+from ace_framework.embedding_service import EmbeddingService
+from ace_framework.eviction import EVICTION_POLICIES
+from ace_framework.generator import Generator
+from ace_framework.llm_cache import CachedClient, LLMResponseCache
+from ace_framework.orchestrator import ACEOrchestrator
+from ace_framework.persistent_store import PersistentContextStore, StoreLockedError
+from ace_framework.prompt_packer import PromptPacker
+from ace_framework.reflector import Reflector
+from ace_framework.tracing import configure_logging
+from config import ACEConfig
+
+logger = logging.getLogger("ace_framework.batch")
+
+
+def load_done_ids(output_path):
+    """
+    出力ファイルから成功済みの結果のidを集める。中断で途中まで書かれた最後の行は
+    追記した結果とつながらないよう切り捨てる。
+    """
+    done = set()
+    if not output_path or not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "error" not in record:
+            done.add(record.get("id"))
+    return done
+
+
+def read_samples(f, done_ids, invalid):
+    """
+    入力を1行ずつ読み、未処理のサンプルを返すジェネレーター（入力全体をメモリに載せない）。
+    不正な行はinvalidに (id, エラー) として集める。
+    """
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            invalid.append((line_number, f"Invalid JSON: {e}"))
+            continue
+        sample_id = record.get("id", line_number)
+        if sample_id in done_ids:
+            continue
+        if not isinstance(record.get("query"), str) or not record["query"].strip():
+            invalid.append((sample_id, "Missing query"))
+            continue
+        yield {"id": sample_id, "query": record["query"], "feedback": record.get("feedback")}
+
+
+def open_context_store(args):
+    """
+    --context-storeのストアを開く。--adaptでは書き込み用に開き、他のプロセスが
+    書き込み用に開いていればStoreLockedErrorを送出する。
+    """
+    if not args.context_store:
+        return ContextStore()
+    if not args.adapt:
+        # 凍結モードでは読み取り専用で開き、Streamlit側のストアと並行して使っても書き換えない
+        if not os.path.exists(os.path.join(args.context_store, "bullets.sqlite")):
+            logger.warning("No context store at %s. Running with an empty evolutionary context.", args.context_store)
+            return ContextStore()
+        return PersistentContextStore(args.context_store, readonly=True)
+    return PersistentContextStore(args.context_store)
+
+
+def build_clients(args):
+    cache = LLMResponseCache(path=ACEConfig.LLM_CACHE_PATH, ttl=ACEConfig.LLM_CACHE_TTL) if ACEConfig.LLM_CACHE_ENABLED else None
+    hosts = args.hosts or [None]
+    clients = []
+    for i in range(args.concurrency):
+        client = Client(host=hosts[i % len(hosts)])
+        if i < len(hosts):
+            # 起動時に各ホストへの接続を確認しておく
+            client.list()
+        if cache is not None:
+            client = CachedClient(client, cache, deterministic_only=ACEConfig.LLM_CACHE_DETERMINISTIC_ONLY)
+        clients.append(client)
+    return clients
+
+
+def summarize(latencies, errors, skipped, elapsed):
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "queries": len(latencies),
+        "errors": errors,
+        "skipped": skipped,
+        "seconds": elapsed,
+        "queries_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50_ms": float(np.percentile(values, 50)) if len(values) else None,
+        "latency_p95_ms": float(np.percentile(values, 95)) if len(values) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="入力のJSONL（\"-\"で標準入力）")
+    parser.add_argument("--output", "-o", default="-", help="出力のJSONL（既定は標準出力）")
+    parser.add_argument("--resume", action="store_true", help="出力ファイルに成功済みの結果があるサンプルを飛ばして追記する")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--freeze", dest="adapt", action="store_false", help="進化的コンテキストを更新しない（既定）")
+    mode.add_argument("--adapt", dest="adapt", action="store_true", help="フィードバックのあるサンプルごとにコンテキストを更新する")
+    parser.set_defaults(adapt=False)
+    parser.add_argument("--model", default="gemma3:4b", help="Ollamaのモデル名")
+    parser.add_argument("--hosts", nargs="+", help="OllamaのURL（複数指定でクライアントを振り分ける。省略時は既定のホスト）")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行する生成の数（= LLMクライアントの数）")
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--context-store", default=ACEConfig.CONTEXT_STORE_DIR, help="進化的コンテキストのディレクトリ（\"\"で空のメモリ上のストア）")
+    parser.add_argument("--collection", default="rag_collection", help="外部コンテキストのChromaDBコレクション")
+    parser.add_argument("--persist-directory", default="./chroma_db", help="ChromaDBの永続化ディレクトリ")
+    args = parser.parse_args()
+
+    configure_logging(ACEConfig.LOG_LEVEL)
+    if args.resume and args.output == "-":
+        parser.error("--resume requires --output to be a file")
+    # モデルを読み込む前にストアを開き、書き込みロックが取れなければすぐに終了する
+    try:
+        context_store = open_context_store(args)
+    except StoreLockedError:
+        parser.error(
+            f"--adapt needs exclusive write access, but {args.context_store} is open for writing by another process "
+            "(e.g. the Streamlit app). Stop it, or use --freeze or a different --context-store."
+        )
+
+    embedding_model = EmbeddingService(
+        load_embedding_model(
+            ACEConfig.EMBEDDING_MODEL_NAME,
+            backend=ACEConfig.EMBEDDING_BACKEND,
+            onnx_dir=ACEConfig.EMBEDDING_ONNX_DIR,
+            quantized=ACEConfig.EMBEDDING_ONNX_QUANTIZED,
+        ),
+        model_name=embedding_model_id(ACEConfig.EMBEDDING_MODEL_NAME, ACEConfig.EMBEDDING_BACKEND, ACEConfig.EMBEDDING_ONNX_QUANTIZED),
+        cache_size=ACEConfig.EMBEDDING_CACHE_SIZE,
+        cache_path=ACEConfig.EMBEDDING_CACHE_PATH,
+    )
+    if args.adapt:
+        with context_store.lock:
+            context_store.generate_and_store_embeddings(embedding_model)
+    clients = build_clients(args)
+    orchestrator = ACEOrchestrator(
+        Generator(clients[0], args.model, options=ACEConfig.LLM_OPTIONS),
+        Reflector(
+            clients[0], args.model, single_pass=ACEConfig.REFLECTION_SINGLE_PASS, max_retries=ACEConfig.REFLECTION_MAX_RETRIES,
+            options=ACEConfig.LLM_OPTIONS,
+        ),
+        Curator(clients[0], args.model, max_bullets=ACEConfig.MAX_CONTEXT_BULLETS, eviction_policy=EVICTION_POLICIES[ACEConfig.EVICTION_POLICY]()),
+        context_store,
+        embedding_model,
+        retriever=open_retriever(embedding_model, args.collection, args.persist_directory),
+        prompt_packer=PromptPacker(max_tokens=ACEConfig.PROMPT_TOKEN_BUDGET),
+    )
+
+    done_ids = load_done_ids(args.output) if args.resume else set()
+    if done_ids:
+        logger.info("Resuming: skipping %d samples already in %s.", len(done_ids), args.output)
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "a" if args.resume else "w", encoding="utf-8")
+    invalid, latencies, errors = [], [], 0
+
+    def write(record):
+        sink.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        # 中断しても書き出し済みの結果から再開できるよう、1件ごとに書き出す
+        sink.flush()
+
+    start = time.perf_counter()
+    try:
+        for result in orchestrator.run_batch(
+            read_samples(source, done_ids, invalid),
+            top_k=args.top_k,
+            adapt=args.adapt,
+            clients=clients,
+            embed_batch_size=args.embed_batch_size,
+        ):
+            write(result)
+            if "error" in result:
+                errors += 1
+            else:
+                latencies.append(result["latency_s"])
+        for sample_id, error in invalid:
+            write({"id": sample_id, "error": error})
+        errors += len(invalid)
+    finally:
+        elapsed = time.perf_counter() - start
+        orchestrator.close()
+        orchestrator.context_store.flush()
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+    summary = summarize(latencies, errors, len(done_ids), elapsed)
+    logger.info(
+        "Processed %d queries in %.1fs (%.2f queries/s, p50 %.0f ms, p95 %.0f ms, %d errors).",
+        summary["queries"], elapsed, summary["queries_per_s"], summary["latency_p50_ms"] or 0, summary["latency_p95_ms"] or 0, errors,
+    )
+    print(json.dumps(summary, ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/ann_benchmark.py
+"""
+ContextStoreの全件検索と近似最近傍インデックスの再現率・レイテンシを比較する。
+
+    python benchmarks/ann_benchmark.py --size 100000 --dim 256 --queries 200
+
+結果はJSONで標準出力に書き出す。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ace_framework.ann_index import HNSWIndex, IVFIndex
+from ace_framework.context_store import ContextStore
+
+
+def make_vectors(size, dim, n_clusters, rng):
+    """実際の文埋め込みに近い、クラスタ構造を持つベクトルを生成する。"""
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    assignment = rng.integers(0, n_clusters, size)
+    return centers[assignment] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+
+
+def build_store(vectors, index=None):
+    store = ContextStore(index=index, exact_search_threshold=0)
+    start = time.perf_counter()
+    store.add_bullets([{"content": str(i), "embedding": vector} for i, vector in enumerate(vectors)])
+    return store, time.perf_counter() - start
+
+
+def measure(store, queries, top_k, exact, truth=None):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        bullets = store.search(query, top_k, exact=exact)
+        latencies.append(time.perf_counter() - start)
+        results.append({int(item["content"]) for item in bullets})
+    report = {
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+    if truth is not None:
+        report["recall"] = float(np.mean([len(r & t) / len(t) for r, t in zip(results, truth)]))
+    return report, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_vectors(args.size, args.dim, args.clusters, rng)
+    queries = make_vectors(args.queries, args.dim, args.clusters, rng)
+    report = {"size": args.size, "dim": args.dim, "top_k": args.top_k, "results": []}
+
+    exact_store, build_seconds = build_store(vectors)
+    exact_report, truth = measure(exact_store, queries, args.top_k, exact=True)
+    report["results"].append({"backend": "exact", "build_s": build_seconds, **exact_report})
+
+    n_lists = max(1, int(np.sqrt(args.size)))
+    ivf = IVFIndex(n_lists=n_lists)
+    ivf_store, build_seconds = build_store(vectors, ivf)
+    for nprobe in (1, 4, 16, 64):
+        ivf.nprobe = nprobe
+        result, _ = measure(ivf_store, queries, args.top_k, exact=False, truth=truth)
+        report["results"].append({"backend": "ivf", "n_lists": n_lists, "nprobe": nprobe, "build_s": build_seconds, **result})
+
+    try:
+        hnsw = HNSWIndex()
+        hnsw_store, build_seconds = build_store(vectors, hnsw)
+    except ImportError as e:
+        report["skipped"] = {"hnsw": str(e)}
+    else:
+        for ef in (16, 64, 256):
+            hnsw.ef_search = ef
+            result, _ = measure(hnsw_store, queries, args.top_k, exact=False, truth=truth)
+            report["results"].append({"backend": "hnsw", "ef_search": ef, "build_s": build_seconds, **result})
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
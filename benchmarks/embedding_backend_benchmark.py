@@ -0,0 +1,133 @@
+# benchmarks/embedding_backend_benchmark.py
+"""
+埋め込みバックエンド（torchのSentenceTransformer / ONNX Runtimeのfp32・int8）の
+起動時間・メモリ・スループットと、現行モデルに対する精度の一致度を計測する。
+
+    python -m ace_framework.embedding_backends cl-nagoya/ruri-v3-30m   # 初回のみ（torchが必要）
+    python benchmarks/embedding_backend_benchmark.py --texts 2000 --output backends.json
+
+- core_import: ace_frameworkの全モジュールのimport時間と、torchなどの重いモジュールが読み込まれたか
+- startup:     バックエンドごとに新しいプロセスで、import・モデル読み込み・最初の1件の埋め込みまでの時間とピークRSS
+- throughput:  コーパスを埋め込む速度（本文/秒）
+- parity:      sentence-transformersを基準にした、本文ごとのコサイン類似度と近傍検索の一致率（recall@k）
+
+parityが--min-cosineか--min-recallを下回ると終了コード1で終わる。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from ace_framework.embedding_backends import default_onnx_dir, load_embedding_model, parity_report
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+VARIANTS = {
+    "sentence-transformers": {"backend": "sentence-transformers", "quantized": True},
+    "onnx-fp32": {"backend": "onnx", "quantized": False},
+    "onnx-int8": {"backend": "onnx", "quantized": True},
+}
+HEAVY_MODULES = ("torch", "sentence_transformers", "transformers", "langchain", "streamlit", "chromadb", "onnxruntime")
+
+CORE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import config
+import ace_framework.orchestrator, ace_framework.persistent_store, ace_framework.document_processor
+import ace_framework.embedding_service, ace_framework.embedding_worker, ace_framework.llm_cache
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "heavy_modules_loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+STARTUP = """
+import json, resource, time
+start = time.perf_counter()
+from ace_framework.embedding_backends import load_embedding_model
+model = load_embedding_model(%r, backend=%r, onnx_dir=%r, quantized=%r)
+loaded = time.perf_counter() - start
+model.encode("最初のクエリ")
+print(json.dumps({"load_s": loaded, "first_encode_s": time.perf_counter() - start, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def make_corpus(n):
+    """語彙を組み合わせた日本語の短文（評価用の合成コーパス）。"""
+    subjects = ["ユーザー", "システム", "検索結果", "回答", "教訓", "ドキュメント", "質問", "モデル"]
+    objects = ["入力", "出力", "根拠", "数値", "日付", "引用", "手順", "前提"]
+    verbs = ["検証する", "確認する", "要約する", "比較する", "記録する", "引用する", "整理する", "見直す"]
+    conditions = ["回答の前に", "曖昧な場合は", "数値を含むときは", "複数の文書にまたがるときは", "失敗したときは"]
+    return [
+        f"{conditions[i % len(conditions)]}{subjects[i % 8]}の{objects[(i // 8) % 8]}を{verbs[(i // 64) % 8]}。（{i}）"
+        for i in range(n)
+    ]
+
+
+def run_snippet(code):
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="cl-nagoya/ruri-v3-30m")
+    parser.add_argument("--onnx-dir", help="書き出し済みONNXモデルのディレクトリ（省略時はace_runs/onnx/<モデル名>）")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--corpus", help="1行1本文のテキストファイル（省略時は合成コーパス）")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--output", help="JSONの書き出し先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    onnx_dir = os.path.abspath(args.onnx_dir or os.path.join(PROJECT_ROOT, default_onnx_dir(args.model)))
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()][:args.texts]
+    else:
+        texts = make_corpus(args.texts)
+
+    report = {"args": vars(args), "core_import": run_snippet(CORE_IMPORT % (HEAVY_MODULES,)), "startup": {}, "throughput": {}, "parity": {}}
+    models = {}
+    for name in args.variants:
+        options = VARIANTS[name]
+        report["startup"][name] = run_snippet(STARTUP % (args.model, options["backend"], onnx_dir, options["quantized"]))
+        try:
+            models[name] = load_embedding_model(args.model, backend=options["backend"], onnx_dir=onnx_dir, quantized=options["quantized"])
+        except (ImportError, OSError) as e:
+            report["throughput"][name] = {"skipped": str(e)}
+            continue
+        models[name].encode(texts[:args.batch_size], batch_size=args.batch_size)  # ウォームアップ
+        start = time.perf_counter()
+        models[name].encode(texts, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        report["throughput"][name] = {"seconds": elapsed, "texts_per_s": len(texts) / elapsed}
+
+    passed = True
+    reference = models.get("sentence-transformers")
+    for name, model in models.items():
+        if reference is None or model is reference:
+            continue
+        parity = parity_report(reference, model, texts, top_k=args.top_k, batch_size=args.batch_size)
+        parity["passed"] = parity["cosine_min"] >= args.min_cosine and (parity["recall_at_k"] or 0) >= args.min_recall
+        passed = passed and parity["passed"]
+        report["parity"][name] = parity
+    report["parity_passed"] = passed if report["parity"] else None
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
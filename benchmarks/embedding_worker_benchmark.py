@@ -0,0 +1,91 @@
+# benchmarks/embedding_worker_benchmark.py
+"""
+同時に届く1件ずつのクエリ埋め込みを、プロセス内のモデルと埋め込みワーカー（マイクロバッチ）で比較する。
+
+    python benchmarks/embedding_worker_benchmark.py --threads 1 8 32 --call-latency 0.01
+
+埋め込みモデルはbenchmarks/fakes.pyのFakeEmbeddingModelで、呼び出しごとの固定費
+（--call-latency）と1件あたりの計算時間（--text-latency）を模擬する。
+結果（スループットとp50/p95レイテンシ、ワーカーの平均バッチサイズ）はJSONで標準出力に書き出す。
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from ace_framework.embedding_worker import EmbeddingWorkerClient, start_worker
+from fakes import FakeEmbeddingModel
+
+
+def run(model, threads, queries_per_thread):
+    latencies = [[] for _ in range(threads)]
+
+    def worker(index):
+        for i in range(queries_per_thread):
+            start = time.perf_counter()
+            model.encode(f"質問{index}-{i}")
+            latencies[index].append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    values = np.concatenate([np.asarray(values) for values in latencies]) * 1000
+    return {
+        "threads": threads,
+        "queries_per_s": threads * queries_per_thread / elapsed,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--queries", type=int, default=50, help="スレッドあたりのクエリ数")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--call-latency", type=float, default=0.01)
+    parser.add_argument("--text-latency", type=float, default=0.0005)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    factory = functools.partial(FakeEmbeddingModel, dim=args.dim, latency_per_text=args.text_latency, latency_per_call=args.call_latency)
+    report = {"args": vars(args), "in_process": [], "worker": []}
+    for threads in args.threads:
+        report["in_process"].append(run(factory(), threads, args.queries))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        address = os.path.join(workdir, "embedding.sock")
+        process = start_worker(factory, address, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+        client = EmbeddingWorkerClient(address)
+        try:
+            for threads in args.threads:
+                before = client.stats()
+                result = run(client, threads, args.queries)
+                after = client.stats()
+                batches = after["batches"] - before["batches"]
+                result["mean_batch_size"] = (after["texts"] - before["texts"]) / batches if batches else 0.0
+                report["worker"].append(result)
+        finally:
+            client.shutdown()
+            process.join(timeout=10)
+
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# benchmarks/fakes.py
+"""
+Ollamaやモデルのダウンロード無しでパイプラインを計測するための決定的な代替部品。
+"""
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+
+
+def _seed(text):
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+
+
+class FakeEmbeddingModel:
+    """
+    SentenceTransformer互換のencode()を持つ埋め込みモデル。本文のハッシュから
+    決定的なベクトルを作るので、同じ本文には常に同じベクトルを返す。
+    latency_per_call（呼び出しごとの固定費）とlatency_per_text（1件あたり）で計算時間を模擬できる。
+    計算は1つのデバイスを占有するものとして、同時の呼び出しは直列に待たせる。
+    """
+    def __init__(self, dim=256, latency_per_text=0.0, latency_per_call=0.0):
+        self.dim = dim
+        self.latency_per_text = latency_per_text
+        self.latency_per_call = latency_per_call
+        self.encoded = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        with self._lock:
+            if self.latency_per_call or self.latency_per_text:
+                time.sleep(self.latency_per_call + self.latency_per_text * len(texts))
+            self.encoded += len(texts)
+            self.calls += 1
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vectors[i] = np.random.default_rng(_seed(text)).standard_normal(self.dim)
+        return vectors[0] if single else vectors
+
+
+class FakeChatClient:
+    """
+    Ollamaクライアント互換のchat()。latency秒待ってから、プロンプトのハッシュで決まる応答を返す。
+
+    formatを指定された呼び出し（構造化出力）には、n_lessons種類の教訓から選んだ
+    insights_per_call件の洞察とhelpful_bullet_idsを含むJSONを返すので、
+    キュレーターの重複統合も現実的な割合で発生する。stream=Trueでは単語ごとに分割して返す。
+    """
+    def __init__(self, latency=0.0, insights_per_call=2, n_lessons=200, answer_words=50):
+        self.latency = latency
+        self.insights_per_call = insights_per_call
+        self.n_lessons = n_lessons
+        self.answer_words = answer_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _content(self, prompt, format):
+        seed = _seed(prompt)
+        if format is None:
+            return " ".join(f"step{(seed + i) % 97}" for i in range(self.answer_words))
+        lessons = [{"content": f"教訓{(seed + i * 7919) % self.n_lessons}: 入力を検証してから処理する。"} for i in range(self.insights_per_call)]
+        return json.dumps(
+            {"critique": "回答は概ね正しいが検証が不足している。", "insights": lessons, "helpful_bullet_ids": [0], "harmful_bullet_ids": []},
+            ensure_ascii=False,
+        )
+
+    def chat(self, model, messages, format=None, options=None, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        content = self._content(prompt, format)
+        # Ollamaと同様にトークン数を応答（ストリームでは最後のチャンク）に含める
+        usage = {"prompt_eval_count": len(prompt.split()), "eval_count": len(content.split())}
+        if stream:
+            words = content.split(" ")
+            return ({"message": {"content": word + " "}, **(usage if i == len(words) - 1 else {})} for i, word in enumerate(words))
+        return {"message": {"content": content}, **usage}
+
+
+class FakeDocument:
+    def __init__(self, page_content):
+        self.page_content = page_content
+        self.metadata = {}
+
+
+class FakeRetriever:
+    """LangChainのRetriever互換のinvoke()。決められたチャンクから先頭k件を返す。"""
+    def __init__(self, chunks, k=4):
+        self.chunks = chunks
+        self.k = k
+
+    def invoke(self, query):
+        start = _seed(query) % max(1, len(self.chunks))
+        return [FakeDocument(self.chunks[(start + i) % len(self.chunks)]) for i in range(min(self.k, len(self.chunks)))]
+
+
+class FakeUploadedFile:
+    """StreamlitのUploadedFile互換（name と getbuffer()）。"""
+    def __init__(self, name, data):
+        self.name = name
+        self._data = data
+
+    def getbuffer(self):
+        return memoryview(self._data)
+
+
+def make_pdf(pages):
+    """各ページの行（ASCII）のリストから、テキストを抽出できる最小限のPDFを作る。"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        text = " ".join(f"({line}) Tj 0 -14 Td" for line in lines)
+        stream = f"BT /F1 10 Tf 40 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
@@ -0,0 +1,240 @@
+# benchmarks/pipeline_benchmark.py
+"""
+Ollamaやモデルのダウンロード無しで、ACEパイプライン全体の性能を計測する。
+
+    python benchmarks/pipeline_benchmark.py --llm-latency 0.05 --output results.json
+
+LLMと埋め込みモデルはbenchmarks/fakes.pyの決定的な代替部品を使い、以下を計測する。
+
+- cycle:     run_adaptation_cycleのレイテンシとステージ別の内訳（p50/p95/平均）
+- scaling:   retrieve_bulletsとperform_deduplicationの、項目数（既定で10〜10万件）に対するスケーリング
+- offline:   run_offline_adaptationのスループット（逐次モードとバッチモード）
+- ingestion: process_uploaded_filesの取り込み速度（初回と、変更なしでの再取り込み）
+
+結果はコミット間で比較できるようJSONで書き出す。
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from ace_framework.context_store import ContextStore
+from ace_framework.curator import Curator
+from ace_framework.generator import Generator
+from ace_framework.orchestrator import ACEOrchestrator
+from ace_framework.reflector import Reflector
+from ace_framework.tracing import tracer
+from fakes import FakeChatClient, FakeEmbeddingModel, FakeRetriever, FakeUploadedFile, make_pdf
+
+STAGES = ("query_embedding_latency", "generation_latency", "reflection_latency", "curation_latency")
+
+
+def summarize(values):
+    """秒のリストをミリ秒のp50/p95/平均にまとめる。"""
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if not len(values):
+        return None
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)), "mean_ms": float(values.mean())}
+
+
+@contextlib.contextmanager
+def quiet():
+    """パイプラインの進捗出力を捨て、標準出力にはJSONだけを書く。"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def build_store(model, size):
+    store = ContextStore()
+    contents = [f"教訓{i}: 入力を検証してから処理する。" for i in range(size)]
+    store.add_bullets([{"content": content, "embedding": vector} for content, vector in zip(contents, model.encode(contents))])
+    return store
+
+
+def build_orchestrator(model, store, client, single_pass, retriever=None):
+    return ACEOrchestrator(
+        Generator(client, "fake"),
+        Reflector(client, "fake", single_pass=single_pass),
+        Curator(client, "fake"),
+        store,
+        model,
+        retriever=retriever,
+    )
+
+
+def bench_cycle(args, model):
+    store = build_store(model, args.cycle_bullets)
+    chunks = [" ".join(f"chunk{c}-word{w}" for w in range(150)) for c in range(50)]
+    orchestrator = build_orchestrator(model, store, FakeChatClient(latency=args.llm_latency), args.single_pass, FakeRetriever(chunks))
+    totals, stages, retrieval, prompt_tokens = [], {stage: [] for stage in STAGES}, [], []
+    tracer.reset()
+    with quiet():
+        for i in range(args.cycles):
+            start = time.perf_counter()
+            result = orchestrator.run_adaptation_cycle(f"質問{i}", "正解でした。", mode="online", top_k=args.top_k)
+            totals.append(time.perf_counter() - start)
+            for stage in STAGES:
+                if stage in result.metrics:
+                    stages[stage].append(result.metrics[stage])
+            retrieval.append(max(result.metrics["retrieval_latency"].values()))
+            prompt_tokens.append(result.metrics["prompt_tokens"])
+    orchestrator.close()
+    return {
+        "cycles": args.cycles,
+        "initial_bullets": args.cycle_bullets,
+        "final_bullets": len(store),
+        "total": summarize(totals),
+        "stages": {"retrieval_latency": summarize(retrieval), **{stage: summarize(values) for stage, values in stages.items()}},
+        "prompt_tokens_mean": float(np.mean(prompt_tokens)),
+        "trace": tracer.snapshot(),
+    }
+
+
+def bench_scaling(args, model):
+    results = []
+    curator = Curator(None, "fake")
+    for size in args.sizes:
+        store = build_store(model, size)
+        latencies = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            store.retrieve_bullets(f"質問{i}", args.top_k, model)
+            latencies.append(time.perf_counter() - start)
+
+        dedup = []
+        with quiet():
+            for round_ in range(args.dedup_rounds):
+                # 2割は既存項目と同じ本文（統合される）、残りは新しい本文
+                entries = [
+                    {"content": f"教訓{(round_ * 31 + j) % size}: 入力を検証してから処理する。" if j % 5 == 0 else f"新しい教訓{round_}-{j}", "metadata": {}}
+                    for j in range(args.delta_size)
+                ]
+                start = time.perf_counter()
+                curator.perform_deduplication(entries, store, model)
+                dedup.append(time.perf_counter() - start)
+        results.append({"bullets": size, "retrieve_bullets": summarize(latencies), "perform_deduplication": summarize(dedup)})
+    return {"top_k": args.top_k, "delta_size": args.delta_size, "results": results}
+
+
+def bench_offline(args, model):
+    dataset = [{"query": f"質問{i}", "feedback": "正解でした。"} for i in range(args.offline_samples)]
+    initial_context = [{"content": f"教訓{i}: 入力を検証してから処理する。", "metadata": {}} for i in range(100)]
+    results = []
+    for name, batch_size, n_clients in (("sequential", None, 1), ("batched", args.batch_size, args.clients)):
+        clients = [FakeChatClient(latency=args.llm_latency) for _ in range(n_clients)]
+        orchestrator = build_orchestrator(model, ContextStore(), clients[0], args.single_pass)
+        with quiet():
+            start = time.perf_counter()
+            context = orchestrator.run_offline_adaptation(dataset, initial_context, epochs=1, top_k=args.top_k, batch_size=batch_size, clients=clients)
+            elapsed = time.perf_counter() - start
+        orchestrator.close()
+        results.append({
+            "mode": name,
+            "batch_size": batch_size,
+            "clients": n_clients,
+            "seconds": elapsed,
+            "samples_per_s": len(dataset) / elapsed,
+            "final_bullets": len(context),
+        })
+    return {"samples": len(dataset), "results": results}
+
+
+def bench_ingestion(args, model):
+    try:
+        from ace_framework.document_processor import process_uploaded_files
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    pages = [[f"Document {{}} page {p} line {line}: the quick brown fox jumps over the lazy dog." for line in range(50)] for p in range(args.ingest_pages)]
+    uploads = [
+        FakeUploadedFile(f"doc{i}.pdf", make_pdf([[line.format(i) for line in page] for page in pages]))
+        for i in range(args.ingest_files)
+    ]
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # process_uploaded_filesはカレントディレクトリのtemp_docsにファイルを書き出す
+        os.chdir(workdir)
+        try:
+            for run in ("cold", "unchanged"):
+                encoded_before = model.encoded
+                with quiet():
+                    start = time.perf_counter()
+                    process_uploaded_files(uploads, model, collection_name="benchmark", persist_directory=os.path.join(workdir, "chroma"))
+                    elapsed = time.perf_counter() - start
+                results.append({
+                    "run": run,
+                    "seconds": elapsed,
+                    "files_per_s": len(uploads) / elapsed,
+                    "pages_per_s": len(uploads) * args.ingest_pages / elapsed,
+                    "chunks_embedded": model.encoded - encoded_before,
+                })
+        finally:
+            os.chdir(cwd)
+    return {"files": args.ingest_files, "pages_per_file": args.ingest_pages, "results": results}
+
+
+SECTIONS = {"cycle": bench_cycle, "scaling": bench_scaling, "offline": bench_offline, "ingestion": bench_ingestion}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", nargs="+", choices=list(SECTIONS), default=list(SECTIONS))
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="偽のLLM呼び出し1回あたりの待ち時間（秒）")
+    parser.add_argument("--single-pass", action="store_true", help="反省を1回の構造化出力呼び出しで行う")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--cycle-bullets", type=int, default=1000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dedup-rounds", type=int, default=10)
+    parser.add_argument("--delta-size", type=int, default=10)
+    parser.add_argument("--offline-samples", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--ingest-files", type=int, default=4)
+    parser.add_argument("--ingest-pages", type=int, default=20)
+    parser.add_argument("--output", help="JSONの書き出し先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    model = FakeEmbeddingModel(dim=args.dim)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "args": {key: value for key, value in vars(args).items() if key != "output"},
+        "sections": {},
+    }
+    for name in args.sections:
+        start = time.perf_counter()
+        report["sections"][name] = SECTIONS[name](args, model)
+        report["sections"][name]["elapsed_s"] = time.perf_counter() - start
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,48 @@ class ACEConfig:
     NUM_ITERATIONS: int = int(os.getenv("ACE_NUM_ITERATIONS", "5"))
     OUTPUT_DIR: str = os.getenv("ACE_OUTPUT_DIR", "ace_runs")
     LOG_LEVEL: str = os.getenv("ACE_LOG_LEVEL", "INFO")
+    # 進化的コンテキストの永続化先 (SQLite + メモリマップされた.npy)
+    CONTEXT_STORE_DIR: str = os.getenv("ACE_CONTEXT_STORE_DIR", os.path.join(OUTPUT_DIR, "context_store"))
+    # 進化的コンテキストの上限と追い出し方針 ("lfu" / "lru" / "decay")
+    MAX_CONTEXT_BULLETS: int = int(os.getenv("ACE_MAX_CONTEXT_BULLETS", "5000"))
+    EVICTION_POLICY: str = os.getenv("ACE_EVICTION_POLICY", "decay")
+    # 埋め込みモデルと、内容ハッシュをキーにした埋め込みキャッシュ
+    EMBEDDING_MODEL_NAME: str = os.getenv("ACE_EMBEDDING_MODEL", "cl-nagoya/ruri-v3-30m")
+    # 埋め込みの実行バックエンド ("sentence-transformers" / "onnx")。onnxは事前に
+    # `python -m ace_framework.embedding_backends <モデル名>` で書き出したモデルをtorch無しで実行する
+    EMBEDDING_BACKEND: str = os.getenv("ACE_EMBEDDING_BACKEND", "sentence-transformers")
+    EMBEDDING_ONNX_DIR: str = os.getenv("ACE_EMBEDDING_ONNX_DIR", os.path.join(OUTPUT_DIR, "onnx", EMBEDDING_MODEL_NAME.replace("/", "__")))
+    EMBEDDING_ONNX_QUANTIZED: bool = os.getenv("ACE_EMBEDDING_ONNX_QUANTIZED", "true").lower() in ("1", "true", "yes")
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("ACE_EMBEDDING_CACHE_SIZE", "10000"))
+    EMBEDDING_CACHE_PATH: str = os.getenv("ACE_EMBEDDING_CACHE_PATH", os.path.join(OUTPUT_DIR, "embedding_cache.sqlite"))
+    # 埋め込みワーカーのUnixソケット (指定するとモデルを別プロセスに置き、プロセス間で共有してまとめてバッチ処理する)
+    EMBEDDING_WORKER_SOCKET: str = os.getenv("ACE_EMBEDDING_WORKER_SOCKET", "")
+    EMBEDDING_WORKER_MAX_BATCH_SIZE: int = int(os.getenv("ACE_EMBEDDING_WORKER_MAX_BATCH_SIZE", "64"))
+    EMBEDDING_WORKER_MAX_WAIT_MS: float = float(os.getenv("ACE_EMBEDDING_WORKER_MAX_WAIT_MS", "5"))
+    # 埋め込みワーカーの認証キー (未指定ならソケットの隣に所有者だけが読める <ソケット>.key を作って使う)
+    EMBEDDING_WORKER_AUTHKEY: str = os.getenv("ACE_EMBEDDING_WORKER_AUTHKEY", "")
+    # 生成・反省でOllamaに渡すオプション (未指定の項目はモデルの既定値)
+    LLM_OPTIONS: dict = {
+        **({"temperature": float(os.getenv("ACE_LLM_TEMPERATURE"))} if os.getenv("ACE_LLM_TEMPERATURE") else {}),
+        **({"seed": int(os.getenv("ACE_LLM_SEED"))} if os.getenv("ACE_LLM_SEED") else {}),
+    }
+    # LLM応答キャッシュ (同じプロンプト・モデル・オプションの呼び出しを再利用)。既定では再現可能な呼び出し
+    # (LLM_OPTIONSでtemperature=0かseedを指定したもの) だけをキャッシュし、サンプリングした応答は固定しない
+    LLM_CACHE_ENABLED: bool = os.getenv("ACE_LLM_CACHE", "true").lower() in ("1", "true", "yes")
+    LLM_CACHE_PATH: str = os.getenv("ACE_LLM_CACHE_PATH", os.path.join(OUTPUT_DIR, "llm_cache.sqlite"))
+    LLM_CACHE_TTL: float | None = float(os.getenv("ACE_LLM_CACHE_TTL")) if os.getenv("ACE_LLM_CACHE_TTL") else None
+    LLM_CACHE_DETERMINISTIC_ONLY: bool = os.getenv("ACE_LLM_CACHE_DETERMINISTIC_ONLY", "true").lower() in ("1", "true", "yes")
+    # 反省・キュレーションを応答の後にバックグラウンドで行うか
+    ASYNC_UPDATES: bool = os.getenv("ACE_ASYNC_UPDATES", "true").lower() in ("1", "true", "yes")
+    # 反省と洞察の抽出を1回の構造化出力呼び出しで行うか、と検証失敗時の再試行回数
+    REFLECTION_SINGLE_PASS: bool = os.getenv("ACE_REFLECTION_SINGLE_PASS", "false").lower() in ("1", "true", "yes")
+    REFLECTION_MAX_RETRIES: int = int(os.getenv("ACE_REFLECTION_MAX_RETRIES", "2"))
+    # 生成プロンプトのトークン予算 (指示・コンテキスト・クエリの合計)
+    PROMPT_TOKEN_BUDGET: int = int(os.getenv("ACE_PROMPT_TOKEN_BUDGET", "4096"))
+    # トレース（ステージごとのスパンとカウンター）の出力先 (カンマ区切り: "logging" / "jsonl" / "prometheus")
+    TRACE_EXPORTERS: str = os.getenv("ACE_TRACE_EXPORTERS", "logging")
+    TRACE_JSONL_PATH: str = os.getenv("ACE_TRACE_JSONL_PATH", os.path.join(OUTPUT_DIR, "traces.jsonl"))
+    TRACE_PROMETHEUS_PATH: str = os.getenv("ACE_TRACE_PROMETHEUS_PATH", os.path.join(OUTPUT_DIR, "ace_metrics.prom"))
     # Define a default reflection prompt template
     DEFAULT_REFLECTION_PROMPT: str = (
         "You are an expert critic and an LLM engineer. Analyze the following agent's performance:\n\n"
@@ -40,6 +82,3 @@ class ACEConfig:
     )
 
     EVALUATION_THRESHOLD: float = float(os.getenv("ACE_EVALUATION_THRESHOLD", "0.9")) # e.g., stop if score > 0.9
-
-# Ensure output directory exists
-os.makedirs(ACEConfig.OUTPUT_DIR, exist_ok=True)
@@ -1,30 +1,96 @@
 # main.py
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 from ollama import Client
-from sentence_transformers import SentenceTransformer
 
-from ace_framework.context_store import ContextStore
+from ace_framework.persistent_store import PersistentContextStore, StoreLockedError
 from ace_framework.generator import Generator
 from ace_framework.reflector import Reflector
 from ace_framework.curator import Curator
 from ace_framework.orchestrator import ACEOrchestrator
 from ace_framework.document_processor import process_uploaded_files
+from ace_framework.embedding_backends import embedding_model_id, load_embedding_model
+from ace_framework.embedding_service import EmbeddingService
+from ace_framework.embedding_worker import connect_or_spawn
+from ace_framework.eviction import EVICTION_POLICIES
+from ace_framework.llm_cache import CachedClient, LLMResponseCache
+from ace_framework.prompt_packer import PromptPacker
+from ace_framework.tracing import JSONLExporter, LoggingExporter, PrometheusExporter, configure_logging, configure_tracing, tracer
+from config import ACEConfig
 
 st.set_page_config(layout="wide")
 st.title("ACE Framework RAG System")
 
+logger = logging.getLogger("ace_framework.app")
+
 # --- 初期化 ---
+@st.cache_resource
+def setup_observability():
+    """ACEConfig.LOG_LEVELでログレベルを設定し、トレースのエクスポーターを登録する（プロセスで1回）。"""
+    configure_logging(ACEConfig.LOG_LEVEL)
+    exporters = []
+    for name in filter(None, (name.strip() for name in ACEConfig.TRACE_EXPORTERS.split(","))):
+        if name == "logging":
+            exporters.append(LoggingExporter())
+        elif name == "jsonl":
+            exporters.append(JSONLExporter(ACEConfig.TRACE_JSONL_PATH))
+        elif name == "prometheus":
+            exporters.append(PrometheusExporter(ACEConfig.TRACE_PROMETHEUS_PATH))
+        else:
+            logger.warning("Unknown trace exporter: %s", name)
+    configure_tracing(exporters)
+
+setup_observability()
+
 @st.cache_resource
 def load_models_and_clients():
     """
     モデルとクライアントをロードし、キャッシュする。
+    埋め込みモデルはEmbeddingServiceで包み、コンテキストストア・オーケストレーター・
+    ドキュメント処理のすべてで同じインスタンスを共有する。
+    ACEConfig.EMBEDDING_WORKER_SOCKETを指定した場合は、モデルをプロセス内にロードせず
+    埋め込みワーカー（無ければ起動する）に接続し、他のStreamlitプロセスとモデルを共有する。
+    埋め込みの実行バックエンド（torchのSentenceTransformerか、ONNX Runtimeのint8モデルか）は
+    ACEConfig.EMBEDDING_BACKENDで選び、どちらもここで初めて読み込む。
     """
-    print("Loading models and clients...")
+    logger.info("Loading models and clients...")
     try:
-        embedding_model = SentenceTransformer('cl-nagoya/ruri-v3-30m')
+        if ACEConfig.EMBEDDING_WORKER_SOCKET:
+            model = connect_or_spawn(
+                ACEConfig.EMBEDDING_WORKER_SOCKET,
+                ACEConfig.EMBEDDING_MODEL_NAME,
+                max_batch_size=ACEConfig.EMBEDDING_WORKER_MAX_BATCH_SIZE,
+                max_wait_ms=ACEConfig.EMBEDDING_WORKER_MAX_WAIT_MS,
+                backend=ACEConfig.EMBEDDING_BACKEND,
+                onnx_dir=ACEConfig.EMBEDDING_ONNX_DIR,
+                quantized=ACEConfig.EMBEDDING_ONNX_QUANTIZED,
+                authkey=ACEConfig.EMBEDDING_WORKER_AUTHKEY or None,
+            )
+        else:
+            model = load_embedding_model(
+                ACEConfig.EMBEDDING_MODEL_NAME,
+                backend=ACEConfig.EMBEDDING_BACKEND,
+                onnx_dir=ACEConfig.EMBEDDING_ONNX_DIR,
+                quantized=ACEConfig.EMBEDDING_ONNX_QUANTIZED,
+            )
+        embedding_model = EmbeddingService(
+            model,
+            # バックエンドごとにベクトルがわずかに違うので、キャッシュのキーを分ける
+            model_name=embedding_model_id(ACEConfig.EMBEDDING_MODEL_NAME, ACEConfig.EMBEDDING_BACKEND, ACEConfig.EMBEDDING_ONNX_QUANTIZED),
+            cache_size=ACEConfig.EMBEDDING_CACHE_SIZE,
+            cache_path=ACEConfig.EMBEDDING_CACHE_PATH,
+        )
         ollama_client = Client()
         ollama_client.list()
-        print("Models and clients loaded successfully.")
+        if ACEConfig.LLM_CACHE_ENABLED:
+            ollama_client = CachedClient(
+                ollama_client,
+                LLMResponseCache(path=ACEConfig.LLM_CACHE_PATH, ttl=ACEConfig.LLM_CACHE_TTL),
+                deterministic_only=ACEConfig.LLM_CACHE_DETERMINISTIC_ONLY,
+            )
+        logger.info("Models and clients loaded successfully.")
         return embedding_model, ollama_client
     except Exception as e:
         st.error(f"モデルまたはOllamaクライアントのロード中にエラーが発生しました: {e}")
@@ -33,6 +99,33 @@ def load_models_and_clients():
 
 embedding_model, ollama_client = load_models_and_clients()
 
+@st.cache_resource
+def load_context_store():
+    """
+    永続化された進化的コンテキストを開く。同じファイルへの書き込みが競合しないよう、
+    プロセス内で1つのストアを全セッションで共有する。更新はストアの書き込みロックの下で
+    差分として適用され、各セッションはロック無しで最新の版のスナップショットを読む。
+    別のプロセス（他のStreamlitやbatch.py --adapt）が書き込み用に開いている場合は
+    読み取り専用で開き、このプロセスではコンテキストを更新しない。
+    """
+    try:
+        return PersistentContextStore(ACEConfig.CONTEXT_STORE_DIR)
+    except StoreLockedError as e:
+        logger.warning("%s Opening it read-only; context updates are disabled in this process.", e)
+        return PersistentContextStore(ACEConfig.CONTEXT_STORE_DIR, readonly=True)
+
+@st.cache_resource
+def load_thread_pools():
+    """
+    全セッションのオーケストレーターで共有する (更新用, 外部検索用) のスレッドプール。
+    Streamlitにはセッションの終了を知る手段が無いため、セッションごとに作ると停止されずに残る。
+    更新用は1本なので、共有ストアへのデルタはセッションをまたいで投入された順に適用される。
+    """
+    return (
+        ThreadPoolExecutor(max_workers=1, thread_name_prefix="ace-update"),
+        ThreadPoolExecutor(max_workers=8, thread_name_prefix="ace-retrieval"),
+    )
+
 # --- session_stateの初期化 ---
 if 'ace_initialized' not in st.session_state:
     st.session_state.ace_initialized = False
@@ -53,11 +146,16 @@ with st.sidebar:
     if st.button("ドキュメントを処理"):
         if uploaded_files and embedding_model:
             with st.spinner("ドキュメントを処理中..."):
+                progress_bar = st.progress(0.0, text="ドキュメントを解析中...")
                 st.session_state.retriever = process_uploaded_files(
                     uploaded_files,
                     embedding_model,
-                    collection_name="rag_collection"
+                    collection_name="rag_collection",
+                    progress_callback=lambda done, total, chunks: progress_bar.progress(
+                        done / total, text=f"{done}/{total} ファイル処理済み（{chunks} チャンク追加）"
+                    ),
                 )
+                progress_bar.empty()
                 if st.session_state.retriever:
                     st.success("ドキュメントの処理が完了しました。")
                 else:
@@ -66,8 +164,9 @@ with st.sidebar:
             st.warning("ファイルをアップロードしてください。")
 
     st.subheader("現在の進化的コンテキスト")
-    if 'context_store' in st.session_state and st.session_state.context_store.context:
-        context_contents = [item.get('content', 'N/A') for item in st.session_state.context_store.context]
+    context_snapshot = st.session_state.context_store.snapshot() if 'context_store' in st.session_state else None
+    if context_snapshot is not None and len(context_snapshot):
+        context_contents = [item.get('content', 'N/A') for item in context_snapshot.context]
         st.json(context_contents)
     else:
         st.info("まだコンテキストはありません。")
@@ -77,29 +176,56 @@ with st.sidebar:
 if embedding_model and ollama_client:
     # ACEコンポーネントの初期化（初回のみ）
     if not st.session_state.ace_initialized:
-        print("Initializing ACE components...")
+        logger.info("Initializing ACE components...")
         MODEL_NAME = "gemma3:4b"
         
-        context_store = ContextStore()
-        context_store.add_bullet("メモ化の良い戦略は、辞書を使って結果を保存することです。")
-        context_store.generate_and_store_embeddings(embedding_model)
+        context_store = load_context_store()
+        if context_store.readonly:
+            # 書き込み中のプロセスに任せ、初期項目の追加や埋め込みの生成は行わない
+            st.warning("進化的コンテキストは別のプロセスが更新中のため、読み取り専用で使用します（このセッションではコンテキストを更新しません）。")
+        else:
+            # 共有ストアなので、複数のセッションが同時に初期化しても初期項目は1つだけ入れる
+            with context_store.lock:
+                if not len(context_store):
+                    context_store.add_bullet("メモ化の良い戦略は、辞書を使って結果を保存することです。")
+                # 保存済みの埋め込みは再利用し、未生成の項目だけをエンコードする
+                context_store.generate_and_store_embeddings(embedding_model)
         
         st.session_state.context_store = context_store
-        st.session_state.generator = Generator(ollama_client, MODEL_NAME)
-        st.session_state.reflector = Reflector(ollama_client, MODEL_NAME)
-        st.session_state.curator = Curator(ollama_client, MODEL_NAME)
+        st.session_state.generator = Generator(ollama_client, MODEL_NAME, options=ACEConfig.LLM_OPTIONS)
+        st.session_state.reflector = Reflector(
+            ollama_client,
+            MODEL_NAME,
+            single_pass=ACEConfig.REFLECTION_SINGLE_PASS,
+            max_retries=ACEConfig.REFLECTION_MAX_RETRIES,
+            options=ACEConfig.LLM_OPTIONS,
+        )
+        st.session_state.curator = Curator(
+            ollama_client,
+            MODEL_NAME,
+            max_bullets=ACEConfig.MAX_CONTEXT_BULLETS,
+            eviction_policy=EVICTION_POLICIES[ACEConfig.EVICTION_POLICY](),
+        )
         st.session_state.ace_initialized = True
-        print("ACE components initialized.")
-
-    # OrchestratorはRetrieverの状態によって動的に再生成
-    orchestrator = ACEOrchestrator(
-        st.session_state.generator,
-        st.session_state.reflector,
-        st.session_state.curator,
-        st.session_state.context_store,
-        embedding_model,
-        retriever=st.session_state.retriever
-    )
+        logger.info("ACE components initialized.")
+
+    # Orchestratorはセッションの未処理の更新を保持するためセッション内で1つだけ作り（スレッドプールはプロセスで共有）、
+    # Retrieverは最新の状態を都度反映する
+    if 'orchestrator' not in st.session_state:
+        update_executor, retrieval_pool = load_thread_pools()
+        st.session_state.orchestrator = ACEOrchestrator(
+            st.session_state.generator,
+            st.session_state.reflector,
+            st.session_state.curator,
+            st.session_state.context_store,
+            embedding_model,
+            async_updates=ACEConfig.ASYNC_UPDATES,
+            prompt_packer=PromptPacker(max_tokens=ACEConfig.PROMPT_TOKEN_BUDGET),
+            update_executor=update_executor,
+            retrieval_pool=retrieval_pool,
+        )
+    orchestrator = st.session_state.orchestrator
+    orchestrator.retriever = st.session_state.retriever
 
     st.subheader("対話")
 
@@ -116,24 +242,33 @@ if embedding_model and ollama_client:
         with st.chat_message("user"):
             st.markdown(query)
 
-        with st.spinner("思考中..."):
-            feedback = " " # UIからフィードバックを得る方法は後で考える
-            
-            trajectory, final_prompt, updated_context = orchestrator.run_adaptation_cycle(
-                query=query,
-                feedback=feedback,
-                mode="online",
-                top_k=5
-            )
-            response = trajectory
+        feedback = " " # UIからフィードバックを得る方法は後で考える
 
-        # AIメッセージを履歴に追加して表示
-        formatted_response = f"回答：\n\n{response}"
-        st.session_state.messages.append({"role": "assistant", "content": formatted_response})
+        # AIメッセージを生成しながら逐次表示する
         with st.chat_message("assistant"):
-            st.markdown(formatted_response)
+            st.markdown("回答：")
+            with st.spinner("思考中..."):
+                streaming_cycle = orchestrator.stream_adaptation_cycle(
+                    query=query,
+                    feedback=feedback,
+                    mode="online",
+                    top_k=5
+                )
+            st.write_stream(streaming_cycle)
+            cycle_result = streaming_cycle.result
+            trajectory, final_prompt, updated_context = cycle_result
+            response = trajectory
+
+            # 全文が揃ってから履歴に追加する
+            formatted_response = f"回答：\n\n{response}"
+            st.session_state.messages.append({"role": "assistant", "content": formatted_response})
             with st.expander("最適化されたプロンプトを表示"):
                 st.text(final_prompt)
+            with st.expander("計測値を表示"):
+                st.json(cycle_result.metrics)
+                st.caption("プロセス全体のスパンとカウンターの集計")
+                st.json(tracer.snapshot())
+        tracer.flush()
 
 else:
     st.warning("ACEコンポーネントを初期化できませんでした。Ollamaが起動しているか確認してください。")
@@ -0,0 +1,62 @@
+# tests/test_ann_index.py
+import numpy as np
+import pytest
+
+from ace_framework.ann_index import HNSWIndex, IVFIndex
+from ace_framework.context_store import ContextStore
+
+DIM = 16
+
+
+def make_index(kind):
+    if kind == "ivf":
+        # 全リストを走査するので、学習後も結果は全件検索と一致する
+        return IVFIndex(n_lists=4, nprobe=4, train_size=20)
+    pytest.importorskip("hnswlib")
+    return HNSWIndex(M=8, ef_construction=100, ef_search=100, initial_capacity=8)
+
+
+def unit_vectors(n, seed):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(params=["ivf", "hnsw"])
+def kind(request):
+    return request.param
+
+
+def test_insert_and_remove(kind):
+    index = make_index(kind)
+    vectors = unit_vectors(40, seed=0)
+    index.add(np.arange(40), vectors)
+    assert len(index) == 40
+
+    labels, scores = index.search(vectors[7], 3)
+    assert labels[0] == 7
+    assert scores[0] == pytest.approx(1.0, abs=1e-4)
+
+    index.remove([7, 8, 7])
+    assert len(index) == 38
+    labels, _ = index.search(vectors[7], 5)
+    assert 7 not in labels.tolist()
+
+    # 削除したラベルを別のベクトルで再追加すると上書きされる
+    index.add([7], vectors[9:10])
+    labels, _ = index.search(vectors[9], 2)
+    assert sorted(labels.tolist()) == [7, 9]
+
+
+def test_store_search_matches_exact_search_after_remove_and_compact(kind):
+    store = ContextStore(initial_capacity=8, index=make_index(kind), exact_search_threshold=0)
+    vectors = unit_vectors(60, seed=1)
+    items = [{"content": f"c{i}", "metadata": {}, "embedding": vector} for i, vector in enumerate(vectors)]
+    store.add_bullets(items)
+    store.remove_bullets(items[:45])  # トゥームストーンが溜まり、詰め直しでインデックスを作り直す
+    assert len(store._bullets) == 15
+    assert len(store.index) == 15
+
+    for query in unit_vectors(5, seed=2):
+        approximate = [item["content"] for item in store.search(query, 3, exact=False)]
+        exact = [item["content"] for item in store.search(query, 3, exact=True)]
+        assert approximate == exact
@@ -0,0 +1,137 @@
+# tests/test_context_store.py
+import threading
+
+import numpy as np
+import pytest
+
+from ace_framework.context_store import ContextStore
+from ace_framework.curator import Curator
+from ace_framework.persistent_store import PersistentContextStore
+
+
+class HashEmbeddingModel:
+    """本文ごとに決まった単位ベクトルを返す、テスト用の埋め込みモデル。"""
+    dim = 16
+
+    def encode(self, texts):
+        single = isinstance(texts, str)
+        vectors = []
+        for text in [texts] if single else texts:
+            vector = np.random.default_rng(abs(hash(text.strip())) % (2 ** 32)).standard_normal(self.dim).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors[0] if single else np.stack(vectors)
+
+
+def make_items(model, contents):
+    return [{"content": content, "metadata": {}, "embedding": model.encode(content)} for content in contents]
+
+
+@pytest.fixture(params=["memory", "persistent"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield ContextStore(initial_capacity=4)
+    else:
+        store = PersistentContextStore(str(tmp_path / "store"), initial_capacity=4)
+        yield store
+        store.close()
+
+
+def test_snapshot_survives_add_remove_and_compact(store):
+    model = HashEmbeddingModel()
+    items = make_items(model, [f"c{i}" for i in range(10)])
+    store.add_bullets(items)
+    snapshot = store.snapshot()
+    before_context = [item["content"] for item in snapshot.context]
+    before_search = [item["content"] for item in snapshot.search(model.encode("c3"), 3)]
+
+    store.apply_delta(added=make_items(model, ["n1", "n2"]), removed=items[:8])
+    if isinstance(store, PersistentContextStore):
+        store.compact()
+    else:
+        store._compact()
+    store.add_bullets(make_items(model, ["n3"]))
+
+    assert [item["content"] for item in store.snapshot().context] == ["c8", "c9", "n1", "n2", "n3"]
+    assert [item["content"] for item in snapshot.context] == before_context
+    assert [item["content"] for item in snapshot.search(model.encode("c3"), 3)] == before_search
+    assert before_search[0] == "c3"
+    assert len(snapshot) == 10
+
+
+def test_apply_delta_publishes_exactly_one_version(store):
+    model = HashEmbeddingModel()
+    items = make_items(model, ["a", "b", "c"])
+    store.add_bullets(items)
+    version = store.version
+
+    store.apply_delta(added=make_items(model, ["d", "e"]), removed=[items[0]])
+
+    assert store.version == version + 1
+    assert store.snapshot().version == store.version
+    assert sorted(item["content"] for item in store.snapshot().context) == ["b", "c", "d", "e"]
+
+
+def test_record_hits_does_not_wait_for_a_writer(store):
+    model = HashEmbeddingModel()
+    store.add_bullets(make_items(model, ["a", "b"]))
+    snapshot = store.snapshot()
+    hit = snapshot.search(model.encode("a"), 1)
+    holding, release = threading.Event(), threading.Event()
+
+    def writer():
+        with store._writing():
+            holding.set()
+            release.wait(timeout=5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        assert holding.wait(timeout=5)
+        reader = threading.Thread(target=store.record_hits, args=(hit,))
+        reader.start()
+        reader.join(timeout=1)
+        assert not reader.is_alive()
+        # 書き込み中は反映されず、キューに積まれる
+        assert store.usage(hit[0])["hits"] == 0
+    finally:
+        release.set()
+        thread.join(timeout=5)
+
+    store.apply_delta()
+    assert store.usage(hit[0])["hits"] == 1
+
+
+def test_merged_metadata_does_not_change_published_snapshots(store):
+    model = HashEmbeddingModel()
+    store.add_bullets(make_items(model, ["a", "b"]))
+    snapshot = store.snapshot()
+    old_item = snapshot.search(model.encode("a"), 1)[0]
+
+    fresh = Curator().perform_deduplication([{"content": "a ", "metadata": {"sources": ["q1"]}}], store, model)
+
+    assert fresh == []
+    assert old_item["metadata"] == {}
+    assert [item["metadata"] for item in snapshot.context] == [{}, {}]
+    current = next(item for item in store.snapshot().context if item["content"] == "a")
+    assert current["metadata"] == {"count": 2, "sources": ["q1"]}
+    # 差し替え前の項目へのフィードバックやヒットも、現在の項目に記録される
+    store.record_feedback([old_item], helpful=True)
+    store.record_hits([old_item])
+    assert store.usage(current)["helpful"] == 1
+    assert store.usage(current)["hits"] == 1
+
+
+def test_each_snapshot_sees_the_metadata_of_its_own_version(store):
+    model = HashEmbeddingModel()
+    store.add_bullets(make_items(model, ["a", "b", "c", "d"]))
+    snapshots = [store.snapshot()]
+    # 何度も差し替えて、履歴の畳み込み（項目数を超えた時点）もまたぐ
+    for i in range(1, 12):
+        item = next(item for item in store.snapshot().context if item["content"] == "a")
+        store.replace_metadata([(item, {"count": i})])
+        snapshots.append(store.snapshot())
+
+    for i, snapshot in enumerate(snapshots):
+        metadata = {item["content"]: item["metadata"] for item in snapshot.context}
+        assert metadata == {"a": {"count": i} if i else {}, "b": {}, "c": {}, "d": {}}
+        assert snapshot.search(model.encode("a"), 1)[0]["metadata"] == metadata["a"]
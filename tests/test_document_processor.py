@@ -0,0 +1,11 @@
+# tests/test_document_processor.py
+from ace_framework.document_processor import _chunk_ids
+
+
+def test_chunk_ids_survive_inserted_text():
+    before = _chunk_ids("a.pdf", ["x", "y", "x", "z"])
+    after = _chunk_ids("a.pdf", ["inserted", "x", "y", "x", "z"])
+
+    assert len(set(before)) == 4
+    assert after[1:] == before
+    assert _chunk_ids("b.pdf", ["x"])[0] != before[0]
@@ -0,0 +1,55 @@
+# tests/test_embedding_worker.py
+import os
+import stat
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import numpy as np
+import pytest
+
+from ace_framework.embedding_worker import EmbeddingWorker, EmbeddingWorkerClient, load_authkey
+from fakes import FakeEmbeddingModel
+
+
+@pytest.fixture
+def address(tmp_path):
+    return str(tmp_path / "worker.sock")
+
+
+def test_worker_rejects_clients_without_the_key(address):
+    model = FakeEmbeddingModel(dim=8)
+    worker = EmbeddingWorker(model, address)
+    thread = threading.Thread(target=worker.serve_forever, daemon=True)
+    thread.start()
+    client = None
+    try:
+        # 起動直後はまだ受け付けていないことがあるので、接続できるまで待つ
+        for _ in range(200):
+            try:
+                client = EmbeddingWorkerClient(address, timeout=5)
+                break
+            except OSError:
+                time.sleep(0.01)
+        assert stat.S_IMODE(os.stat(f"{address}.key").st_mode) == 0o600
+
+        with pytest.raises(AuthenticationError):
+            EmbeddingWorkerClient(address, authkey=b"wrong key")
+        # 拒否した後も、正しいキーのクライアントには応答し続ける
+        np.testing.assert_allclose(client.encode(["a"]), model.encode(["a"]))
+    finally:
+        if client is not None:
+            client.shutdown()
+        thread.join(5)
+
+
+def test_key_file_readable_by_others_is_refused(address):
+    load_authkey(address)
+    os.chmod(f"{address}.key", 0o644)
+    with pytest.raises(PermissionError):
+        load_authkey(address)
+
+
+def test_explicit_key_does_not_touch_the_key_file(address):
+    assert load_authkey(address, "secret") == b"secret"
+    assert not os.path.exists(f"{address}.key")
@@ -0,0 +1,20 @@
+# tests/test_eviction.py
+import numpy as np
+
+from ace_framework.eviction import ScoreDecayPolicy
+
+
+def test_decay_does_not_let_stale_harmful_bullets_outlive_fresh_ones():
+    policy = ScoreDecayPolicy(half_life=10, feedback_weight=2.0)
+    # [古くharmfulな項目, 追加したばかりの項目, 古く使われていた項目]
+    hits = np.array([0, 0, 5])
+    last_used = np.array([0, 100, 0])
+    helpful = np.array([0, 0, 0])
+    harmful = np.array([3, 0, 0])
+
+    scores = policy.scores(hits, last_used, helpful, harmful, cycle=100)
+
+    assert scores[0] == -5.0
+    assert scores[1] == 1.0
+    assert 0 < scores[2] < 1.0
+    assert np.argmin(scores) == 0
@@ -0,0 +1,79 @@
+# tests/test_llm_cache.py
+import pytest
+
+from ace_framework import llm_cache
+from ace_framework.generator import Generator
+from ace_framework.llm_cache import CachedClient, LLMResponseCache
+from ace_framework.tracing import tracer
+from fakes import FakeChatClient
+
+MESSAGES = [{"role": "user", "content": "質問"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_ttl_expiry_round_trip_through_disk(tmp_path, clock):
+    path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMResponseCache(path=path, ttl=10)
+    key = cache.make_key("m", MESSAGES)
+    cache.put(key, {"message": {"content": "a"}})
+    cache.close()
+
+    # 新しいインスタンスはメモリが空なので、ディスクから読み戻す
+    reopened = LLMResponseCache(path=path, ttl=10)
+    clock[0] += 5
+    assert reopened.get(key) == {"message": {"content": "a"}}
+    clock[0] += 10
+    assert reopened.get(key) is None
+    reopened.close()
+    assert LLMResponseCache(path=path, ttl=10).get(key) is None
+
+
+def test_disk_and_memory_eviction_drop_least_recently_used(tmp_path, clock):
+    cache = LLMResponseCache(max_entries=2, path=str(tmp_path / "llm_cache.sqlite"), max_disk_entries=2)
+    keys = [cache.make_key("m", [{"role": "user", "content": str(i)}]) for i in range(3)]
+    cache.put(keys[0], {"n": 0})
+    clock[0] += 1
+    cache.put(keys[1], {"n": 1})
+    clock[0] += 1
+    assert cache.get(keys[0]) == {"n": 0}
+    clock[0] += 1
+    cache.put(keys[2], {"n": 2})
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {"n": 0}
+    assert cache.get(keys[2]) == {"n": 2}
+    assert cache.stats()["evictions"] == 2
+
+
+def test_deterministic_only_caches_only_reproducible_calls():
+    client = FakeChatClient()
+    cached = CachedClient(client, LLMResponseCache(), deterministic_only=True)
+    for _ in range(2):
+        cached.chat(model="m", messages=MESSAGES)
+    assert client.calls == 2
+    for _ in range(2):
+        cached.chat(model="m", messages=MESSAGES, options={"seed": 1})
+        cached.chat(model="m", messages=MESSAGES, options={"temperature": 0})
+    assert client.calls == 4
+
+
+def test_cache_hits_are_not_counted_as_llm_usage():
+    tracer.reset()
+    client = FakeChatClient()
+    generator = Generator(CachedClient(client, LLMResponseCache()), "m")
+    for _ in range(3):
+        generator.complete("同じプロンプト")
+
+    counters = {counter["name"]: counter["value"] for counter in tracer.snapshot()["counters"]}
+    usage = client.chat(model="m", messages=[{"role": "user", "content": "同じプロンプト"}])
+    assert counters["llm_calls"] == 1
+    assert counters["llm_cache_hits"] == 2
+    assert counters["llm_prompt_tokens"] == usage["prompt_eval_count"]
+    assert counters["llm_completion_tokens"] == usage["eval_count"]
+    tracer.reset()
@@ -0,0 +1,106 @@
+# tests/test_orchestrator.py
+import json
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import numpy as np
+import pytest
+
+from ace_framework.context_store import ContextStore
+from ace_framework.curator import Curator
+from ace_framework.generator import Generator
+from ace_framework.orchestrator import ACEOrchestrator
+from ace_framework.persistent_store import PersistentContextStore
+from ace_framework.reflector import Reflector
+from fakes import FakeChatClient, FakeEmbeddingModel
+
+DATASET = [{"query": f"質問{i}", "feedback": "正解"} for i in range(4)]
+
+
+def make_orchestrator(store, model):
+    client = FakeChatClient()
+    return ACEOrchestrator(Generator(client, "m"), Reflector(client, "m"), Curator(), store, model)
+
+
+def test_resume_restores_embeddings_and_usage_of_an_in_memory_store(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    model = FakeEmbeddingModel(dim=8)
+    store = ContextStore()
+    orchestrator = make_orchestrator(store, model)
+    orchestrator.run_offline_adaptation(DATASET, [{"content": "初期の教訓"}], epochs=1, batch_size=2)
+    item = store.context[0]
+    store.record_feedback([item], helpful=True)
+    store.record_hits([item])
+    orchestrator._save_checkpoint(checkpoint_path, 1, 0, len(DATASET))
+    expected = {entry["content"]: (store.usage(entry), store.get_embedding(entry)) for entry in store.context}
+
+    resumed_store = ContextStore()
+    resumed_model = FakeEmbeddingModel(dim=8)
+    context = make_orchestrator(resumed_store, resumed_model).run_offline_adaptation(
+        DATASET, [], epochs=1, batch_size=2, checkpoint_path=checkpoint_path
+    )
+
+    assert resumed_model.encoded == 0
+    assert resumed_store.cycle == store.cycle
+    assert {entry["content"] for entry in context} == set(expected)
+    for entry in context:
+        usage, embedding = expected[entry["content"]]
+        assert resumed_store.usage(entry) == usage
+        np.testing.assert_allclose(resumed_store.get_embedding(entry), embedding, rtol=1e-6)
+    assert not (tmp_path / "checkpoint.json").exists()
+
+
+def test_persistent_store_checkpoints_only_progress_and_resumes_in_place(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    model = FakeEmbeddingModel(dim=8)
+    store = PersistentContextStore(str(tmp_path / "store"))
+    orchestrator = make_orchestrator(store, model)
+    orchestrator.run_offline_adaptation(DATASET, [{"content": "初期の教訓"}], epochs=1, batch_size=2)
+    orchestrator._save_checkpoint(checkpoint_path, 1, 0, len(DATASET))
+    with open(checkpoint_path, encoding="utf-8") as f:
+        assert json.load(f) == {"epoch": 1, "next_index": 0, "samples": len(DATASET)}
+    slots = dict(store._slot_of_content)
+    store.record_hits([store.context[0]])
+    usage = store.usage(store.context[0])
+    store.close()
+
+    resumed_store = PersistentContextStore(str(tmp_path / "store"))
+    context = make_orchestrator(resumed_store, model).run_offline_adaptation(
+        DATASET, [{"content": "無視される初期値"}], epochs=1, batch_size=2, checkpoint_path=checkpoint_path
+    )
+
+    # 項目は消して追加し直されず、同じスロットに残る
+    assert resumed_store._slot_of_content == slots
+    assert resumed_store.usage(context[0]) == usage
+    resumed_store.close()
+
+
+def test_in_memory_store_rejects_a_checkpoint_without_context(tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text(json.dumps({"epoch": 0, "next_index": 2, "samples": len(DATASET)}), encoding="utf-8")
+    orchestrator = make_orchestrator(ContextStore(), FakeEmbeddingModel(dim=8))
+
+    with pytest.raises(ValueError):
+        orchestrator.run_offline_adaptation(DATASET, [], epochs=1, batch_size=2, checkpoint_path=str(checkpoint_path))
+
+
+def test_flush_timeout_bounds_the_total_wait():
+    orchestrator = make_orchestrator(ContextStore(), FakeEmbeddingModel(dim=8))
+    # 0.15秒おきに1つずつ完了する更新：1つずつtimeoutを待つと全体ではtimeoutを超えても完了してしまう
+    futures = [Future() for _ in range(5)]
+    timers = [threading.Timer(0.15 * (i + 1), future.set_result, (None,)) for i, future in enumerate(futures)]
+    orchestrator._pending = list(futures)
+    for timer in timers:
+        timer.start()
+    try:
+        started = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            orchestrator.flush(timeout=0.4)
+        assert time.perf_counter() - started < 0.6
+        assert 0 < orchestrator.pending_updates < 5
+    finally:
+        for timer in timers:
+            timer.join()
+    orchestrator.flush()
+    assert orchestrator.pending_updates == 0
@@ -0,0 +1,33 @@
+# tests/test_persistent_store.py
+import numpy as np
+import pytest
+
+from ace_framework.persistent_store import PersistentContextStore, StoreLockedError
+
+
+def test_second_writer_is_refused_but_readers_are_not(tmp_path):
+    writer = PersistentContextStore(str(tmp_path))
+    writer.add_bullets([{"content": "a", "metadata": {}, "embedding": np.ones(4)}])
+    try:
+        with pytest.raises(StoreLockedError):
+            PersistentContextStore(str(tmp_path))
+        reader = PersistentContextStore(str(tmp_path), readonly=True)
+        assert [item["content"] for item in reader.context] == ["a"]
+        reader.close()
+    finally:
+        writer.close()
+    PersistentContextStore(str(tmp_path)).close()
+
+
+def test_rows_flagged_embedded_without_a_vector_are_reembedded(tmp_path):
+    store = PersistentContextStore(str(tmp_path), initial_capacity=4)
+    store.add_bullets([{"content": f"c{i}", "metadata": {}, "embedding": np.full(4, i + 1.0)} for i in range(4)])
+    # 行列を拡張する前に中断し、埋め込み済みとして記録された行だけが残った状態
+    store._conn.execute("INSERT INTO bullets (slot, content, metadata, has_embedding) VALUES (4, 'c4', '{}', 1)")
+    store._conn.commit()
+    store.close()
+
+    reader = PersistentContextStore(str(tmp_path), readonly=True)
+    assert len(reader) == 5
+    assert len(reader.snapshot().search(np.ones(4), 5)) == 4
+    reader.close()
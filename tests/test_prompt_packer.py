@@ -0,0 +1,59 @@
+# tests/test_prompt_packer.py
+from ace_framework.prompt_packer import PromptPacker
+
+
+def build_prompt(evolutionary_context, external_context):
+    return f"指示\n{evolutionary_context}\n{external_context}\nクエリ"
+
+
+LESSON = "回答の前に引用した数値が文書と一致しているかを必ず確認する。"
+
+
+def test_bullet_survives_when_the_chunk_containing_it_is_over_budget():
+    chunk = "背景の説明。" * 40 + LESSON + "後続の説明。" * 40
+    packed = PromptPacker(max_tokens=120).pack(build_prompt, [{"content": LESSON}], [chunk])
+
+    assert [item["content"] for item in packed.bullets] == [LESSON]
+    assert packed.chunks == []
+    assert packed.dropped["duplicate_bullets"] == 0
+    assert packed.prompt_tokens <= 120
+
+
+def test_bullet_contained_in_a_selected_chunk_is_dropped():
+    chunk = "背景の説明。" + LESSON + "後続の説明。"
+    packed = PromptPacker(max_tokens=1000).pack(build_prompt, [{"content": LESSON}], [chunk])
+
+    assert packed.bullets == []
+    assert packed.chunks == [chunk]
+    assert packed.dropped["duplicate_bullets"] == 1
+    assert LESSON in packed.prompt
+
+
+def test_short_bullet_is_not_dropped_for_a_phrase_in_a_chunk():
+    packed = PromptPacker(max_tokens=1000).pack(build_prompt, [{"content": "出典を示す"}], ["回答には必ず出典を示すこと。"])
+
+    assert [item["content"] for item in packed.bullets] == ["出典を示す"]
+    assert packed.dropped["duplicate_bullets"] == 0
+
+
+def test_overlapping_chunks_are_trimmed():
+    shared = "これはチャンク同士で重なっている部分の文章です。" * 3
+    first, second = "前半の内容。" + shared, shared + "後半の内容。"
+    packed = PromptPacker(max_tokens=1000, min_overlap_chars=20).pack(build_prompt, [], [first, second])
+
+    assert packed.chunks == [first, "後半の内容。"]
+    assert packed.dropped["trimmed_chunks"] == 1
+
+
+def test_selection_respects_budget_and_evolutionary_share():
+    bullets = [{"content": f"教訓{i}：" + "あ" * 20} for i in range(10)]
+    chunks = ["い" * 50 for _ in range(10)]
+    packer = PromptPacker(max_tokens=200, evolutionary_share=0.5)
+    packed = packer.pack(build_prompt, bullets, [chunk + str(i) for i, chunk in enumerate(chunks)])
+
+    assert packed.prompt_tokens <= 200
+    assert 0 < packed.section_tokens["evolutionary"] <= 100
+    assert packed.bullets and packed.chunks
+    assert packed.dropped["over_budget"] == 20 - len(packed.bullets) - len(packed.chunks)
+    # 採用した項目は本文順に並ぶ
+    assert [item["content"] for item in packed.bullets] == sorted(item["content"] for item in packed.bullets)
@@ -0,0 +1,58 @@
+# tests/test_reflector.py
+import json
+
+from ace_framework.reflector import Reflector
+from ace_framework.tracing import tracer
+from fakes import FakeChatClient
+
+
+class InvalidFirstClient(FakeChatClient):
+    """最初のinvalid_calls回だけスキーマに合わないJSONを返し、受け取った会話を記録する。"""
+    def __init__(self, invalid_calls):
+        super().__init__()
+        self.invalid_calls = invalid_calls
+        self.requests = []
+
+    def _content(self, prompt, format):
+        if len(self.requests) <= self.invalid_calls:
+            return json.dumps({"critique": "検証が不足している。"}, ensure_ascii=False)
+        return super()._content(prompt, format)
+
+    def chat(self, model, messages, **kwargs):
+        self.requests.append(list(messages))
+        return super().chat(model, messages, **kwargs)
+
+
+def repairs():
+    counters = tracer.snapshot()["counters"]
+    return sum(counter["value"] for counter in counters if counter["name"] == "reflection_repairs")
+
+
+def test_invalid_output_is_repaired_in_the_same_conversation():
+    tracer.reset()
+    client = InvalidFirstClient(invalid_calls=1)
+    bullets = [{"content": "入力を検証する"}]
+    critique, insights, tags = Reflector(client, "m", single_pass=True, max_retries=2).reflect_and_distill("軌跡", "不正解", bullets)
+
+    assert len(client.requests) == 2
+    first, retry = client.requests
+    assert retry[0] == first[0]
+    assert retry[1] == {"role": "assistant", "content": json.dumps({"critique": "検証が不足している。"}, ensure_ascii=False)}
+    assert "検証に失敗しました" in retry[2]["content"]
+    assert critique and insights
+    assert tags == {"helpful": bullets, "harmful": []}
+    assert repairs() == 1
+    tracer.reset()
+
+
+def test_gives_up_without_insights_after_max_retries():
+    tracer.reset()
+    client = InvalidFirstClient(invalid_calls=10)
+    result = Reflector(client, "m", single_pass=True, max_retries=2).reflect_and_distill("軌跡", "不正解")
+
+    assert result == ("", [], {"helpful": [], "harmful": []})
+    assert len(client.requests) == 3
+    # 修正依頼は直前の不正な出力だけを含み、会話が伸び続けない
+    assert all(len(messages) == 3 for messages in client.requests[1:])
+    assert repairs() == 3
+    tracer.reset()